@@ -0,0 +1,155 @@
+"""
+Phân tích hàng loạt tin nhắn (import đơn từ file export Zalo / Facebook).
+
+Dùng chung cho route POST /chatbot/analyze/batch và CLI:
+
+    cd BE && python -m app.api.chatbot.batch messages.ndjson --concurrency 8 > results.ndjson
+
+Input là 1 JSON list hoặc NDJSON, mỗi phần tử là chuỗi tin nhắn hoặc {"message": "..."}.
+Output là NDJSON: mỗi tin nhắn 1 dòng {index, success, data} theo thứ tự xử lý xong,
+cuối cùng là 1 dòng tổng kết {done, total, saved, failed, ids}.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+from typing import Any, AsyncIterable, AsyncIterator, Dict, Iterable, Union
+
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+
+_DONE = object()
+
+
+def parse_ndjson_line(line: Union[str, bytes]) -> Any:
+    """
+    Parse 1 dòng NDJSON; dòng lỗi được trả về dưới dạng ValueError để báo lỗi riêng
+    cho phần tử đó thay vì dừng cả batch
+    """
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        return ValueError(f'Invalid NDJSON line: {e}')
+
+
+async def _aiter(items: Union[Iterable[Any], AsyncIterable[Any]]) -> AsyncIterator[Any]:
+    if hasattr(items, '__aiter__'):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+
+def _message_of(entry: Any) -> str:
+    if isinstance(entry, Exception):
+        raise entry
+    if isinstance(entry, dict):
+        entry = entry.get('message')
+    if not isinstance(entry, str) or not entry.strip():
+        raise ValueError('Each item must be a non-empty message string or {"message": "..."}')
+    return entry
+
+
+async def run_batch(service, entries: Union[Iterable[Any], AsyncIterable[Any]],
+                    concurrency: int = BATCH_CONCURRENCY) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Chạy analyze_message cho từng tin nhắn với tối đa `concurrency` lời gọi LLM song song,
+    trả về kết quả từng tin nhắn ngay khi xong. Các đơn phân tích thành công được lưu
+    trong 1 lần ghi duy nhất (id liên tiếp) sau khi cả batch chạy xong; tin nhắn lỗi
+    không làm dừng batch.
+    """
+    pending: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    results: asyncio.Queue = asyncio.Queue()
+
+    async def feed():
+        try:
+            index = 0
+            async for entry in _aiter(entries):
+                await pending.put((index, entry))
+                index += 1
+        finally:
+            for _ in range(concurrency):
+                await pending.put(_DONE)
+
+    async def worker():
+        try:
+            while True:
+                item = await pending.get()
+                if item is _DONE:
+                    break
+                index, entry = item
+                try:
+                    data = await service.analyze_message(_message_of(entry), user_id='batch')
+                except Exception as e:
+                    data = {'error': f'Failed to analyze message: {str(e)}'}
+                await results.put((index, data))
+        finally:
+            await results.put(_DONE)
+
+    tasks = [asyncio.create_task(feed())] + [asyncio.create_task(worker()) for _ in range(concurrency)]
+    analyzed: Dict[int, Dict[str, Any]] = {}
+    total = 0
+    running = concurrency
+    try:
+        while running:
+            item = await results.get()
+            if item is _DONE:
+                running -= 1
+                continue
+            index, data = item
+            total += 1
+            success = 'error' not in data
+            if success:
+                analyzed[index] = data
+            yield {'index': index, 'success': success, 'data': data}
+
+        # lỗi khi đọc input (vd. body bị ngắt) -> báo ở dòng tổng kết, vẫn lưu các đơn đã xong
+        await asyncio.wait([tasks[0]])
+        feed_error = tasks[0].exception()
+        indexes = sorted(analyzed)
+        ids = await service.save_orders_batch([analyzed[i] for i in indexes]) if indexes else []
+        summary = {
+            'done': True,
+            'total': total,
+            'saved': len(ids),
+            'failed': total - len(ids),
+            'ids': {str(index): order_id for index, order_id in zip(indexes, ids)}
+        }
+        if feed_error:
+            summary['error'] = f'Failed to read input: {str(feed_error)}'
+        yield summary
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def _read_entries(path: str) -> Iterable[Any]:
+    stream = sys.stdin if path == '-' else open(path, 'r', encoding='utf-8')
+    with stream:
+        text = stream.read()
+    if text.lstrip().startswith('['):
+        return json.loads(text)
+    return [parse_ndjson_line(line) for line in text.splitlines() if line.strip()]
+
+
+async def _main(args: argparse.Namespace) -> None:
+    from .services import AsyncChatbotService
+
+    service = AsyncChatbotService()
+    try:
+        async for result in run_batch(service, _read_entries(args.input), args.concurrency):
+            print(json.dumps(result, ensure_ascii=False), flush=True)
+    finally:
+        await service.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', help="file JSON list / NDJSON, '-' để đọc từ stdin")
+    parser.add_argument('--concurrency', type=int, default=BATCH_CONCURRENCY)
+    asyncio.run(_main(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+import copy
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+from app.utils.text import fold_text
+
+# Các field chỉ mang tính metadata, không ảnh hưởng tới kết quả trích xuất
+VOLATILE_FIELDS = ('timestamp', 'original_message')
+
+
+def normalize_message(message: str) -> str:
+    """
+    Bỏ dấu tiếng Việt, chữ thường, gom khoảng trắng: "  Xác   nhận " -> "xac nhan"
+    """
+    return fold_text(message)
+
+
+def order_fingerprint(order: Optional[Dict[str, Any]]) -> str:
+    """
+    Hash ổn định của snapshot đơn hàng (không phụ thuộc thứ tự key)
+    """
+    if not order:
+        return ''
+    snapshot = {k: v for k, v in order.items() if k not in VOLATILE_FIELDS}
+    raw = json.dumps(snapshot, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class ExtractionCache:
+    """
+    Cache kết quả trích xuất của LLM theo (tin nhắn đã chuẩn hoá, snapshot đơn hàng).
+
+    - Tầng bộ nhớ: LRU giới hạn max_size phần tử, mỗi phần tử có TTL
+    - Tầng đĩa (tuỳ chọn): file SQLite, giữ được qua các lần restart
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 3600, disk_path: Optional[str] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'disk_hits': 0, 'evictions': 0, 'expirations': 0}
+
+        self._db = None
+        if disk_path:
+            os.makedirs(os.path.dirname(os.path.abspath(disk_path)), exist_ok=True)
+            self._db = sqlite3.connect(disk_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS extraction_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.execute("DELETE FROM extraction_cache WHERE expires_at < ?", (time.time(),))
+            self._db.commit()
+
+    @staticmethod
+    def make_key(message: str, existing_order: Optional[Dict[str, Any]] = None) -> str:
+        raw = normalize_message(message) + '\x00' + order_fingerprint(existing_order)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                expires_at, value = entry
+                if expires_at >= now:
+                    self._entries.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return copy.deepcopy(value)
+                del self._entries[key]
+                self._stats['expirations'] += 1
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, expires_at FROM extraction_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row and row[1] >= now:
+                    value = json.loads(row[0])
+                    self._put_memory(key, row[1], value)
+                    self._stats['hits'] += 1
+                    self._stats['disk_hits'] += 1
+                    return copy.deepcopy(value)
+
+            self._stats['misses'] += 1
+            return None
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        value = {k: v for k, v in copy.deepcopy(value).items() if k not in VOLATILE_FIELDS}
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._put_memory(key, expires_at, value)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO extraction_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False), expires_at)
+                )
+                self._db.commit()
+
+    def _put_memory(self, key: str, expires_at: float, value: Dict[str, Any]) -> None:
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self._stats['evictions'] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['misses']
+            return {
+                **self._stats,
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hit_ratio': self._stats['hits'] / lookups if lookups else 0.0
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM extraction_cache")
+                self._db.commit()
@@ -0,0 +1,239 @@
+"""
+Danh mục bánh: đưa tên bánh khách gõ tự do về sản phẩm chuẩn (sku + tên chuẩn).
+
+Tên được bỏ dấu, thay từ đồng nghĩa ("socola" -> "chocolate"), bỏ từ thừa ("bánh",
+"sinh nhật") rồi tra theo thứ tự: khớp đúng khoá -> gần đúng bằng trigram ký tự
+(hệ số Dice, chỉ mục ngược dựng sẵn lúc load). Không đủ giống thì giữ nguyên tên và
+đánh dấu unmatched.
+
+    cd BE && python -m app.api.chatbot.catalog "banh kem socola" "bánh tiramisu"
+"""
+import argparse
+import hashlib
+import heapq
+import json
+import os
+import re
+from collections import Counter
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+from app.storage.base import DEFAULT_DATA_DIR
+from app.utils.text import fold_text
+
+# Danh mục đi kèm code (không nằm trong DATA_DIR), đổi được bằng CATALOG_PATH
+CATALOG_PATH = os.getenv("CATALOG_PATH") or os.path.join(DEFAULT_DATA_DIR, 'catalog.json')
+# Điểm Dice tối thiểu (0-1) để coi là cùng 1 sản phẩm
+CATALOG_MATCH_THRESHOLD = float(os.getenv("CATALOG_MATCH_THRESHOLD", "0.6"))
+# Sản phẩm thứ 2 kém điểm hơn không quá mức này thì coi là mơ hồ ("bánh kem" -> su kem? kem bắp?)
+CATALOG_AMBIGUITY_MARGIN = float(os.getenv("CATALOG_AMBIGUITY_MARGIN", "0.1"))
+# Số tên đã tra được nhớ lại (tên bánh lặp lại rất nhiều giữa các đơn)
+CATALOG_CACHE_SIZE = int(os.getenv("CATALOG_CACHE_SIZE", "10000"))
+
+# Số ứng viên (nhiều trigram chung nhất) được tính điểm Dice đầy đủ
+FUZZY_CANDIDATES = 64
+# Tổng độ dài posting tối đa được đếm khi chọn ứng viên (luôn đếm ít nhất 2 trigram hiếm nhất)
+FUZZY_POSTINGS_BUDGET = 2000
+
+
+def trigrams(key: str) -> frozenset:
+    padded = f' {key} '
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def _phrase_re(phrases: Iterable[str]) -> Optional[re.Pattern]:
+    # cụm dài trước để "so co la" không bị "co" cắt mất
+    phrases = sorted({fold_text(p) for p in phrases if p.strip()}, key=len, reverse=True)
+    if not phrases:
+        return None
+    return re.compile(r'\b(?:' + '|'.join(re.escape(p) for p in phrases) + r')\b')
+
+
+class Catalog:
+    """
+    Danh sách sản phẩm {sku, ten_banh, aliases} cùng chỉ mục:
+    - _exact: khoá chuẩn hoá của tên / alias -> vị trí sản phẩm
+    - _postings: trigram -> danh sách khoá chứa trigram đó (để chọn ứng viên gần đúng)
+    """
+
+    def __init__(self, products: List[Dict[str, Any]], synonyms: Optional[Dict[str, str]] = None,
+                 stopwords: Iterable[str] = (), threshold: float = CATALOG_MATCH_THRESHOLD,
+                 cache_size: int = CATALOG_CACHE_SIZE):
+        self.products = products
+        self.threshold = threshold
+        stopwords = list(stopwords)
+        # đổi khi danh mục đổi, để biết dữ liệu đã gộp theo danh mục (thống kê) có còn đúng
+        self.fingerprint = hashlib.blake2b(
+            json.dumps([products, synonyms or {}, sorted(stopwords)], ensure_ascii=False, sort_keys=True).encode('utf-8'),
+            digest_size=8
+        ).hexdigest()
+        self.cache_size = cache_size
+        self._synonyms = {fold_text(k): fold_text(v) for k, v in (synonyms or {}).items()}
+        self._synonym_re = _phrase_re(self._synonyms)
+        self._stopword_re = _phrase_re(stopwords)
+        self._by_sku = {product['sku']: product for product in products}
+
+        self._exact: Dict[str, int] = {}
+        self._keys: List[Tuple[int, frozenset]] = []
+        self._postings: Dict[str, List[int]] = {}
+        for position, product in enumerate(products):
+            for name in [product['ten_banh'], *product.get('aliases', ())]:
+                key = self.normalize_key(name)
+                if not key or key in self._exact:
+                    continue
+                self._exact[key] = position
+                grams = trigrams(key)
+                for gram in grams:
+                    self._postings.setdefault(gram, []).append(len(self._keys))
+                self._keys.append((position, grams))
+
+        # tên thô đã fold -> (sản phẩm, điểm) hoặc None
+        self._cache: Dict[str, Optional[Tuple[Dict[str, Any], float]]] = {}
+        self.counters = {'exact': 0, 'fuzzy': 0, 'unmatched': 0, 'cache_hits': 0}
+
+    def __len__(self) -> int:
+        return len(self.products)
+
+    def normalize_key(self, name: str) -> str:
+        key = fold_text(name)
+        if self._synonym_re:
+            key = self._synonym_re.sub(lambda m: self._synonyms[m.group()], key)
+        if self._stopword_re:
+            key = self._stopword_re.sub(' ', key)
+        return ' '.join(key.split())
+
+    def resolve(self, name: str) -> Optional[Tuple[Dict[str, Any], float]]:
+        """
+        (sản phẩm, điểm 0-1) của tên bánh, None nếu không có sản phẩm đủ giống
+        """
+        raw = fold_text(name or '')
+        if raw in self._cache:
+            self.counters['cache_hits'] += 1
+            return self._cache[raw]
+
+        key = self.normalize_key(raw)
+        match = None
+        if key in self._exact:
+            match = (self.products[self._exact[key]], 1.0)
+            self.counters['exact'] += 1
+        elif key:
+            match = self._fuzzy(key)
+            self.counters['fuzzy' if match else 'unmatched'] += 1
+        else:
+            self.counters['unmatched'] += 1
+
+        if self.cache_size > 0:
+            if len(self._cache) >= self.cache_size:
+                # bỏ phần tử cũ nhất (dict giữ thứ tự thêm vào)
+                del self._cache[next(iter(self._cache))]
+            self._cache[raw] = match
+        return match
+
+    def _fuzzy(self, key: str) -> Optional[Tuple[Dict[str, Any], float]]:
+        grams = trigrams(key)
+        # chỉ đếm trên các trigram hiếm (posting ngắn): trigram có ở hầu hết sản phẩm
+        # ("kem", " ch"...) tốn thời gian mà không giúp chọn ứng viên
+        postings = sorted((self._postings[gram] for gram in grams if gram in self._postings), key=len)
+        if not postings:
+            return None
+        shared = Counter()
+        budget = FUZZY_POSTINGS_BUDGET
+        for number, entries in enumerate(postings):
+            if number >= 2 and len(entries) > budget:
+                break
+            shared.update(entries)
+            budget -= len(entries)
+
+        scores: Dict[int, float] = {}
+        size = len(grams)
+        for entry, _ in heapq.nlargest(FUZZY_CANDIDATES, shared.items(), key=lambda item: item[1]):
+            position, entry_grams = self._keys[entry]
+            score = 2 * len(grams & entry_grams) / (size + len(entry_grams))
+            if score > scores.get(position, 0.0):
+                scores[position] = score
+        ranked = heapq.nlargest(2, scores.items(), key=lambda item: item[1])
+        best, best_score = ranked[0]
+        if best_score < self.threshold:
+            return None
+        if len(ranked) > 1 and best_score - ranked[1][1] < CATALOG_AMBIGUITY_MARGIN:
+            return None
+        return self.products[best], best_score
+
+    def normalize_cakes(self, cakes: Optional[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """
+        Đưa danh sách bánh về tên chuẩn + sku, gộp các dòng trùng sản phẩm (cộng số lượng).
+        Tên không tra được giữ nguyên và có 'unmatched': True.
+        """
+        if not cakes or not self.products:
+            return cakes or []
+        merged: Dict[str, Dict[str, Any]] = {}
+        for cake in cakes:
+            if not isinstance(cake, dict) or not (cake.get('ten_banh') or '').strip():
+                continue
+            item = self.normalize_cake(cake)
+            key = self.cake_key(item)
+            if key in merged:
+                # 1 dòng chưa rõ số lượng (output bị cắt) thì tổng cũng chưa rõ
+                quantities = (merged[key].get('so_luong'), item.get('so_luong'))
+                merged[key]['so_luong'] = None if None in quantities else sum(quantities)
+            else:
+                merged[key] = item
+        return list(merged.values())
+
+    def normalize_cake(self, cake: Dict[str, Any]) -> Dict[str, Any]:
+        product = self._by_sku.get(cake.get('sku'))
+        if product is None:
+            match = self.resolve(cake['ten_banh'])
+            product = match[0] if match else None
+        item = {k: v for k, v in cake.items() if k not in ('sku', 'unmatched')}
+        if product is None:
+            item['ten_banh'] = cake['ten_banh'].strip()
+            item['unmatched'] = True
+        else:
+            item['ten_banh'] = product['ten_banh']
+            item['sku'] = product['sku']
+        return item
+
+    def cake_key(self, cake: Dict[str, Any]) -> str:
+        """
+        Khoá để gộp dòng bánh: sku nếu đã tra được, không thì tên đã fold
+        """
+        return cake.get('sku') or fold_text(cake.get('ten_banh') or '')
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counters, 'products': len(self.products), 'keys': len(self._keys),
+                'cached': len(self._cache)}
+
+    @classmethod
+    def load(cls, path: Optional[str] = None, **kwargs) -> 'Catalog':
+        """
+        Đọc danh mục từ file JSON {products, synonyms, stopwords}; lỗi / không có file
+        thì trả danh mục rỗng (tên bánh giữ nguyên như trước)
+        """
+        path = path or CATALOG_PATH
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return cls(data.get('products', []), data.get('synonyms'), data.get('stopwords', ()), **kwargs)
+        except FileNotFoundError:
+            return cls([], **kwargs)
+        except Exception as e:
+            print(f"Error loading catalog {path}: {str(e)}")
+            return cls([], **kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('names', nargs='+')
+    parser.add_argument('--path', help="file danh mục (mặc định CATALOG_PATH)")
+    args = parser.parse_args()
+
+    catalog = Catalog.load(args.path)
+    for name in args.names:
+        match = catalog.resolve(name)
+        if match:
+            print(f"{name} -> {match[0]['sku']} {match[0]['ten_banh']} ({match[1]:.2f})")
+        else:
+            print(f"{name} -> unmatched")
+
+
+if __name__ == '__main__':
+    main()
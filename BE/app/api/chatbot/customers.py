@@ -0,0 +1,65 @@
+"""
+Tra cứu khách quen theo số điện thoại: số điện thoại đã chuẩn hoá -> tên, địa chỉ
+của đơn xác nhận gần nhất. Dựng 1 lần từ kho data_final, sau đó cập nhật theo
+từng đơn được lưu nên mỗi lần tra chỉ là 1 lần đọc dict.
+"""
+import re
+from typing import Dict, Any, Iterable, Optional
+
+# các field được điền sẵn từ đơn gần nhất của khách
+PREFILL_FIELDS = ('ten_khach_hang', 'dia_chi')
+
+
+def normalize_phone(value: Any) -> Optional[str]:
+    """
+    "+84 901-234-567", "0901.234.567", "84901234567" -> "0901234567".
+    None nếu không phải số điện thoại (10-11 chữ số sau khi chuẩn hoá)
+    """
+    if not isinstance(value, str):
+        return None
+    digits = re.sub(r'\D', '', value)
+    if digits.startswith('84') and len(digits) in (11, 12):
+        digits = '0' + digits[2:]
+    elif not digits.startswith('0') and len(digits) in (9, 10):
+        digits = '0' + digits
+    return digits if len(digits) in (10, 11) else None
+
+
+class CustomerIndex:
+    """
+    Số điện thoại -> {ten_khach_hang, dia_chi, order_id, confirmed_at} của đơn mới nhất.
+    Field trống ở đơn mới hơn không đè lên giá trị đã biết từ đơn cũ.
+    """
+
+    def __init__(self):
+        self.customers: Dict[str, Dict[str, Any]] = {}
+        # số đơn đã đưa vào index, để biết còn khớp với kho hay không
+        self.orders = 0
+
+    def add(self, order: Dict[str, Any]) -> None:
+        self.orders += 1
+        phone = normalize_phone(order.get('so_dien_thoai'))
+        if not phone:
+            return
+        entry = self.customers.setdefault(phone, {})
+        for field in PREFILL_FIELDS:
+            value = order.get(field)
+            if isinstance(value, str) and value.strip():
+                entry[field] = value.strip()
+        entry['order_id'] = order.get('id')
+        entry['confirmed_at'] = order.get('confirmed_at')
+
+    def get(self, phone: Any) -> Optional[Dict[str, Any]]:
+        phone = normalize_phone(phone)
+        return self.customers.get(phone) if phone else None
+
+    def __len__(self) -> int:
+        return len(self.customers)
+
+    @classmethod
+    def build(cls, finals: Iterable[Dict[str, Any]]) -> 'CustomerIndex':
+        # kho trả đơn theo id tăng dần nên đơn sau cùng là đơn mới nhất
+        index = cls()
+        for order in finals:
+            index.add(order)
+        return index
@@ -0,0 +1,150 @@
+"""
+Xuất đơn đã xác nhận ra CSV / NDJSON theo từng trang của kho (không dựng cả file trong
+bộ nhớ): mỗi dòng bánh trong danh_sach_banh là 1 dòng, các cột của đơn lặp lại.
+
+    cd BE && python -m app.api.chatbot.export --format csv --status confirmed > orders.csv
+    cd BE && python -m app.api.chatbot.export --format ndjson --gzip > orders.ndjson.gz
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import zlib
+from typing import Dict, Any, Iterable, Iterator, List, Optional
+from app.storage.base import OrderRepository
+from .catalog import Catalog
+
+# Số đơn đọc từ kho mỗi lần (mỗi lần giữ lock của kho 1 lúc ngắn)
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "500"))
+
+# (field, tiêu đề cột CSV)
+EXPORT_COLUMNS = [
+    ('id', 'Mã đơn'),
+    ('confirmed_at', 'Xác nhận lúc'),
+    ('status', 'Trạng thái'),
+    ('ten_khach_hang', 'Tên khách hàng'),
+    ('so_dien_thoai', 'Số điện thoại'),
+    ('dia_chi', 'Địa chỉ'),
+    ('gio_giao', 'Giờ giao'),
+    ('ghi_chu', 'Ghi chú'),
+    ('ten_banh', 'Loại bánh'),
+    ('sku', 'Mã bánh'),
+    ('so_luong', 'Số lượng'),
+]
+CAKE_FIELDS = ('ten_banh', 'sku', 'so_luong')
+
+MEDIA_TYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+
+def flatten_order(order: Dict[str, Any], catalog: Optional[Catalog] = None) -> Iterator[Dict[str, Any]]:
+    """
+    1 dòng cho mỗi bánh trong đơn (đơn không có bánh vẫn ra 1 dòng, cột bánh để trống).
+    Có catalog thì tên bánh của đơn cũ cũng được đưa về tên chuẩn + sku như đơn mới.
+    """
+    base = {field: order.get(field) for field, _ in EXPORT_COLUMNS if field not in CAKE_FIELDS}
+    base['status'] = base['status'] or 'confirmed'
+    cakes = [cake for cake in order.get('danh_sach_banh') or [] if isinstance(cake, dict)]
+    if catalog is not None:
+        cakes = catalog.normalize_cakes(cakes)
+    for cake in cakes or [{}]:
+        yield {**base, **{field: cake.get(field) for field in CAKE_FIELDS}}
+
+
+class ExportEncoder:
+    """
+    Mã hoá từng lô đơn thành bytes (CSV có BOM để Excel đọc đúng tiếng Việt, hoặc NDJSON),
+    nén gzip dần theo từng lô nếu bật
+    """
+
+    def __init__(self, fmt: str = 'csv', gzip: bool = False, catalog: Optional[Catalog] = None):
+        if fmt not in MEDIA_TYPES:
+            raise ValueError(f'Unsupported export format: {fmt}')
+        self.fmt = fmt
+        self.catalog = catalog
+        self.rows = 0
+        self._compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None
+
+    @property
+    def media_type(self) -> str:
+        return 'application/gzip' if self._compressor else MEDIA_TYPES[self.fmt]
+
+    def filename(self, stem: str) -> str:
+        return f"{stem}.{self.fmt}" + ('.gz' if self._compressor else '')
+
+    def start(self) -> bytes:
+        if self.fmt != 'csv':
+            return b''
+        return self._output('\ufeff' + self._csv_text([[title for _, title in EXPORT_COLUMNS]]))
+
+    def encode(self, orders: Iterable[Dict[str, Any]]) -> bytes:
+        rows = [row for order in orders for row in flatten_order(order, self.catalog)]
+        self.rows += len(rows)
+        if self.fmt == 'csv':
+            text = self._csv_text([['' if row[field] is None else row[field] for field, _ in EXPORT_COLUMNS]
+                                   for row in rows])
+        else:
+            text = ''.join(json.dumps(row, ensure_ascii=False) + '\n' for row in rows)
+        return self._output(text)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush() if self._compressor else b''
+
+    def _output(self, text: str) -> bytes:
+        data = text.encode('utf-8')
+        return self._compressor.compress(data) if self._compressor else data
+
+    @staticmethod
+    def _csv_text(rows: List[List[Any]]) -> str:
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator='\r\n').writerows(rows)
+        return buffer.getvalue()
+
+
+def iter_order_pages(store: OrderRepository, batch_size: int = EXPORT_BATCH_SIZE, descending: bool = False,
+                     **filters) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Các lô đơn theo confirmed_at, đi bằng cursor của store.page (lọc status / date_from / date_to / q)
+    """
+    cursor = None
+    while True:
+        page = store.page('confirmed_at', descending=descending, limit=batch_size, cursor=cursor, **filters)
+        if page['items']:
+            yield page['items']
+        cursor = page['next_cursor']
+        if not cursor:
+            return
+
+
+def main():
+    from app.storage.factory import get_backend
+    from .order_store import FINAL_ORDER_INDEXES
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--format', choices=sorted(MEDIA_TYPES), default='csv')
+    parser.add_argument('--gzip', action='store_true')
+    parser.add_argument('--status')
+    parser.add_argument('--date-from')
+    parser.add_argument('--date-to')
+    parser.add_argument('--q')
+    args = parser.parse_args()
+
+    backend = get_backend()
+    encoder = ExportEncoder(args.format, args.gzip, Catalog.load())
+    out = sys.stdout.buffer
+    try:
+        final_store = backend.orders('data_final', indexes=FINAL_ORDER_INDEXES)
+        out.write(encoder.start())
+        for orders in iter_order_pages(final_store, status=args.status, date_from=args.date_from,
+                                       date_to=args.date_to, q=args.q):
+            out.write(encoder.encode(orders))
+        out.write(encoder.finish())
+        out.flush()
+    finally:
+        backend.close()
+    print(f"{encoder.rows} dòng", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
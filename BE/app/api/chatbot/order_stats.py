@@ -0,0 +1,212 @@
+"""
+Thống kê đơn hàng tính dần theo từng lần ghi (không quét lại kho khi đọc).
+
+Dựng lại từ đầu (ví dụ sau khi sửa tay file dữ liệu):
+
+    cd BE && python -m app.api.chatbot.order_stats --rebuild
+"""
+import argparse
+import json
+import os
+import re
+from collections import Counter
+from datetime import date, datetime, timedelta
+from typing import Dict, Any, Iterable, List, Optional
+from app.storage.base import OrderRepository, data_path
+from .catalog import Catalog
+from .order_store import order_status, FINAL_ORDER_INDEXES
+
+STATS_FILE = 'order_stats.json'
+UNKNOWN_HOUR = 'unknown'
+
+_HOUR_RE = re.compile(r'^\s*(\d{1,2})(?:\s*[:hg]|\s*$)')
+
+
+def delivery_hour(gio_giao: Any) -> str:
+    """
+    Giờ (00-23) của giờ giao dạng "HH:MM" / "14h30", 'unknown' nếu không đọc được
+    """
+    match = _HOUR_RE.match(gio_giao) if isinstance(gio_giao, str) else None
+    if match and int(match.group(1)) < 24:
+        return f'{int(match.group(1)):02d}'
+    return UNKNOWN_HOUR
+
+
+class OrderStats:
+    """
+    Các bộ đếm của kho đơn đã xác nhận (theo status, loại bánh, giờ / ngày xác nhận,
+    giờ giao) và số đơn nháp. add_final / remove_final cập nhật theo từng đơn nên
+    snapshot() không phụ thuộc số đơn trong kho.
+
+    watermark là (số đơn, id kế tiếp) của 2 kho lúc bộ đếm còn khớp, dùng để biết
+    file thống kê đã lưu có còn đúng với kho khi mở lại hay không.
+
+    Bánh được gộp theo sản phẩm trong danh mục (sku), kể cả đơn cũ lưu từ trước khi
+    có danh mục, nên dựng lại thì các cách gõ khác nhau của cùng 1 loại bánh thành 1 dòng.
+    """
+
+    def __init__(self, catalog: Optional[Catalog] = None):
+        self.catalog = catalog or Catalog([])
+        self.finals = 0
+        self.drafts = 0
+        self.quantity = 0
+        self.by_status: Counter = Counter()
+        # catalog.cake_key (sku, hoặc tên đã fold nếu không có trong danh mục)
+        # -> [tên hiển thị, số lượng bánh, số đơn]
+        self.cakes: Dict[str, List[Any]] = {}
+        self.by_hour: Counter = Counter()
+        self.by_day: Counter = Counter()
+        self.delivery_hours: Counter = Counter()
+
+    def add_final(self, order: Dict[str, Any], sign: int = 1) -> None:
+        self.finals += sign
+        self.by_status[order_status(order)] += sign
+        confirmed_at = order.get('confirmed_at') or ''
+        if len(confirmed_at) >= 13:
+            self.by_day[confirmed_at[:10]] += sign
+            self.by_hour[confirmed_at[11:13]] += sign
+        self.delivery_hours[delivery_hour(order.get('gio_giao'))] += sign
+
+        counted = set()
+        for cake in order.get('danh_sach_banh') or []:
+            name = (cake.get('ten_banh') or '').strip() if isinstance(cake, dict) else ''
+            if not name:
+                continue
+            quantity = cake.get('so_luong') if isinstance(cake.get('so_luong'), int) else 1
+            cake = self.catalog.normalize_cake(cake)
+            key = self.catalog.cake_key(cake)
+            entry = self.cakes.setdefault(key, [cake['ten_banh'], 0, 0])
+            entry[1] += sign * quantity
+            if key not in counted:
+                entry[2] += sign
+                counted.add(key)
+            self.quantity += sign * quantity
+        for key in counted:
+            if self.cakes[key][2] <= 0:
+                del self.cakes[key]
+
+    def remove_final(self, order: Dict[str, Any]) -> None:
+        self.add_final(order, sign=-1)
+
+    def add_drafts(self, count: int = 1) -> None:
+        self.drafts += count
+
+    def clear_drafts(self) -> None:
+        self.drafts = 0
+
+    def snapshot(self, top: int = 10, days: int = 30, today: Optional[date] = None) -> Dict[str, Any]:
+        today = today or date.today()
+        top_cakes = sorted(self.cakes.values(), key=lambda entry: (-entry[1], entry[0]))[:top]
+        return {
+            'total_orders': self.finals,
+            'status_counts': {status: count for status, count in self.by_status.items() if count},
+            'total_quantity': self.quantity,
+            'draft_orders': self.drafts,
+            'top_cakes': [{'ten_banh': name, 'so_luong': quantity, 'orders': orders}
+                          for name, quantity, orders in top_cakes],
+            'orders_per_hour': {f'{hour:02d}': self.by_hour.get(f'{hour:02d}', 0) for hour in range(24)},
+            'orders_per_day': {day: self.by_day.get(day, 0) for day in
+                               ((today - timedelta(days=n)).isoformat() for n in range(days - 1, -1, -1))},
+            'delivery_hours': {hour: count for hour, count in sorted(self.delivery_hours.items()) if count},
+        }
+
+    @classmethod
+    def build(cls, finals: Iterable[Dict[str, Any]], drafts: int,
+              catalog: Optional[Catalog] = None) -> 'OrderStats':
+        stats = cls(catalog)
+        for order in finals:
+            stats.add_final(order)
+        stats.drafts = drafts
+        return stats
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'finals': self.finals, 'drafts': self.drafts, 'quantity': self.quantity,
+            'by_status': dict(+self.by_status), 'cakes': self.cakes, 'by_hour': dict(+self.by_hour),
+            'by_day': dict(+self.by_day), 'delivery_hours': dict(+self.delivery_hours),
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], catalog: Optional[Catalog] = None) -> 'OrderStats':
+        stats = cls(catalog)
+        stats.finals = data['finals']
+        stats.drafts = data['drafts']
+        stats.quantity = data['quantity']
+        stats.by_status = Counter(data['by_status'])
+        stats.cakes = {key: list(entry) for key, entry in data['cakes'].items()}
+        stats.by_hour = Counter(data['by_hour'])
+        stats.by_day = Counter(data['by_day'])
+        stats.delivery_hours = Counter(data['delivery_hours'])
+        return stats
+
+
+def store_watermark(final_store: OrderRepository, draft_store: OrderRepository) -> List[int]:
+    return [len(final_store), final_store.next_id, len(draft_store), draft_store.next_id]
+
+
+def rebuild_stats(final_store: OrderRepository, draft_store: OrderRepository,
+                  catalog: Optional[Catalog] = None) -> OrderStats:
+    return OrderStats.build(final_store.all(), len(draft_store), catalog)
+
+
+def load_stats(final_store: OrderRepository, draft_store: OrderRepository,
+               catalog: Optional[Catalog] = None, path: Optional[str] = None) -> OrderStats:
+    """
+    Đọc thống kê đã lưu nếu còn khớp với kho và danh mục, không thì dựng lại bằng 1 lần quét
+    """
+    catalog = catalog or Catalog([])
+    path = path or data_path(STATS_FILE)
+    try:
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if (data.get('watermark') == store_watermark(final_store, draft_store)
+                    and data.get('catalog') == catalog.fingerprint):
+                return OrderStats.from_dict(data['stats'], catalog)
+    except Exception as e:
+        print(f"Error loading order stats: {str(e)}")
+    stats = rebuild_stats(final_store, draft_store, catalog)
+    save_stats(stats, final_store, draft_store, path)
+    return stats
+
+
+def save_stats(stats: OrderStats, final_store: OrderRepository, draft_store: OrderRepository,
+               path: Optional[str] = None) -> None:
+    path = path or data_path(STATS_FILE)
+    try:
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'watermark': store_watermark(final_store, draft_store),
+                       'catalog': stats.catalog.fingerprint, 'stats': stats.to_dict(),
+                       'saved_at': datetime.now().isoformat()}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        print(f"Error saving order stats: {str(e)}")
+
+
+def main():
+    from app.storage.factory import get_backend
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rebuild', action='store_true', help="quét lại kho và ghi đè file thống kê")
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--days', type=int, default=30)
+    args = parser.parse_args()
+
+    backend = get_backend()
+    try:
+        final_store = backend.orders('data_final', indexes=FINAL_ORDER_INDEXES)
+        draft_store = backend.orders('order_info')
+        catalog = Catalog.load()
+        if args.rebuild:
+            stats = rebuild_stats(final_store, draft_store, catalog)
+            save_stats(stats, final_store, draft_store)
+        else:
+            stats = load_stats(final_store, draft_store, catalog)
+        print(json.dumps(stats.snapshot(args.top, args.days), ensure_ascii=False, indent=2))
+    finally:
+        backend.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,449 @@
+import base64
+import copy
+import json
+import os
+import secrets
+from bisect import bisect_left, bisect_right, insort
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Iterable, Callable, Tuple, Iterator
+from app.utils.text import fold_text
+from app.storage.base import OrderRepository, append_bytes, truncate_file
+from app.storage.file_lock import FileLock
+from app.utils.metrics import count_bytes
+
+# Compact log khi số bản ghi trong log vượt quá COMPACT_RATIO lần số đơn còn sống
+COMPACT_RATIO = 2.0
+COMPACT_MIN_RECORDS = 1000
+
+
+def order_status(order: Dict[str, Any]) -> str:
+    return order.get('status') or 'pending'
+
+
+class SortedIndex:
+    """
+    Thứ tự sắp xếp tính sẵn của các đơn theo 1 khoá: danh sách (khoá, id) đã sort,
+    có thêm 1 danh sách riêng cho từng status để lọc theo status không phải duyệt hết.
+    """
+
+    def __init__(self, key_func: Callable[[Dict[str, Any]], Any]):
+        self.key_func = key_func
+        self._all: List[Tuple[Any, int]] = []
+        self._by_status: Dict[str, List[Tuple[Any, int]]] = {}
+        self._current: Dict[int, Tuple[Tuple[Any, int], str]] = {}
+
+    def add(self, order: Dict[str, Any]) -> None:
+        self.remove(order['id'])
+        entry = (self.key_func(order), order['id'])
+        status = order_status(order)
+        insort(self._all, entry)
+        insort(self._by_status.setdefault(status, []), entry)
+        self._current[order['id']] = (entry, status)
+
+    def remove(self, order_id: int) -> None:
+        current = self._current.pop(order_id, None)
+        if not current:
+            return
+        entry, status = current
+        for entries in (self._all, self._by_status[status]):
+            position = bisect_left(entries, entry)
+            if position < len(entries) and entries[position] == entry:
+                del entries[position]
+
+    def clear(self) -> None:
+        self._all.clear()
+        self._by_status.clear()
+        self._current.clear()
+
+    def entries(self, status: Optional[str] = None) -> List[Tuple[Any, int]]:
+        if status is None:
+            return self._all
+        return self._by_status.get(status, [])
+
+    def counts(self) -> Dict[str, int]:
+        return {status: len(entries) for status, entries in self._by_status.items()}
+
+
+def encode_cursor(entry: Tuple[Any, int]) -> str:
+    raw = json.dumps(list(entry), ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[Any, int]:
+    try:
+        key, order_id = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode('utf-8'))
+        return key, int(order_id)
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+
+def order_search_text(order: Dict[str, Any]) -> str:
+    """
+    Chuỗi đã bỏ dấu gồm tên khách, số điện thoại và tên bánh, dùng cho lọc theo từ khoá
+    """
+    cakes = [b.get('ten_banh', '') if isinstance(b, dict) else str(b) for b in order.get('danh_sach_banh') or []]
+    return fold_text(' '.join([order.get('ten_khach_hang') or '', order.get('so_dien_thoai') or '', ' '.join(cakes)]))
+
+
+def order_matches_text(order: Dict[str, Any], needle: str) -> bool:
+    return needle in order_search_text(order)
+
+
+# Các khoá sắp xếp dùng cho phân trang đơn đã xác nhận
+FINAL_ORDER_INDEXES = {
+    'confirmed_at': lambda order: order.get('confirmed_at') or '',
+    'name': lambda order: fold_text(order.get('ten_khach_hang') or ''),
+}
+
+
+class OrderStore(OrderRepository):
+    """
+    Kho đơn hàng với index id -> order trong bộ nhớ.
+
+    Trên đĩa là 1 log JSONL append-only, mỗi dòng là 1 thao tác:
+        {"op": "seq", "next_id": N}     bộ đếm id (monotonic, không bị reset khi clear)
+        {"op": "put", "order": {...}}   thêm / cập nhật 1 đơn
+        {"op": "del", "id": N}          xoá 1 đơn
+        {"op": "clear"}                 xoá tất cả đơn
+    Mỗi thao tác chỉ ghi thêm 1 dòng thay vì ghi lại toàn bộ file; log được compact
+    (ghi file tạm rồi rename) khi có quá nhiều bản ghi cũ.
+
+    Ở chế độ write_behind, các dòng mới chỉ được áp vào bộ nhớ và giữ trong bộ đệm,
+    sync() ghi cả nhóm bằng 1 lần write (group commit).
+
+    shared=True: nhiều process cùng dùng 1 log. Mỗi thao tác giữ flock trên <log>.lock
+    (ghi: exclusive, đọc: shared) và đọc bù các dòng process khác đã ghi thêm (hoặc
+    đọc lại cả file nếu process khác đã compact) trước khi cấp id / đọc dữ liệu.
+    """
+
+    def __init__(self, log_path: str, legacy_file: Optional[str] = None,
+                 indexes: Optional[Dict[str, Callable[[Dict[str, Any]], Any]]] = None, shared: bool = False):
+        self.log_path = log_path
+        self.legacy_file = legacy_file
+        self._indexes = {name: SortedIndex(key_func) for name, key_func in (indexes or {}).items()}
+
+        self._orders: Dict[int, Dict[str, Any]] = {}
+        self._next_id = 1
+        self._log_records = 0
+        self._fh = None
+        self._pending: List[bytes] = []
+        # tăng mỗi khi dữ liệu trong bộ nhớ đổi (ghi hoặc đọc bù), epoch khác nhau mỗi lần mở
+        self._version = 0
+        self._epoch = secrets.token_hex(4)
+        # số byte / inode của log đã đọc vào bộ nhớ, để biết process khác đã ghi thêm / compact
+        self._log_size = 0
+        self._log_inode = None
+        # sync() có thể chạy ở thread khác trong lúc request khác đang ghi
+        self._lock = FileLock(log_path + '.lock' if shared else None)
+        # nhãn 'store' của metrics số byte đọc / ghi: order_info, data_final
+        self._metrics_store = os.path.splitext(os.path.basename(log_path))[0]
+
+    # ------------------------------------------------------------------
+    # Khởi tạo
+    # ------------------------------------------------------------------
+    def open(self) -> None:
+        directory = os.path.dirname(os.path.abspath(self.log_path))
+        os.makedirs(directory, exist_ok=True)
+
+        with self._lock.hold():
+            if os.path.exists(self.log_path):
+                self._replay()
+            elif self.legacy_file and os.path.exists(self.legacy_file) and os.path.getsize(self.legacy_file) > 0:
+                # Lần chạy đầu tiên: import từ file JSON cũ
+                with open(self.legacy_file, 'r', encoding='utf-8') as f:
+                    for order in json.load(f):
+                        self._apply({'op': 'put', 'order': order})
+                self.compact()
+
+            self._open_writer()
+
+    def _open_writer(self) -> None:
+        self._fh = open(self.log_path, 'ab')
+        stat = os.fstat(self._fh.fileno())
+        self._log_inode = stat.st_ino
+        self._log_size = stat.st_size
+
+    def close(self) -> None:
+        with self._lock.hold():
+            if self._fh:
+                self._write_pending()
+                self._fh.close()
+                self._fh = None
+        self._lock.close()
+
+    @contextmanager
+    def _locked(self, exclusive: bool = True) -> Iterator[None]:
+        with self._lock.hold(exclusive) as outermost:
+            if outermost and self._lock.shared and self._fh is not None:
+                self._catch_up()
+            yield
+
+    def _catch_up(self) -> None:
+        stat = os.stat(self.log_path)
+        if stat.st_ino != self._log_inode:
+            # process khác đã compact (file mới): đọc lại từ đầu, bộ đếm id chỉ tăng
+            self._orders.clear()
+            for index in self._indexes.values():
+                index.clear()
+            self._log_records = 0
+            self._fh.close()
+            self._replay()
+            self._open_writer()
+        elif stat.st_size != self._log_size:
+            self._replay(self._log_size)
+
+    def _replay(self, start: int = 0) -> None:
+        """
+        Áp các thao tác trong log từ byte start; dòng ghi dở ở cuối (crash) bị cắt bỏ
+        """
+        valid_bytes = start
+        with open(self.log_path, 'rb') as f:
+            f.seek(start)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # dòng ghi dở khi crash
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                self._apply(record)
+                self._log_records += 1
+                valid_bytes += len(line)
+        count_bytes(self._metrics_store, 'read', valid_bytes - start)
+        if valid_bytes != os.path.getsize(self.log_path):
+            with open(self.log_path, 'r+b') as f:
+                f.truncate(valid_bytes)
+        self._log_size = valid_bytes
+
+    def _apply(self, record: Dict[str, Any]) -> None:
+        self._version += 1
+        op = record.get('op')
+        if op == 'put':
+            order = record['order']
+            order_id = order['id']
+            self._orders[order_id] = order
+            if order_id >= self._next_id:
+                self._next_id = order_id + 1
+            for index in self._indexes.values():
+                index.add(order)
+        elif op == 'del':
+            self._orders.pop(record['id'], None)
+            for index in self._indexes.values():
+                index.remove(record['id'])
+        elif op == 'clear':
+            self._orders.clear()
+            for index in self._indexes.values():
+                index.clear()
+        elif op == 'seq':
+            self._next_id = max(self._next_id, record['next_id'])
+
+    # ------------------------------------------------------------------
+    # Ghi
+    # ------------------------------------------------------------------
+    def _append(self, records: Iterable[Dict[str, Any]]) -> None:
+        self._pending.append(b''.join(
+            (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8') for record in records
+        ))
+        if not self.write_behind:
+            try:
+                self._write_pending()
+            except OSError:
+                # các dòng này chưa được áp vào bộ nhớ, người gọi nhận lỗi -> không ghi lại sau
+                self._pending.pop()
+                raise
+
+    def _write_pending(self) -> None:
+        if not self._pending:
+            return
+        data = b''.join(self._pending)
+        try:
+            append_bytes(self._fh, data)
+        except OSError:
+            # ghi dở: cắt về cuối dòng cuối cùng đã ghi đủ, giữ bộ đệm để lần sync sau ghi lại
+            truncate_file(self._fh, self._log_size)
+            raise
+        self._log_size += len(data)
+        self._pending.clear()
+        count_bytes(self._metrics_store, 'write', len(data))
+
+    def _write(self, records: List[Dict[str, Any]]) -> None:
+        with self._locked():
+            self._append(records)
+            for record in records:
+                self._apply(record)
+            self._log_records += len(records)
+            self._maybe_compact()
+
+    def sync(self, fsync: bool = False) -> None:
+        """
+        Ghi các dòng đang chờ bằng 1 lần write; fsync trên bản sao fd để không giữ lock
+        trong lúc chờ đĩa
+        """
+        with self._lock.hold():
+            if self._fh is None:
+                return
+            self._write_pending()
+            fd = os.dup(self._fh.fileno()) if fsync else None
+        if fd is not None:
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def _maybe_compact(self) -> None:
+        if self._log_records > COMPACT_MIN_RECORDS and self._log_records > COMPACT_RATIO * (len(self._orders) + 1):
+            self.compact()
+
+    def compact(self) -> None:
+        """
+        Ghi lại log chỉ gồm bộ đếm id và các đơn còn sống (file tạm + rename nên không
+        bao giờ để lại file ghi dở)
+        """
+        with self._locked():
+            self._compact()
+
+    def _compact(self) -> None:
+        # các dòng đang chờ đã nằm trong self._orders nên được ghi cùng bản compact
+        self._pending.clear()
+        tmp_path = self.log_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write((json.dumps({'op': 'seq', 'next_id': self._next_id}) + '\n').encode('utf-8'))
+            for order in self._orders.values():
+                f.write((json.dumps({'op': 'put', 'order': order}, ensure_ascii=False) + '\n').encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+            count_bytes(self._metrics_store, 'write', f.tell())
+
+        reopen = self._fh is not None
+        if reopen:
+            self._fh.close()
+            self._fh = None
+        os.replace(tmp_path, self.log_path)
+        self._log_records = len(self._orders) + 1
+        if reopen:
+            self._open_writer()
+
+    def add(self, order: Dict[str, Any]) -> int:
+        """
+        Thêm đơn mới, cấp id mới từ bộ đếm, trả về id
+        """
+        return self.add_many([order])[0]
+
+    def add_many(self, orders: List[Dict[str, Any]]) -> List[int]:
+        """
+        Thêm nhiều đơn trong 1 lần ghi, các đơn nhận id liên tiếp nhau
+        """
+        records = []
+        ids = []
+        # id được cấp sau khi đã đọc bù log (chế độ shared) và trong cùng khoá với lần ghi
+        with self._locked():
+            for order in orders:
+                order = copy.deepcopy(order)
+                order['id'] = self._next_id + len(ids)
+                ids.append(order['id'])
+                records.append({'op': 'put', 'order': order})
+            if records:
+                self._write(records)
+        return ids
+
+    def put(self, order_id: int, order: Dict[str, Any]) -> None:
+        """
+        Ghi đè đơn có id tương ứng
+        """
+        order = copy.deepcopy(order)
+        order['id'] = order_id
+        self._write([{'op': 'put', 'order': order}])
+
+    def delete(self, order_id: int) -> bool:
+        with self._locked():
+            if order_id not in self._orders:
+                return False
+            self._write([{'op': 'del', 'id': order_id}])
+            return True
+
+    def clear(self) -> None:
+        self._write([{'op': 'clear'}])
+
+    # ------------------------------------------------------------------
+    # Đọc
+    # ------------------------------------------------------------------
+    def get(self, order_id: int) -> Optional[Dict[str, Any]]:
+        with self._locked(exclusive=False):
+            order = self._orders.get(order_id)
+            return copy.deepcopy(order) if order is not None else None
+
+    def all(self) -> List[Dict[str, Any]]:
+        with self._locked(exclusive=False):
+            return [copy.deepcopy(order) for order in self._orders.values()]
+
+    def __len__(self) -> int:
+        with self._locked(exclusive=False):
+            return len(self._orders)
+
+    @property
+    def next_id(self) -> int:
+        with self._locked(exclusive=False):
+            return self._next_id
+
+    def version(self) -> str:
+        if self._lock.shared:
+            # đọc bù phần log process khác ghi thêm (chỉ stat file nếu không có gì mới)
+            with self._locked(exclusive=False):
+                return f'{self._epoch}.{self._version}'
+        return f'{self._epoch}.{self._version}'
+
+    def page(self, sort: str, descending: bool = False, limit: int = 50, cursor: Optional[str] = None,
+             status: Optional[str] = None, date_from: Optional[str] = None, date_to: Optional[str] = None,
+             q: Optional[str] = None, date_index: str = 'confirmed_at') -> Dict[str, Any]:
+        """
+        Lấy 1 trang đơn theo thứ tự của index `sort`, phân trang bằng cursor.
+        status dùng danh sách riêng của index; date_from / date_to (ISO, có thể chỉ là ngày)
+        được cắt bằng tìm kiếm nhị phân khi sort theo date_index; q (không phân biệt dấu)
+        lọc trên tên, số điện thoại, tên bánh.
+        """
+        with self._locked(exclusive=False):
+            if sort not in self._indexes:
+                raise ValueError(f'Unsupported sort key: {sort}')
+            entries = self._indexes[sort].entries(status)
+            needle = fold_text(q) if q else None
+
+            lo, hi = 0, len(entries)
+            range_by_index = sort == date_index
+            if range_by_index:
+                if date_from:
+                    lo = bisect_left(entries, (date_from,))
+                if date_to:
+                    # '\uffff' để tính cả các thời điểm trong ngày khi date_to chỉ có ngày
+                    hi = bisect_right(entries, (date_to + '\uffff',))
+            if cursor:
+                cursor_entry = decode_cursor(cursor)
+                if descending:
+                    hi = min(hi, bisect_left(entries, cursor_entry))
+                else:
+                    lo = max(lo, bisect_right(entries, cursor_entry))
+
+            date_key = self._indexes[date_index].key_func if date_index in self._indexes else None
+            positions = range(hi - 1, lo - 1, -1) if descending else range(lo, hi)
+            items: List[Dict[str, Any]] = []
+            last_position = None
+            for position in positions:
+                order = self._orders[entries[position][1]]
+                last_position = position
+                if not range_by_index and date_key and (date_from or date_to):
+                    value = date_key(order)
+                    if (date_from and value < date_from) or (date_to and value[:len(date_to)] > date_to):
+                        continue
+                if needle and not order_matches_text(order, needle):
+                    continue
+                items.append(copy.deepcopy(order))
+                if len(items) >= limit:
+                    break
+
+            has_more = last_position is not None and (last_position > lo if descending else last_position < hi - 1)
+            exact_total = needle is None and (range_by_index or not (date_from or date_to))
+            return {
+                'items': items,
+                'next_cursor': encode_cursor(entries[last_position]) if len(items) >= limit and has_more else None,
+                'total': max(hi - lo, 0) if exact_total and not cursor else None,
+                'counts': self._indexes[sort].counts()
+            }
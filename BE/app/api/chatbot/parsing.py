@@ -0,0 +1,224 @@
+import json
+import re
+from typing import Dict, Any, List, Optional, Tuple
+from pydantic import BaseModel, ConfigDict, Field, ValidationInfo, field_validator
+
+FENCE_RE = re.compile(r'```(?:json)?\s*(.*?)(?:```|$)', re.S | re.I)
+TRAILING_COMMA_RE = re.compile(r',\s*([}\]])')
+QUANTITY_RE = re.compile(r'\d+')
+
+CLOSERS = {'{': '}', '[': ']'}
+
+
+class CakeItem(BaseModel):
+    model_config = ConfigDict(extra='allow')
+
+    ten_banh: str = ''
+    so_luong: Optional[int] = Field(None, validate_default=True)
+
+    @field_validator('ten_banh', mode='before')
+    @classmethod
+    def _coerce_name(cls, value: Any) -> str:
+        return '' if value is None else str(value).strip()
+
+    @field_validator('so_luong', mode='before')
+    @classmethod
+    def _coerce_quantity(cls, value: Any, info: ValidationInfo) -> Optional[int]:
+        # "2 cái" -> 2, 2.0 -> 2, null / thiếu -> 1; output bị cắt thì để trống,
+        # bước kiểm tra đơn sẽ hỏi lại thay vì tự điền số lượng không ai nói
+        if value is None or value == '':
+            return None if (info.context or {}).get('truncated') else 1
+        if isinstance(value, (int, float)):
+            return int(value)
+        match = QUANTITY_RE.search(str(value))
+        return int(match.group()) if match else 1
+
+
+class OrderExtraction(BaseModel):
+    """
+    Kết quả trích xuất của LLM. Chỉ giữ các field của đơn hàng, ép kiểu về dạng
+    mà phần còn lại của service đang dùng.
+    """
+    model_config = ConfigDict(extra='ignore')
+
+    id: Optional[int] = None
+    ten_khach_hang: Optional[str] = None
+    so_dien_thoai: Optional[str] = None
+    danh_sach_banh: Optional[List[CakeItem]] = None
+    dia_chi: Optional[str] = None
+    gio_giao: Optional[str] = None
+    ghi_chu: Optional[str] = None
+
+    @field_validator('ten_khach_hang', 'so_dien_thoai', 'dia_chi', 'gio_giao', 'ghi_chu', mode='before')
+    @classmethod
+    def _coerce_text(cls, value: Any) -> Optional[str]:
+        if value is None or isinstance(value, str):
+            return value
+        return str(value)
+
+    @field_validator('id', mode='before')
+    @classmethod
+    def _coerce_id(cls, value: Any) -> Optional[int]:
+        try:
+            return int(value) if value not in (None, '') else None
+        except (TypeError, ValueError):
+            return None
+
+    @field_validator('danh_sach_banh', mode='before')
+    @classmethod
+    def _coerce_cakes(cls, value: Any) -> Optional[List[Any]]:
+        if value is None:
+            return None
+        if isinstance(value, (dict, str)):
+            value = [value]
+        return [{'ten_banh': item} if isinstance(item, str) else item for item in value]
+
+
+JSON_RESPONSE_FORMAT = {"type": "json_object"}
+
+
+def _strip_fences(text: str) -> str:
+    match = FENCE_RE.search(text)
+    return match.group(1) if match else text
+
+
+def _open_brackets(text: str) -> List[Tuple[str, int]]:
+    """
+    Các ngoặc còn mở ở cuối text (ngoài chuỗi), kèm vị trí
+    """
+    stack: List[Tuple[str, int]] = []
+    in_string = False
+    escaped = False
+    for i, ch in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == '\\':
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in CLOSERS:
+            stack.append((ch, i))
+        elif ch in '}]' and stack:
+            stack.pop()
+    return stack
+
+
+def _drop_open_array_items(text: str) -> str:
+    # object trong mảng bị cắt giữa chừng thì các field phía sau (so_luong...) đã mất,
+    # đóng lại sẽ thành 1 phần tử thiếu dữ liệu -> bỏ cả phần tử
+    stack = _open_brackets(text)
+    for (outer, _), (inner, position) in zip(stack, stack[1:]):
+        if outer == '[' and inner == '{':
+            return text[:position].rstrip()
+    return text
+
+
+def _scan(text: str, start: int) -> Tuple[Optional[int], List[str], bool]:
+    """
+    Duyệt từ dấu '{' ở vị trí start, trả về (vị trí kết thúc object ngoài cùng hoặc None,
+    các ngoặc còn mở, đang ở trong chuỗi hay không)
+    """
+    stack: List[str] = []
+    in_string = False
+    escaped = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == '\\':
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in CLOSERS:
+            stack.append(ch)
+        elif ch in '}]':
+            if stack:
+                stack.pop()
+            if not stack:
+                return i, [], False
+    return None, stack, in_string
+
+
+def _close(text: str) -> str:
+    # đóng chuỗi / ngoặc còn mở của 1 đoạn JSON bị cắt giữa chừng
+    _, stack, in_string = _scan(text, 0)
+    if in_string:
+        text += '"'
+    text = text.rstrip()
+    if text.endswith(','):
+        text = text[:-1]
+    elif text.endswith(':'):
+        text += ' null'
+    return text + ''.join(CLOSERS[ch] for ch in reversed(stack))
+
+
+def _loads_object(text: str) -> Dict[str, Any]:
+    try:
+        value = json.loads(text)
+    except ValueError:
+        value = json.loads(TRAILING_COMMA_RE.sub(r'\1', text))
+    if not isinstance(value, dict):
+        raise ValueError('Model output is not a JSON object')
+    return value
+
+
+def _repair_truncated(body: str) -> Dict[str, Any]:
+    text = body
+    # bị cắt giữa 1 chuỗi thì giá trị đó không đáng tin -> bỏ cả phần tử đang dở
+    while _scan(text, 0)[2] and text.rfind(',') > 0:
+        text = text[:text.rfind(',')]
+    # thử đóng ngay; không được thì bỏ dần phần tử cuối đang dở (tới dấu ',' gần nhất)
+    while text:
+        text = _drop_open_array_items(text)
+        try:
+            return _loads_object(_close(text))
+        except ValueError:
+            pass
+        cut = text.rfind(',')
+        if cut <= 0:
+            break
+        text = text[:cut]
+    raise ValueError('Could not repair truncated JSON from model output')
+
+
+def parse_llm_json(text: str) -> Tuple[Dict[str, Any], bool, bool]:
+    """
+    Parse JSON object từ output của LLM, trả về (object, có phải sửa hay không, có bị cắt hay không).
+    Chịu được code fence, text thừa trước/sau object, dấu phẩy thừa và output bị cắt
+    do max_tokens. Chỉ output bị cắt mới có thể mất dữ liệu (field / phần tử cuối).
+    """
+    raw = (text or '').strip()
+    try:
+        value = json.loads(raw)
+        if isinstance(value, dict):
+            return value, False, False
+    except ValueError:
+        pass
+
+    candidate = _strip_fences(raw)
+    start = candidate.find('{')
+    if start < 0:
+        raise ValueError('No JSON object in model output')
+
+    end, _, _ = _scan(candidate, start)
+    if end is not None:
+        return _loads_object(candidate[start:end + 1]), True, False
+    return _repair_truncated(candidate[start:]), True, True
+
+
+def validate_extraction(data: Dict[str, Any], truncated: bool = False) -> Dict[str, Any]:
+    """
+    Kiểm tra / ép kiểu bằng OrderExtraction, chỉ trả về các field model thực sự trả về
+    (để chế độ delta không tự thêm field rỗng). truncated: output bị cắt và đã được đóng lại,
+    bánh thiếu số lượng giữ so_luong = None thay vì mặc định 1.
+    """
+    order = OrderExtraction.model_validate(data, context={'truncated': truncated})
+    dumped = order.model_dump()
+    return {field: dumped[field] for field in OrderExtraction.model_fields if field in order.model_fields_set}
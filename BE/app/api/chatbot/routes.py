@@ -1,22 +1,45 @@
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
-import os
 import json
-from .services import ChatbotService
+from datetime import datetime
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from typing import List, Dict, Any, Optional, Union
+from .services import AsyncChatbotService
+from .scheduler import SchedulerOverloaded
+from .streaming import sse_event
+from .batch import BATCH_CONCURRENCY, parse_ndjson_line, run_batch
+from .export import ExportEncoder
+from app.utils.http_cache import response_cache
 
 router = APIRouter(prefix="/chatbot", tags=["chatbot"])
 
 # Initialize chatbot service
 try:
-    chatbot_service = ChatbotService()
+    chatbot_service = AsyncChatbotService()
 except ValueError as e:
     print(f"Warning: {e}")
     chatbot_service = None
 
+@router.on_event("startup")
+async def start_chatbot_retention():
+    if chatbot_service:
+        chatbot_service.start_retention()
+
+@router.on_event("shutdown")
+async def close_chatbot_service():
+    if chatbot_service:
+        await chatbot_service.aclose()
+
 class MessageRequest(BaseModel):
     message: str
     order_id: Optional[int] = None
+    user_id: Optional[str] = None
+
+class OrderPage(BaseModel):
+    items: List[Dict[str, Any]]
+    next_cursor: Optional[str] = None
+    total: Optional[int] = None
+    counts: Dict[str, int] = {}
 
 class MessageResponse(BaseModel):
     success: bool
@@ -24,19 +47,29 @@ class MessageResponse(BaseModel):
     message: str
 
 class ConfirmOrderRequest(BaseModel):
-    order_id: int
+    # bỏ trống order_id thì xác nhận đơn nháp trong phiên của user_id
+    order_id: Optional[int] = None
+    user_id: Optional[str] = None
+
+def overloaded_error(error: SchedulerOverloaded) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Hệ thống đang quá tải, vui lòng thử lại sau ít phút.",
+        headers={"Retry-After": str(max(1, round(error.retry_after)))}
+    )
 
 @router.post("/process", response_model=MessageResponse)
 async def process_message(request: MessageRequest):
     """
-    Xử lý tin nhắn với logic đầy đủ (kiểm tra thông tin, hỏi thiếu, xác nhận)
+    Xử lý tin nhắn với logic đầy đủ (kiểm tra thông tin, hỏi thiếu, xác nhận).
+    Có user_id thì đơn nháp được giữ trong phiên phía server, không cần gửi order_id.
     """
     if not chatbot_service:
         raise HTTPException(status_code=500, detail="Chatbot service not initialized. Please check OPENAI_API_KEY.")
     
     try:
         # Process message with full logic
-        result = chatbot_service.process_order_logic(request.message, request.order_id)
+        result = await chatbot_service.process_order_logic(request.message, request.order_id, request.user_id)
         
         return MessageResponse(
             success=True,
@@ -44,9 +77,37 @@ async def process_message(request: MessageRequest):
             message=result.get('message', 'Processed successfully')
         )
         
+    except SchedulerOverloaded as e:
+        raise overloaded_error(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to process message: {str(e)}")
 
+@router.post("/process/stream")
+async def process_message_stream(request: MessageRequest):
+    """
+    Giống /process nhưng stream tiến trình xử lý về client qua Server-Sent Events
+    (started, field, completeness, result)
+    """
+    if not chatbot_service:
+        raise HTTPException(status_code=500, detail="Chatbot service not initialized. Please check OPENAI_API_KEY.")
+
+    # hàng đợi LLM đầy thì trả 503 ngay, trước khi mở stream
+    try:
+        chatbot_service.scheduler.check_capacity()
+    except SchedulerOverloaded as e:
+        raise overloaded_error(e)
+
+    async def event_stream():
+        async for event, data in chatbot_service.process_order_events(request.message, request.order_id,
+                                                                      request.user_id):
+            yield sse_event(event, data)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.post("/confirm", response_model=MessageResponse)
 async def confirm_order(request: ConfirmOrderRequest):
     """
@@ -55,30 +116,28 @@ async def confirm_order(request: ConfirmOrderRequest):
     if not chatbot_service:
         raise HTTPException(status_code=500, detail="Chatbot service not initialized. Please check OPENAI_API_KEY.")
     
+    order_id = request.order_id
+    if order_id is None and request.user_id:
+        order_id = chatbot_service.sessions.order_for(request.user_id)
+    if order_id is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+
     try:
-        # Get all current orders
-        orders = chatbot_service.get_all_orders()
-        target_order = None
+        # Đọc đơn, kiểm tra và lưu vào kho final trong cùng 1 giao dịch
+        result = await chatbot_service.confirm_order(order_id)
         
-        # Find the order to confirm
-        for order in orders:
-            if order.get('id') == request.order_id:
-                target_order = order
-                break
-        
-        if not target_order:
+        if result.get('error'):
             raise HTTPException(status_code=404, detail="Order not found")
         
         # Check if order is complete before confirming
-        completeness_check = chatbot_service.check_order_completeness(target_order)
-        if not completeness_check['is_complete']:
+        if result['missing_fields']:
             raise HTTPException(
                 status_code=400, 
-                detail=f"Cannot confirm incomplete order. Missing: {', '.join(completeness_check['missing_fields'])}"
+                detail=f"Cannot confirm incomplete order. Missing: {', '.join(result['missing_fields'])}"
             )
         
-        # Save to final orders
-        save_success = chatbot_service.save_final_order(target_order)
+        target_order = result['order']
+        save_success = result['saved']
         
         if save_success:
             return MessageResponse(
@@ -94,17 +153,30 @@ async def confirm_order(request: ConfirmOrderRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to confirm order: {str(e)}")
 
+@router.get("/sessions/{user_id}")
+async def get_session(user_id: str):
+    """
+    Phiên hội thoại đang giữ trong bộ nhớ của user: đơn nháp và các lượt gần nhất
+    """
+    if not chatbot_service:
+        raise HTTPException(status_code=500, detail="Chatbot service not initialized. Please check OPENAI_API_KEY.")
+
+    session = chatbot_service.sessions.get(user_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return session.to_dict()
+
 @router.get("/confirmed-orders", response_model=List[Dict[str, Any]])
-async def get_confirmed_orders():
+async def get_confirmed_orders(request: Request):
     """
-    Lấy tất cả đơn hàng đã xác nhận
+    Lấy tất cả đơn hàng đã xác nhận (ETag theo version của kho, If-None-Match -> 304)
     """
     if not chatbot_service:
         raise HTTPException(status_code=500, detail="Chatbot service not initialized. Please check OPENAI_API_KEY.")
     
     try:
-        confirmed_orders = chatbot_service.get_confirmed_orders()
-        return confirmed_orders
+        return await response_cache.respond(request, chatbot_service.orders_version(confirmed=True),
+                                            chatbot_service.get_confirmed_orders)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get confirmed orders: {str(e)}")
@@ -119,10 +191,10 @@ async def analyze_message(request: MessageRequest):
     
     try:
         # Analyze the message
-        order_data = chatbot_service.analyze_message(request.message)
+        order_data = await chatbot_service.analyze_message(request.message, user_id=request.user_id)
         
         # Save to file
-        save_success = chatbot_service.save_order_info(order_data)
+        save_success = await chatbot_service.save_order_info(order_data)
 
         if save_success and 'error' not in order_data:
             return MessageResponse(
@@ -137,39 +209,166 @@ async def analyze_message(request: MessageRequest):
                 message=order_data.get('error', 'Failed to analyze message')
             )
         
+    except SchedulerOverloaded as e:
+        raise overloaded_error(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to analyze message: {str(e)}")
 
+@router.post("/analyze/batch")
+async def analyze_batch(request: Request, concurrency: int = Query(BATCH_CONCURRENCY, ge=1, le=64)):
+    """
+    Phân tích hàng loạt tin nhắn, body là JSON ({"messages": [...]} hoặc list) hoặc NDJSON
+    (Content-Type: application/x-ndjson). Kết quả stream về dạng NDJSON, mỗi tin nhắn 1 dòng
+    ngay khi xong, dòng cuối là tổng kết kèm id các đơn đã lưu.
+    """
+    if not chatbot_service:
+        raise HTTPException(status_code=500, detail="Chatbot service not initialized. Please check OPENAI_API_KEY.")
+
+    content_type = request.headers.get('content-type', '')
+    if 'ndjson' in content_type or 'jsonl' in content_type:
+        # Body được đọc hết trước khi trả response: StreamingResponse dùng receive() để
+        # theo dõi client ngắt kết nối nên không đọc tiếp body song song được
+        body = await request.body()
+        entries = [parse_ndjson_line(line) for line in body.splitlines() if line.strip()]
+    else:
+        try:
+            body = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid JSON body")
+        entries = body.get('messages') if isinstance(body, dict) else body
+        if not isinstance(entries, list):
+            raise HTTPException(status_code=400, detail="Body must be a list of messages or {\"messages\": [...]}")
+
+    async def result_stream():
+        async for result in run_batch(chatbot_service, entries, concurrency):
+            yield json.dumps(result, ensure_ascii=False) + '\n'
+
+    return StreamingResponse(result_stream(), media_type="application/x-ndjson")
+
 @router.get("/orders", response_model=List[Dict[str, Any]])
-async def get_all_orders():
+async def get_all_orders(request: Request):
     """
-    Lấy tất cả thông tin đơn hàng đã được phân tích
+    Lấy tất cả thông tin đơn hàng đã được phân tích (ETag theo version của kho, If-None-Match -> 304)
     """
     if not chatbot_service:
         raise HTTPException(status_code=500, detail="Chatbot service not initialized. Please check OPENAI_API_KEY.")
     
     try:
-        orders = chatbot_service.get_all_orders()
-        return orders
+        return await response_cache.respond(request, chatbot_service.orders_version(),
+                                            chatbot_service.get_all_orders)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get orders: {str(e)}")
     
-@router.get("/orders-final", response_model=List[Dict[str, Any]])
-async def get_all_orders():
+@router.get("/orders-final", response_model=Union[List[Dict[str, Any]], OrderPage])
+async def get_all_orders(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    q: Optional[str] = None,
+    sort: str = Query('confirmed_at', pattern='^(confirmed_at|name)$'),
+    order: str = Query('desc', pattern='^(asc|desc)$')
+):
     """
-    Lấy tất cả thông tin đơn hàng đã được phân tích
+    Lấy thông tin đơn hàng đã xác nhận.
+    Không truyền limit: trả về toàn bộ danh sách như cũ.
+    Có limit: trả về 1 trang {items, next_cursor, total, counts}, lọc theo status,
+    khoảng ngày (date_from / date_to), từ khoá q và sắp xếp theo confirmed_at hoặc name.
+    Cả 2 dạng đều có ETag theo version của kho (If-None-Match -> 304).
     """
     if not chatbot_service:
         raise HTTPException(status_code=500, detail="Chatbot service not initialized. Please check OPENAI_API_KEY.")
     
     try:
-        orders = chatbot_service.get_orders()
-        return orders
-        
+        if limit is None:
+            produce = chatbot_service.get_orders
+        else:
+            def produce():
+                return chatbot_service.page_final_orders(limit=limit, cursor=cursor, status=status,
+                                                         date_from=date_from, date_to=date_to, q=q,
+                                                         sort=sort, descending=order == 'desc')
+        return await response_cache.respond(request, chatbot_service.orders_version(confirmed=True), produce)
+
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get orders: {str(e)}")
 
+@router.get("/orders-final/export")
+async def export_final_orders(
+    export_format: str = Query('csv', alias='format', pattern='^(csv|ndjson)$'),
+    status: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    q: Optional[str] = None,
+    order: str = Query('asc', pattern='^(asc|desc)$'),
+    gzip: bool = False
+):
+    """
+    Xuất đơn đã xác nhận ra CSV hoặc NDJSON (mỗi bánh 1 dòng), cùng bộ lọc với /orders-final.
+    Đọc kho theo từng lô và stream dần về client, gzip=true thì nén luôn trong lúc stream.
+    """
+    if not chatbot_service:
+        raise HTTPException(status_code=500, detail="Chatbot service not initialized. Please check OPENAI_API_KEY.")
+
+    encoder = ExportEncoder(export_format, gzip, chatbot_service.catalog)
+    pages = chatbot_service.iter_final_orders(status=status, date_from=date_from, date_to=date_to, q=q,
+                                              descending=order == 'desc')
+
+    async def export_stream():
+        yield encoder.start()
+        async for orders in pages:
+            yield encoder.encode(orders)
+        yield encoder.finish()
+
+    filename = encoder.filename(f"bakery_orders_{datetime.now():%Y%m%d_%H%M%S}")
+    return StreamingResponse(export_stream(), media_type=encoder.media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@router.get("/stats")
+async def get_order_stats(
+    top: int = Query(10, ge=1, le=100),
+    days: int = Query(30, ge=1, le=366)
+):
+    """
+    Thống kê cho trang admin: tổng số đơn đã xác nhận, số đơn theo status, số đơn nháp,
+    top bánh, số đơn theo giờ / ngày xác nhận (days ngày gần nhất) và theo giờ giao.
+    Đọc từ bộ đếm được cập nhật ở mỗi lần ghi đơn nên không quét lại kho.
+    """
+    if not chatbot_service:
+        raise HTTPException(status_code=500, detail="Chatbot service not initialized. Please check OPENAI_API_KEY.")
+
+    try:
+        return await chatbot_service.get_order_stats(top=top, days=days)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get stats: {str(e)}")
+
+@router.post("/stats/rebuild")
+async def rebuild_order_stats():
+    """
+    Quét lại toàn bộ kho đơn để dựng lại bộ đếm thống kê
+    """
+    if not chatbot_service:
+        raise HTTPException(status_code=500, detail="Chatbot service not initialized. Please check OPENAI_API_KEY.")
+
+    try:
+        return await chatbot_service.rebuild_order_stats()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to rebuild stats: {str(e)}")
+
+@router.get("/extraction-stats")
+async def get_extraction_stats():
+    """
+    Số lượt trích xuất đi fast path (regex, không gọi LLM) so với đi LLM
+    """
+    if not chatbot_service:
+        raise HTTPException(status_code=500, detail="Chatbot service not initialized. Please check OPENAI_API_KEY.")
+
+    return chatbot_service.get_extraction_stats()
+
 @router.delete("/orders")
 async def clear_orders():
     """
@@ -180,9 +379,7 @@ async def clear_orders():
     
     try:
         # Clear order_info.json
-        file_path = os.path.join(os.path.dirname(__file__), '..', '..', 'order_info.json')
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump([], f)
+        await chatbot_service.clear_all_orders()
         
         return {"success": True, "message": "All orders cleared"}
         
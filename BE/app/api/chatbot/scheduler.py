@@ -0,0 +1,355 @@
+import asyncio
+import math
+import os
+import random
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+import openai
+from app.utils import metrics
+
+# Ngân sách gọi LLM (theo giới hạn của tài khoản OpenAI)
+LLM_RPM = float(os.getenv("LLM_RPM", "500"))
+LLM_TPM = float(os.getenv("LLM_TPM", "200000"))
+# Số lời gọi đang chạy tối đa và số lời gọi được xếp hàng trước khi trả 503
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+LLM_QUEUE_SIZE = int(os.getenv("LLM_QUEUE_SIZE", "256"))
+# Retry khi gặp 429 / 5xx / lỗi kết nối: exponential backoff có jitter
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "20"))
+
+# Cho phép dồn tối đa lượng ngân sách của BURST_SECONDS giây
+BURST_SECONDS = 10
+
+
+class SchedulerOverloaded(Exception):
+    """
+    Hàng đợi đã đầy: route trả 503 kèm Retry-After thay vì để request chờ mãi
+    """
+
+    def __init__(self, retry_after: float):
+        super().__init__(f'LLM scheduler is overloaded, retry after {retry_after:.0f}s')
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """
+        Số giây phải chờ tới khi đủ `amount` (yêu cầu lớn hơn sức chứa được tính bằng sức chứa)
+        """
+        self._refill()
+        amount = min(amount, self.capacity)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float) -> None:
+        self._refill()
+        self.tokens -= amount
+
+    def refund(self, amount: float) -> None:
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+@dataclass
+class _Job:
+    key: str
+    tokens: int
+    call: Callable[[], Awaitable[Any]]
+    future: asyncio.Future
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+class HeldStream:
+    """
+    Completion dạng stream trả về từ scheduler: lời gọi vẫn giữ slot (LLM_MAX_CONCURRENCY)
+    cho tới khi stream được đọc hết, lỗi hoặc đóng; lúc đó on_close(usage) nhận usage ở
+    chunk cuối (stream_options include_usage) để tính lại token thật.
+    """
+
+    def __init__(self, stream: Any, on_close: Callable[[Any], None]):
+        self._stream = stream
+        self._on_close = on_close
+        self._closed = False
+        self.usage = None
+
+    def __aiter__(self) -> 'HeldStream':
+        return self
+
+    async def __anext__(self) -> Any:
+        try:
+            chunk = await self._stream.__anext__()
+        except BaseException:
+            # StopAsyncIteration (hết stream) hoặc lỗi giữa chừng
+            self._finish()
+            raise
+        usage = getattr(chunk, 'usage', None)
+        if usage:
+            self.usage = usage
+        return chunk
+
+    async def aclose(self) -> None:
+        if self._closed:
+            return
+        close = getattr(self._stream, 'close', None) or getattr(self._stream, 'aclose', None)
+        try:
+            if close:
+                await close()
+        finally:
+            self._finish()
+
+    def _finish(self) -> None:
+        if not self._closed:
+            self._closed = True
+            self._on_close(self.usage)
+
+    def __del__(self):
+        # bị bỏ đi mà chưa đóng (client ngắt giữa chừng): vẫn trả slot
+        self._finish()
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """
+    Đọc Retry-After (giây hoặc HTTP date) / retry-after-ms từ response lỗi của OpenAI
+    """
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    value = headers.get('retry-after-ms')
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get('retry-after')
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+def is_rate_limited(error: Exception) -> bool:
+    return getattr(error, 'status_code', None) == 429
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    status = getattr(error, 'status_code', None)
+    return status is not None and (status == 429 or status >= 500)
+
+
+class LLMScheduler:
+    """
+    Bộ điều phối lời gọi LLM:
+
+    - 2 token bucket: số request / phút (RPM) và số token / phút (TPM). Mỗi lời gọi
+      trừ trước số token ước lượng (prompt + max_tokens), trả lại phần dư theo usage thật
+    - Hàng đợi có giới hạn, đầy thì submit() ném SchedulerOverloaded ngay (503 + Retry-After)
+    - Mỗi key (user_id) có 1 hàng đợi riêng, lấy việc xoay vòng giữa các key để 1 user
+      gửi dồn dập không làm các user khác phải chờ
+    - Lỗi 429 / 5xx / kết nối được retry với exponential backoff + jitter; gặp 429 thì
+      tôn trọng Retry-After và tạm dừng phát request mới cho tới lúc đó
+    """
+
+    def __init__(self, rpm: float = LLM_RPM, tpm: float = LLM_TPM,
+                 max_concurrency: int = LLM_MAX_CONCURRENCY, max_queue: int = LLM_QUEUE_SIZE,
+                 max_retries: int = LLM_MAX_RETRIES, backoff_base: float = LLM_BACKOFF_BASE,
+                 backoff_max: float = LLM_BACKOFF_MAX):
+        self.requests = TokenBucket(rpm / 60, max(1.0, rpm / 60 * BURST_SECONDS))
+        self.tokens = TokenBucket(tpm / 60, max(1.0, tpm / 60 * BURST_SECONDS))
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self._queues: "OrderedDict[str, Deque[_Job]]" = OrderedDict()
+        self._queued = 0
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._stats = {'submitted': 0, 'completed': 0, 'failed': 0, 'rejected': 0,
+                       'retries': 0, 'rate_limited': 0, 'throttled_waits': 0}
+
+    # ------------------------------------------------------------------
+    # API
+    # ------------------------------------------------------------------
+    def retry_after_hint(self) -> float:
+        # thời gian ước tính để xả hết hàng đợi hiện tại theo ngân sách request
+        drain = self._queued / self.requests.rate if self.requests.rate else 1.0
+        return max(1.0, drain, self._paused_until - time.monotonic())
+
+    def check_capacity(self) -> None:
+        """
+        Ném SchedulerOverloaded nếu hàng đợi đã đầy (dùng trước khi mở stream)
+        """
+        if self._queued >= self.max_queue:
+            self._stats['rejected'] += 1
+            raise SchedulerOverloaded(self.retry_after_hint())
+
+    async def submit(self, key: str, tokens: int, call: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Xếp lời gọi vào hàng đợi của `key`, chờ tới lượt và trả về kết quả của call()
+        """
+        self.check_capacity()
+        self._ensure_dispatcher()
+
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(key, deque()).append(_Job(key, tokens, call, future))
+        self._queued += 1
+        self._stats['submitted'] += 1
+        self._wakeup.set()
+        return await future
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            'queued': self._queued,
+            'in_flight': self._in_flight,
+            'active_keys': len(self._queues),
+            'paused_for': max(0.0, self._paused_until - time.monotonic())
+        }
+
+    async def close(self) -> None:
+        if self._dispatcher:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+
+    # ------------------------------------------------------------------
+    # Điều phối
+    # ------------------------------------------------------------------
+    def _ensure_dispatcher(self) -> None:
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+    def _next_job(self) -> Optional[_Job]:
+        # round-robin: lấy key đứng đầu, còn việc thì đưa key xuống cuối
+        while self._queues:
+            key, jobs = self._queues.popitem(last=False)
+            job = jobs.popleft()
+            if jobs:
+                self._queues[key] = jobs
+            self._queued -= 1
+            if not job.future.done():  # bỏ qua request mà client đã huỷ
+                return job
+        return None
+
+    async def _dispatch(self) -> None:
+        while True:
+            job = self._next_job()
+            if job is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            await self._slots.acquire()
+            await self._wait_budget(job.tokens)
+            asyncio.create_task(self._run(job))
+
+    async def _wait_budget(self, tokens: int) -> None:
+        while True:
+            delay = max(self._paused_until - time.monotonic(),
+                        self.requests.wait_time(1),
+                        self.tokens.wait_time(tokens))
+            if delay <= 0:
+                self.requests.consume(1)
+                self.tokens.consume(tokens)
+                return
+            self._stats['throttled_waits'] += 1
+            await asyncio.sleep(delay)
+
+    def _backoff(self, error: Exception, attempt: int) -> float:
+        # full jitter; nếu server gửi Retry-After thì chờ ít nhất chừng đó
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        retry_after = retry_after_seconds(error)
+        if retry_after is not None:
+            delay = retry_after + random.uniform(0, self.backoff_base)
+        return delay
+
+    def _settle(self, estimated: int, usage: Any) -> None:
+        total = getattr(usage, 'total_tokens', None)
+        if total:
+            self.tokens.refund(estimated - total)
+
+    def _release(self) -> None:
+        self._in_flight -= 1
+        self._slots.release()
+
+    def _stream_closed(self, job: _Job, usage: Any) -> None:
+        self._settle(job.tokens, usage)
+        self._stats['completed'] += 1
+        self._release()
+
+    async def _run(self, job: _Job) -> None:
+        self._in_flight += 1
+        # không dùng metrics.stage: task này không thuộc context của request gửi job
+        metrics.STAGE_SECONDS.labels('llm_queue').observe(time.monotonic() - job.enqueued_at)
+        held = None
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    result = await job.call()
+                except Exception as e:
+                    if not is_retryable(e) or attempt == self.max_retries or job.future.done():
+                        raise
+                    delay = self._backoff(e, attempt)
+                    if is_rate_limited(e):
+                        self._stats['rate_limited'] += 1
+                        self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                    self._stats['retries'] += 1
+                    await asyncio.sleep(delay)
+                    await self._wait_budget(job.tokens)
+                    continue
+
+                if hasattr(result, '__aiter__'):
+                    # stream=True: slot và token được giữ tới khi stream đóng (HeldStream)
+                    held = HeldStream(result, lambda usage: self._stream_closed(job, usage))
+                    if job.future.done():
+                        await held.aclose()
+                    else:
+                        job.future.set_result(held)
+                    return
+                self._settle(job.tokens, getattr(result, 'usage', None))
+                self._stats['completed'] += 1
+                if not job.future.done():
+                    job.future.set_result(result)
+                return
+        except Exception as e:
+            self._stats['failed'] += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+        finally:
+            if held is None:
+                self._release()
+
+
+def estimate_tokens(messages: Any, max_tokens: int) -> int:
+    """
+    Ước lượng token của 1 lời gọi như cách OpenAI tính rate limit: prompt (~3 ký tự
+    tiếng Việt / token) + max_tokens
+    """
+    prompt_chars = sum(len(m.get('content') or '') for m in messages)
+    return math.ceil(prompt_chars / 3) + max_tokens
@@ -1,13 +1,225 @@
 import json
 import os
-from typing import Dict, Any, Optional, List
+import re
+import asyncio
+from typing import Dict, Any, Optional, List, AsyncIterator, Tuple
+from collections import deque
+from contextlib import aclosing, nullcontext
+import httpx
 import openai
 from dotenv import load_dotenv
 from datetime import datetime
+from .streaming import PartialJSONFieldParser
+from .cache import ExtractionCache
+from .parsing import JSON_RESPONSE_FORMAT, parse_llm_json, validate_extraction
+from .order_store import FINAL_ORDER_INDEXES
+from .order_stats import OrderStats, load_stats, save_stats
+from .customers import CustomerIndex, PREFILL_FIELDS
+from .catalog import Catalog
+from .export import EXPORT_BATCH_SIZE
+from .scheduler import LLMScheduler, SchedulerOverloaded, estimate_tokens
+from .sessions import Session, SessionManager
+from app.storage.factory import get_backend, get_committer
+from app.storage import retention
+from app.utils import metrics
 
 # Load environment variables
 load_dotenv()
 
+MODEL_NAME = "gpt-4o-mini"
+
+# Cấu hình HTTP client dùng chung cho AsyncOpenAI (giây / số kết nối)
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "30"))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", "20"))
+
+# Cache kết quả trích xuất (số phần tử, TTL giây, file SQLite tuỳ chọn cho tầng đĩa)
+EXTRACTION_CACHE_SIZE = int(os.getenv("EXTRACTION_CACHE_SIZE", "1024"))
+EXTRACTION_CACHE_TTL = float(os.getenv("EXTRACTION_CACHE_TTL", "3600"))
+EXTRACTION_CACHE_PATH = os.getenv("EXTRACTION_CACHE_PATH") or None
+
+# Cách cập nhật đơn đang có: 'delta' (model chỉ trả về field thay đổi, merge cục bộ)
+# hoặc 'full' (prompt cũ, model trả lại toàn bộ đơn) để so sánh token
+EXTRACTION_MODE = os.getenv("EXTRACTION_MODE", "delta")
+
+# Bật JSON mode (response_format json_object) khi gọi LLM
+OPENAI_JSON_MODE = os.getenv("OPENAI_JSON_MODE", "1") != "0"
+
+# Các field của đơn hàng mà LLM trích xuất
+ORDER_FIELDS = ('ten_khach_hang', 'so_dien_thoai', 'danh_sach_banh', 'dia_chi', 'gio_giao', 'ghi_chu')
+
+LLM_TOKENS = metrics.histogram(
+    'bakery_llm_tokens', 'Số token mỗi lời gọi LLM (theo usage của OpenAI)', ('type', 'kind'),
+    buckets=metrics.TOKEN_BUCKETS
+)
+
+_shared_http_client: Optional[httpx.AsyncClient] = None
+
+def get_shared_http_client() -> httpx.AsyncClient:
+    """
+    HTTP client (connection pool) dùng chung cho mọi AsyncOpenAI client trong process
+    """
+    global _shared_http_client
+    if _shared_http_client is None or _shared_http_client.is_closed:
+        _shared_http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=OPENAI_MAX_KEEPALIVE
+            )
+        )
+    return _shared_http_client
+
+# ----------------------------------------------------------------------
+# Fast path: trích xuất bằng regex cho các tin nhắn bổ sung đơn giản
+# (chỉ số điện thoại, giờ giao, 1 dòng địa chỉ, "2 cupcake vanilla", ...)
+# ----------------------------------------------------------------------
+PHONE_RE = re.compile(r'^(?:\+?84|0)(?:[\s.\-]?\d){8,10}$')
+
+TIME_RE = re.compile(
+    r'^(?P<hour>\d{1,2})\s*(?P<sep>:|h|g|giờ)\s*(?P<minute>\d{2}|rưỡi)?'
+    r'(?:\s*(?P<period>sáng|trưa|chiều|tối|đêm))?$',
+    re.IGNORECASE
+)
+
+_CAKE_QTY = r'^(?P<qty>\d{1,3})\s*(?:cái|chiếc|hộp|ổ|phần)?\s+'
+_CAKE_KEYWORD = r'(?:bánh|cake|cupcake|tiramisu|cheesecake|mousse|tart|muffin|donut|macaron|flan|croissant|su kem|bông lan)'
+# Tên bánh: từ khoá + tối đa 5 từ (chỉ chữ), phần dài hơn có thể là ghi chú -> để LLM xử lý
+CAKE_RE = re.compile(_CAKE_QTY + r'(?P<name>' + _CAKE_KEYWORD + r'(?:\s+[^\W\d_]+){0,5})$', re.IGNORECASE)
+# Dòng bắt đầu bằng "<số> bánh ..." (kể cả khi CAKE_RE không nhận) không phải địa chỉ
+CAKE_LINE_RE = re.compile(_CAKE_QTY + _CAKE_KEYWORD + r'\b', re.IGNORECASE)
+# Từ hay gặp trong yêu cầu kèm theo tên bánh ("bánh kem nhưng không đường", "... ít ngọt")
+CAKE_NOTE_RE = re.compile(
+    r'\b(?:nhưng|không|ít|nhiều|bớt|thêm|ghi|viết|chữ|cho|để|có|kèm|riêng|size|cỡ)\b',
+    re.IGNORECASE
+)
+
+ADDRESS_RE = re.compile(
+    r'^(?:số\s*)?\d+[a-zA-Z]?(?:/\d+[a-zA-Z]?)*\s+\S.{3,}$',
+    re.IGNORECASE
+)
+ADDRESS_KEYWORD_RE = re.compile(
+    r'\b(?:đường|phố|phường|quận|huyện|xã|thành phố|tp|q\.?\s*\d+|p\.?\s*\d+|ngõ|hẻm|kiệt|ngách|ấp|thôn)\b',
+    re.IGNORECASE
+)
+
+# Các cụm từ đệm được phép đứng trước / sau thông tin chính
+LEADING_FILLER_RE = re.compile(
+    r'^(?:(?:số điện thoại|điện thoại|sđt|sdt|đt|phone|địa chỉ|đ/c|giờ giao|giao vào lúc|giao lúc|giao vào|'
+    r'vào lúc|lúc|giao đến|giao tới|giao về|giao|thêm|lấy|đặt|cho mình|cho em|cho tôi|là)\s*:?\s*)+',
+    re.IGNORECASE
+)
+TRAILING_FILLER_RE = re.compile(r'(?:\s*(?:nhé|nha|nhe|ạ|ha|nhá))*[\s.!]*$', re.IGNORECASE)
+SEGMENT_SPLIT_RE = re.compile(r'\s*(?:,|;|\s+và\s+|\s+với\s+)\s*', re.IGNORECASE)
+
+
+def _strip_filler(text: str) -> str:
+    text = LEADING_FILLER_RE.sub('', text.strip())
+    return TRAILING_FILLER_RE.sub('', text).strip()
+
+
+def _parse_phone(text: str) -> Optional[str]:
+    if not PHONE_RE.match(text):
+        return None
+    digits = re.sub(r'\D', '', text)
+    if digits.startswith('84'):
+        digits = '0' + digits[2:]
+    return digits if len(digits) in (10, 11) else None
+
+
+def _parse_time(text: str) -> Optional[str]:
+    match = TIME_RE.match(text)
+    if not match:
+        return None
+    hour = int(match.group('hour'))
+    minute_text = match.group('minute')
+    if match.group('sep') == ':' and not minute_text:
+        return None
+    minute = 30 if minute_text and minute_text.lower() == 'rưỡi' else int(minute_text or 0)
+    period = (match.group('period') or '').lower()
+    if period in ('chiều', 'tối') and hour < 12:
+        hour += 12
+    elif period == 'trưa' and hour < 11:
+        hour += 12
+    elif period == 'đêm' and 6 < hour < 12:
+        hour += 12
+    # "12 giờ đêm" / "12 giờ tối" là 00:00, "12 giờ trưa" / "12 giờ chiều" là 12:00
+    if period in ('đêm', 'tối') and hour == 12:
+        hour = 0
+    if hour > 23 or minute > 59:
+        return None
+    return f"{hour:02d}:{minute:02d}"
+
+
+def _parse_cake(text: str, catalog: Optional[Catalog] = None) -> Optional[Dict[str, Any]]:
+    match = CAKE_RE.match(text)
+    if not match:
+        return None
+    qty = int(match.group('qty'))
+    name = match.group('name').strip().lower()
+    if qty <= 0 or not name or CAKE_NOTE_RE.search(name):
+        return None
+    # có danh mục thì chỉ nhận tên tra được, tên lạ để LLM đọc cả câu
+    if catalog is not None and len(catalog) and not catalog.resolve(name):
+        return None
+    if not name.startswith('bánh'):
+        name = f"bánh {name}"
+    return {'ten_banh': name, 'so_luong': qty}
+
+
+def _parse_address(text: str) -> Optional[str]:
+    text = _strip_filler(text)
+    if ADDRESS_RE.match(text) and ADDRESS_KEYWORD_RE.search(text):
+        return text
+    return None
+
+
+def fast_extract(message: str, catalog: Optional[Catalog] = None) -> Optional[Dict[str, Any]]:
+    """
+    Trích xuất thông tin đơn hàng bằng regex, không gọi LLM.
+    Chỉ trả về kết quả khi TOÀN BỘ tin nhắn được nhận diện (độ tin cậy cao),
+    ngược lại trả về None để đi đường LLM. Có catalog thì tên bánh phải có trong danh mục.
+    """
+    extracted: Dict[str, Any] = {}
+    cakes: List[Dict[str, Any]] = []
+
+    lines = [line.strip() for line in message.strip().splitlines() if line.strip()]
+    if not lines:
+        return None
+
+    for line in lines:
+        address = None if CAKE_LINE_RE.match(_strip_filler(line)) else _parse_address(line)
+        if address:
+            if 'dia_chi' in extracted:
+                return None
+            extracted['dia_chi'] = address
+            continue
+
+        for segment in SEGMENT_SPLIT_RE.split(line):
+            segment = _strip_filler(segment)
+            if not segment:
+                continue
+            phone = _parse_phone(segment)
+            if phone and 'so_dien_thoai' not in extracted:
+                extracted['so_dien_thoai'] = phone
+                continue
+            gio_giao = _parse_time(segment)
+            if gio_giao and 'gio_giao' not in extracted:
+                extracted['gio_giao'] = gio_giao
+                continue
+            cake = _parse_cake(segment, catalog)
+            if cake:
+                cakes.append(cake)
+                continue
+            # Còn phần không nhận diện được -> để LLM xử lý
+            return None
+
+    if cakes:
+        extracted['danh_sach_banh'] = cakes
+    return extracted or None
+
+
 class ChatbotService:
     def __init__(self):
         # Configure OpenAI API
@@ -16,16 +228,93 @@ class ChatbotService:
             raise ValueError("OPENAI_API_KEY not found in environment variables")
         
         self.client = openai.OpenAI(api_key=api_key)
+        self._init_extraction()
+        self._init_storage()
         
-    def analyze_message(self, message: str, existing_order: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    def _init_storage(self) -> None:
+        # Kho đơn nháp và đơn đã xác nhận, lấy từ backend cấu hình bởi STORAGE_BACKEND
+        self.storage = get_backend()
+        self.draft_store = self.storage.orders('order_info')
+        self.final_store = self.storage.orders('data_final', indexes=FINAL_ORDER_INDEXES)
+        # thống kê cho trang admin, cập nhật ở mỗi lần ghi đơn
+        self.order_stats = load_stats(self.final_store, self.draft_store, self.catalog)
+        # khách quen theo số điện thoại, để điền sẵn tên / địa chỉ từ đơn gần nhất
+        self.customers = CustomerIndex.build(self.final_store.all())
+
+
+    def _init_extraction(self) -> None:
+        # Đếm số lượt trích xuất đi fast path (regex), trúng cache và đi LLM
+        self.extraction_stats = {'fast_path': 0, 'cache': 0, 'llm': 0}
+        self.extraction_cache = ExtractionCache(
+            max_size=EXTRACTION_CACHE_SIZE,
+            ttl=EXTRACTION_CACHE_TTL,
+            disk_path=EXTRACTION_CACHE_PATH
+        )
+        self.extraction_mode = EXTRACTION_MODE
+        # Kết quả parse output của LLM: hợp lệ ngay / phải sửa cục bộ / không cứu được
+        self.parse_stats = {'ok': 0, 'repaired': 0, 'failed': 0}
+        # Điền sẵn từ đơn cũ của khách quen: số lần tra, số lần có điền field, số field,
+        # số lượt hỏi thêm thông tin (mỗi lượt là 1 lần gọi LLM) tránh được
+        self.prefill_stats = {'lookups': 0, 'prefilled': 0, 'fields': 0, 'turns_saved': 0}
+        # Danh mục bánh: tên bánh tự do -> sku + tên chuẩn
+        self.catalog = Catalog.load()
+        # Token sử dụng theo loại request ('new_full', 'update_delta', 'update_full') + vài request gần nhất
+        self.token_usage: Dict[str, Dict[str, int]] = {}
+        self.recent_usage = deque(maxlen=100)
+        self._register_metrics()
+
+    def _register_metrics(self) -> None:
+        # các bộ đếm sẵn có được đọc lúc render /metrics
+        metrics.callback_metric(
+            'bakery_extractions_total', 'Số lượt trích xuất theo nguồn (fast_path, cache, llm)', ('source',),
+            lambda: {(source,): count for source, count in self.extraction_stats.items()}, kind='counter'
+        )
+        metrics.callback_metric(
+            'bakery_llm_parse_total', 'Kết quả parse output của LLM (ok, repaired, failed)', ('result',),
+            lambda: {(result,): count for result, count in self.parse_stats.items()}, kind='counter'
+        )
+        metrics.callback_metric(
+            'bakery_catalog_resolutions_total', 'Kết quả tra tên bánh trong danh mục', ('result',),
+            lambda: {(result,): count for result, count in self.catalog.counters.items()}, kind='counter'
+        )
+        metrics.callback_metric(
+            'bakery_customer_prefill_total', 'Điền sẵn thông tin khách quen theo số điện thoại', ('event',),
+            lambda: {(event,): count for event, count in self.prefill_stats.items()}, kind='counter'
+        )
+        metrics.callback_metric(
+            'bakery_extraction_cache_events_total', 'Sự kiện của cache trích xuất', ('event',),
+            lambda: {(event,): value for event, value in self.extraction_cache.stats().items()
+                     if event in ('hits', 'misses', 'disk_hits', 'evictions', 'expirations')},
+            kind='counter'
+        )
+        metrics.callback_metric(
+            'bakery_extraction_cache_entries', 'Số phần tử trong cache trích xuất (bộ nhớ)', (),
+            lambda: {(): self.extraction_cache.stats()['size']}
+        )
+
+    def _build_system_prompt(self, existing_order: Optional[Dict[str, Any]] = None) -> str:
         """
-        Phân tích tin nhắn chat và trích xuất thông tin đơn hàng
+        Tạo system prompt cho việc trích xuất / cập nhật đơn hàng
         """
+        if existing_order and self.extraction_mode == 'delta':
+            current = {field: existing_order.get(field) for field in ORDER_FIELDS}
+            current_json = json.dumps(current, ensure_ascii=False, separators=(',', ':'))
+
+            return f"""Bạn là AI assistant cập nhật đơn hàng bánh.
+
+ĐƠN HIỆN TẠI: {current_json}
+
+Đọc tin nhắn mới và CHỈ trả về JSON gồm các field thay đổi hoặc mới xuất hiện trong tin nhắn
+(ten_khach_hang, so_dien_thoai, danh_sach_banh, dia_chi, gio_giao dạng HH:MM, ghi_chu).
+- danh_sach_banh: chỉ các bánh mới hoặc đổi số lượng, dạng [{{"ten_banh": "...", "so_luong": n}}]
+- Không lặp lại field không đổi, không tự sáng tạo. Không có gì thay đổi thì trả về {{}}
+
+Chỉ trả về JSON, không có text khác."""
         if existing_order:
             # Build the prompt carefully to avoid f-string syntax issues
             existing_order_json = json.dumps(existing_order, ensure_ascii=False, indent=2)
-            
-            system_prompt = f"""Bạn là một AI assistant chuyên cập nhật thông tin đơn hàng bánh.
+
+            return f"""Bạn là một AI assistant chuyên cập nhật thông tin đơn hàng bánh.
 
 THÔNG TIN ĐƠN HÀNG HIỆN TẠI:
 {existing_order_json}
@@ -57,8 +346,7 @@ Trả về JSON với cấu trúc chính xác:
     "gio_giao": "...",
     "ghi_chu": "..."
 }}"""
-        else:
-            system_prompt = """Bạn là một AI agent chuyên phân tích tin nhắn chat để trích xuất thông tin đơn hàng bánh.
+        return """Bạn là một AI agent chuyên phân tích tin nhắn chat để trích xuất thông tin đơn hàng bánh.
 
 Nhiệm vụ của bạn là phân tích tin nhắn và trả về thông tin dưới dạng JSON với cấu trúc chính xác như sau:
 
@@ -91,66 +379,174 @@ Quy tắc quan trọng:
 
 Chỉ trả về JSON hợp lệ, không có text khác."""
 
+    def _build_messages(self, message: str, existing_order: Optional[Dict[str, Any]] = None) -> List[Dict[str, str]]:
         user_prompt = f"Phân tích tin nhắn sau: {message}"
+        return [
+            {"role": "system", "content": self._build_system_prompt(existing_order)},
+            {"role": "user", "content": user_prompt}
+        ]
+
+    def _completion_kwargs(self, message: str, existing_order: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        kwargs = {
+            'model': MODEL_NAME,
+            'messages': self._build_messages(message, existing_order),
+            'temperature': 0.1,
+            'max_tokens': 1000
+        }
+        if OPENAI_JSON_MODE:
+            kwargs['response_format'] = JSON_RESPONSE_FORMAT
+        return kwargs
 
+    def _parse_result(self, result_text: str, message: str,
+                      existing_order: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Parse JSON trả về từ LLM và gắn thêm timestamp, tin nhắn gốc.
+        Output hỏng (code fence, text thừa, bị cắt) được sửa cục bộ rồi kiểm tra bằng
+        OrderExtraction thay vì báo lỗi ngay.
+        Ở chế độ delta, kết quả chỉ gồm field thay đổi nên được merge vào đơn hiện tại.
+        """
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.1,
-                max_tokens=1000
-            )
-            
+            data, repaired, truncated = parse_llm_json(result_text)
+            result = validate_extraction(data, truncated)
+        except ValueError:
+            self.parse_stats['failed'] += 1
+            raise
+        self.parse_stats['repaired' if repaired else 'ok'] += 1
+        if result.get('danh_sach_banh'):
+            result['danh_sach_banh'] = self.catalog.normalize_cakes(result['danh_sach_banh'])
+
+        if existing_order and self.extraction_mode == 'delta':
+            delta = {k: v for k, v in result.items() if k in ORDER_FIELDS}
+            result = self.merge_order_info(existing_order, delta)
+            result['id'] = existing_order.get('id')
+
+        # Add timestamp
+        result['timestamp'] = datetime.now().isoformat()
+        result['original_message'] = message
+
+        return result
+
+    def _error_result(self, error: Exception, message: str) -> Dict[str, Any]:
+        return {
+            'error': f'Failed to analyze message: {str(error)}',
+            'timestamp': datetime.now().isoformat(),
+            'original_message': message
+        }
+
+    def _try_fast_path(self, message: str, existing_order: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """
+        Với tin nhắn bổ sung cho đơn đang có, thử trích xuất bằng regex và merge
+        cục bộ bằng merge_order_info. Trả về None nếu phải gọi LLM.
+        """
+        if not existing_order:
+            return None
+        extracted = fast_extract(message, self.catalog)
+        if not extracted:
+            return None
+
+        merged = self.merge_order_info(existing_order, extracted)
+        merged['id'] = existing_order.get('id')
+        merged['original_message'] = message
+        self.extraction_stats['fast_path'] += 1
+        return merged
+
+    def _try_local(self, message: str, existing_order: Optional[Dict[str, Any]], cache_key: str) -> Optional[Dict[str, Any]]:
+        """
+        Trả lời không cần LLM: fast path regex, sau đó tới cache kết quả trích xuất
+        """
+        fast_result = self._try_fast_path(message, existing_order)
+        if fast_result:
+            return fast_result
+
+        cached = self.extraction_cache.get(cache_key)
+        if cached:
+            cached['timestamp'] = datetime.now().isoformat()
+            cached['original_message'] = message
+            self.extraction_stats['cache'] += 1
+            return cached
+        return None
+
+    def _record_usage(self, existing_order: Optional[Dict[str, Any]], usage: Any) -> None:
+        """
+        Ghi lại số token prompt / completion của 1 lần gọi LLM
+        """
+        if usage is None:
+            return
+        kind = f"update_{self.extraction_mode}" if existing_order else 'new_full'
+        totals = self.token_usage.setdefault(kind, {'requests': 0, 'prompt_tokens': 0, 'completion_tokens': 0})
+        totals['requests'] += 1
+        totals['prompt_tokens'] += usage.prompt_tokens or 0
+        totals['completion_tokens'] += usage.completion_tokens or 0
+        LLM_TOKENS.labels('prompt', kind).observe(usage.prompt_tokens or 0)
+        LLM_TOKENS.labels('completion', kind).observe(usage.completion_tokens or 0)
+        self.recent_usage.append({
+            'kind': kind,
+            'prompt_tokens': usage.prompt_tokens,
+            'completion_tokens': usage.completion_tokens,
+            'timestamp': datetime.now().isoformat()
+        })
+
+    def get_extraction_stats(self) -> Dict[str, Any]:
+        total = sum(self.extraction_stats.values())
+        token_usage = {
+            kind: {
+                **totals,
+                'avg_prompt_tokens': totals['prompt_tokens'] / totals['requests'],
+                'avg_completion_tokens': totals['completion_tokens'] / totals['requests']
+            }
+            for kind, totals in self.token_usage.items()
+        }
+        return {
+            **self.extraction_stats,
+            'fast_path_ratio': self.extraction_stats['fast_path'] / total if total else 0.0,
+            'cache_stats': self.extraction_cache.stats(),
+            'extraction_mode': self.extraction_mode,
+            'parse_stats': self.parse_stats,
+            'prefill_stats': self.prefill_stats,
+            'catalog_stats': self.catalog.stats(),
+            'token_usage': token_usage,
+            'recent_usage': list(self.recent_usage)
+        }
+
+    def analyze_message(self, message: str, existing_order: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Phân tích tin nhắn chat và trích xuất thông tin đơn hàng
+        """
+        cache_key = ExtractionCache.make_key(message, existing_order)
+        with metrics.stage('local_extract'):
+            local_result = self._try_local(message, existing_order, cache_key)
+        if local_result:
+            return self.prefill_customer(local_result)
+
+        self.extraction_stats['llm'] += 1
+        try:
+            with metrics.stage('llm'):
+                response = self.client.chat.completions.create(**self._completion_kwargs(message, existing_order))
+
+            self._record_usage(existing_order, response.usage)
+
             # Parse JSON response
-            result_text = response.choices[0].message.content.strip()
-            result = json.loads(result_text)
-            
-            # Add timestamp
-            result['timestamp'] = datetime.now().isoformat()
-            result['original_message'] = message
-            
-            return result
-            
+            with metrics.stage('parse'):
+                result = self._parse_result(response.choices[0].message.content, message, existing_order)
+            self.extraction_cache.set(cache_key, result)
+            return self.prefill_customer(result)
+
         except Exception as e:
-            return {
-                'error': f'Failed to analyze message: {str(e)}',
-                'timestamp': datetime.now().isoformat(),
-                'original_message': message
-            }
-    
+            return self._error_result(e, message)
+
     def save_order_info(self, order_data: Dict[str, Any]) -> bool:
         """
-        Lưu thông tin đơn hàng vào file order_info.json
+        Lưu thông tin đơn hàng mới vào kho đơn nháp (order_info)
         """
         try:
-            file_path = os.path.join(os.path.dirname(__file__), '..', '..', 'order_info.json')
-            
-            # Load existing data if file exists
-            existing_data = []
-            if os.path.exists(file_path) and os.path.getsize(file_path) > 0:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    existing_data = json.load(f)
-            
-            # Generate ID for new order
-            if not existing_data:
-                order_data['id'] = 1
-            else:
-                max_id = max(order.get('id', 0) for order in existing_data)
-                order_data['id'] = max_id + 1
-            
             # Remove timestamp and original_message from saved data
             order_to_save = {k: v for k, v in order_data.items() 
                            if k not in ['timestamp', 'original_message']}
+            order_to_save['updated_at'] = datetime.now().isoformat()
             
-            # Add new order data
-            existing_data.append(order_to_save)
-            
-            # Save back to file
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(existing_data, f, ensure_ascii=False, indent=2)
+            # ID được cấp từ bộ đếm của kho, không cần quét max(id)
+            order_data['id'] = self.draft_store.add(order_to_save)
+            self.order_stats.add_drafts()
             
             return True
             
@@ -158,18 +554,26 @@ Chỉ trả về JSON hợp lệ, không có text khác."""
             print(f"Error saving order info: {str(e)}")
             return False
     
+    def save_orders_batch(self, orders: List[Dict[str, Any]]) -> List[int]:
+        """
+        Lưu nhiều đơn nháp trong 1 lần ghi, các đơn nhận id liên tiếp nhau
+        """
+        updated_at = datetime.now().isoformat()
+        orders_to_save = [{**{k: v for k, v in order.items() if k not in ['timestamp', 'original_message']},
+                           'updated_at': updated_at}
+                          for order in orders]
+        ids = self.draft_store.add_many(orders_to_save)
+        self.order_stats.add_drafts(len(ids))
+        for order, order_id in zip(orders, ids):
+            order['id'] = order_id
+        return ids
+
     def get_all_orders(self) -> list:
         """
-        Lấy tất cả thông tin đơn hàng từ file
+        Lấy tất cả thông tin đơn hàng nháp
         """
         try:
-            file_path = os.path.join(os.path.dirname(__file__), '..', '..', 'order_info.json')
-            
-            if not os.path.exists(file_path) or os.path.getsize(file_path) == 0:
-                return []
-            
-            with open(file_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            return self.draft_store.all()
                 
         except Exception as e:
             print(f"Error reading orders: {str(e)}")
@@ -177,16 +581,10 @@ Chỉ trả về JSON hợp lệ, không có text khác."""
         
     def get_orders(self) -> list:
         """
-        Lấy tất cả thông tin đơn hàng từ file final
+        Lấy tất cả thông tin đơn hàng từ kho final
         """
         try:
-            file_path = os.path.join(os.path.dirname(__file__), '..', '..', 'data_final.json')
-            
-            if not os.path.exists(file_path) or os.path.getsize(file_path) == 0:
-                return []
-            
-            with open(file_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            return self.final_store.all()
                 
         except Exception as e:
             print(f"Error reading orders: {str(e)}")
@@ -203,6 +601,9 @@ Chỉ trả về JSON hợp lệ, không có text khác."""
             if field == 'danh_sach_banh':
                 if not order_data.get(field) or len(order_data[field]) == 0:
                     missing_fields.append(field)
+                elif any(not isinstance(banh.get('so_luong'), int) for banh in order_data[field]):
+                    # output LLM bị cắt: bánh chưa rõ số lượng thì hỏi lại
+                    missing_fields.append('so_luong')
             else:
                 if not order_data.get(field) or order_data[field] == "":
                     missing_fields.append(field)
@@ -223,6 +624,7 @@ Chỉ trả về JSON hợp lệ, không có text khác."""
             'ten_khach_hang': 'tên khách hàng',
             'so_dien_thoai': 'số điện thoại',
             'danh_sach_banh': 'danh sách bánh cần đặt',
+            'so_luong': 'số lượng của từng loại bánh',
             'dia_chi': 'địa chỉ giao hàng',
             'gio_giao': 'giờ giao hàng'
         }
@@ -244,7 +646,7 @@ Chỉ trả về JSON hợp lệ, không có text khác."""
         """
         banh_list = []
         for banh in order_data.get('danh_sach_banh', []):
-            banh_list.append(f"• {banh['ten_banh']} - Số lượng: {banh['so_luong']}")
+            banh_list.append(f"• {banh['ten_banh']} - Số lượng: {banh.get('so_luong') or '?'}")
         
         confirmation_msg = f"""✅ **XÁC NHẬN ĐỚN HÀNG**
 
@@ -265,38 +667,25 @@ Bạn có xác nhận đơn hàng này không? Vui lòng trả lời "Xác nhậ
     
     def save_final_order(self, order_data: Dict[str, Any]) -> bool:
         """
-        Lưu đơn hàng đã xác nhận vào file data_final.json
+        Lưu đơn hàng đã xác nhận vào kho final (data_final)
         """
+        return self._save_final(order_data)
+
+    def _save_final(self, order_data: Dict[str, Any]) -> bool:
+        # phần đồng bộ của save_final_order, bản async chạy hàm này trong thread
         try:
-            file_path = os.path.join(os.path.dirname(__file__), '..', '..', 'data_final.json')
-            
-            # Load existing data if file exists
-            existing_data = []
-            if os.path.exists(file_path) and os.path.getsize(file_path) > 0:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    existing_data = json.load(f)
-            
-            # Generate ID for new order
-            if not existing_data:
-                order_data['id'] = 1
-            else:
-                max_id = max(order.get('id', 0) for order in existing_data)
-                order_data['id'] = max_id + 1
-            
             # Add confirmation timestamp
             order_data['confirmed_at'] = datetime.now().isoformat()
             order_data['status'] = 'confirmed'
             
             # Remove temporary fields
+            order_data['danh_sach_banh'] = self.catalog.normalize_cakes(order_data.get('danh_sach_banh'))
             order_to_save = {k: v for k, v in order_data.items() 
-                           if k not in ['timestamp', 'original_message']}
-            
-            # Add new order data
-            existing_data.append(order_to_save)
+                           if k not in ['timestamp', 'original_message', 'updated_at']}
             
-            # Save back to file
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(existing_data, f, ensure_ascii=False, indent=2)
+            order_data['id'] = self.final_store.add(order_to_save)
+            self.order_stats.add_final(order_to_save)
+            self.customers.add({**order_to_save, 'id': order_data['id']})
             
             return True
             
@@ -304,66 +693,155 @@ Bạn có xác nhận đơn hàng này không? Vui lòng trả lời "Xác nhậ
             print(f"Error saving final order: {str(e)}")
             return False
     
+    def confirm_order(self, order_id: int) -> Dict[str, Any]:
+        """
+        Xác nhận đơn nháp trong 1 giao dịch: đọc đơn, kiểm tra đủ thông tin rồi lưu vào kho final
+        """
+        with self.storage.transaction():
+            target_order = self._find_draft(order_id)
+            if not target_order:
+                return {'error': 'Order not found'}
+
+            completeness_check = self.check_order_completeness(target_order)
+            if not completeness_check['is_complete']:
+                return {'order': target_order, 'missing_fields': completeness_check['missing_fields'], 'saved': False}
+
+            saved = self._save_final(target_order)
+            return {'order': target_order, 'missing_fields': [], 'saved': saved}
+
     def get_confirmed_orders(self) -> list:
         """
-        Lấy tất cả đơn hàng đã xác nhận từ file data_final.json
+        Lấy tất cả đơn hàng đã xác nhận
         """
         try:
-            file_path = os.path.join(os.path.dirname(__file__), '..', '..', 'data_final.json')
-            
-            if not os.path.exists(file_path) or os.path.getsize(file_path) == 0:
-                return []
-            
-            with open(file_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            return self.final_store.all()
                 
         except Exception as e:
             print(f"Error reading confirmed orders: {str(e)}")
             return []
     
+    def orders_version(self, confirmed: bool = False) -> str:
+        """
+        Version của kho đơn nháp / đơn đã xác nhận, đổi sau mỗi lần ghi (dùng cho ETag)
+        """
+        return (self.final_store if confirmed else self.draft_store).version()
+
+    def get_order_stats(self, top: int = 10, days: int = 30) -> Dict[str, Any]:
+        """
+        Thống kê đơn hàng (tổng, theo status, top bánh, theo giờ / ngày, giờ giao) từ bộ đếm
+        """
+        self._refresh_order_stats()
+        return self.order_stats.snapshot(top=top, days=days)
+
+    def rebuild_order_stats(self) -> Dict[str, Any]:
+        """
+        Dựng lại bộ đếm thống kê bằng cách quét lại toàn bộ kho
+        """
+        self.order_stats = OrderStats.build(self.final_store.all(), len(self.draft_store), self.catalog)
+        save_stats(self.order_stats, self.final_store, self.draft_store)
+        return self.order_stats.snapshot()
+
+    def save_order_stats(self) -> None:
+        self._refresh_order_stats()
+        save_stats(self.order_stats, self.final_store, self.draft_store)
+
+    def _refresh_order_stats(self) -> None:
+        # nhiều process cùng ghi: bộ đếm trong process này không thấy đơn do process khác ghi,
+        # số đơn lệch với kho thì quét lại
+        if self.storage.shared and (len(self.final_store) != self.order_stats.finals
+                                    or len(self.draft_store) != self.order_stats.drafts):
+            self.order_stats = OrderStats.build(self.final_store.all(), len(self.draft_store), self.catalog)
+
+    def prefill_customer(self, order_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Đơn đã có số điện thoại nhưng thiếu tên / địa chỉ: điền từ đơn xác nhận gần nhất
+        của số đó (chạy sau trích xuất, trước check_order_completeness)
+        """
+        if 'error' in order_data or not order_data.get('so_dien_thoai'):
+            return order_data
+        missing = [field for field in PREFILL_FIELDS if not order_data.get(field)]
+        if not missing:
+            return order_data
+
+        self.prefill_stats['lookups'] += 1
+        self._refresh_customers()
+        customer = self.customers.get(order_data['so_dien_thoai'])
+        filled = [field for field in missing if customer and customer.get(field)]
+        if not filled:
+            return order_data
+        for field in filled:
+            order_data[field] = customer[field]
+        self.prefill_stats['prefilled'] += 1
+        self.prefill_stats['fields'] += len(filled)
+        if self.check_order_completeness(order_data)['is_complete']:
+            # không điền thì lượt này sẽ phải hỏi lại tên / địa chỉ
+            self.prefill_stats['turns_saved'] += 1
+        return order_data
+
+    def _refresh_customers(self) -> None:
+        # giống _refresh_order_stats: process khác ghi đơn thì dựng lại index
+        if self.storage.shared and len(self.final_store) != self.customers.orders:
+            self.customers = CustomerIndex.build(self.final_store.all())
+
+    def page_final_orders(self, limit: int = 50, cursor: Optional[str] = None, status: Optional[str] = None,
+                          date_from: Optional[str] = None, date_to: Optional[str] = None, q: Optional[str] = None,
+                          sort: str = 'confirmed_at', descending: bool = True) -> Dict[str, Any]:
+        """
+        Lấy 1 trang đơn đã xác nhận (lọc / sắp xếp phía server, phân trang bằng cursor)
+        """
+        return self.final_store.page(sort, descending=descending, limit=limit, cursor=cursor, status=status,
+                                     date_from=date_from, date_to=date_to, q=q)
+
     def update_incomplete_order(self, order_id: int, new_message: str) -> Dict[str, Any]:
         """
         Cập nhật thông tin đơn hàng chưa hoàn chỉnh với thông tin mới
         """
         try:
-            # Get current orders
-            current_orders = self.get_all_orders()
-            target_order = None
-            
-            # Find the order to update
-            for order in current_orders:
-                if order.get('id') == order_id:
-                    target_order = order
-                    break
-            
+            target_order = self.find_order(order_id)
+
             if not target_order:
                 return {'error': 'Order not found'}
-            
+
             # Phân tích thông tin mới với context của đơn hàng cũ
             updated_order = self.analyze_message(new_message, target_order)
-            
+
             if 'error' in updated_order:
                 return updated_order
-            
+
             # Keep the same ID
             updated_order['id'] = order_id
-            
-            # Update the order in the list
-            for i, order in enumerate(current_orders):
-                if order.get('id') == order_id:
-                    current_orders[i] = {k: v for k, v in updated_order.items() 
-                                       if k not in ['timestamp', 'original_message']}
-                    break
-            
-            # Save updated orders
-            file_path = os.path.join(os.path.dirname(__file__), '..', '..', 'order_info.json')
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(current_orders, f, ensure_ascii=False, indent=2)
-            
+            self.replace_order(order_id, updated_order)
+
             return updated_order
-            
+
         except Exception as e:
             return {'error': f'Failed to update order: {str(e)}'}
+
+    def find_order(self, order_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Tìm đơn hàng (chưa xác nhận) theo id
+        """
+        return self._find_draft(order_id)
+
+    def _find_draft(self, order_id: int) -> Optional[Dict[str, Any]]:
+        return self.draft_store.get(order_id)
+
+    def replace_order(self, order_id: int, updated_order: Dict[str, Any]) -> None:
+        """
+        Ghi đè đơn hàng nháp có id tương ứng
+        """
+        self.draft_store.put(order_id, {**{k: v for k, v in updated_order.items()
+                                           if k not in ['timestamp', 'original_message']},
+                                        'updated_at': datetime.now().isoformat()})
+
+    def expire_drafts(self, max_age_hours: float = retention.DRAFT_TTL_HOURS) -> List[int]:
+        """
+        Xoá các đơn nháp bỏ dở quá max_age_hours giờ, trả về id đã xoá
+        """
+        with self.storage.transaction():
+            expired = retention.expire_drafts(self.draft_store, max_age_hours)
+        self.order_stats.add_drafts(-len(expired))
+        return expired
     
     def merge_order_info(self, old_order: Dict[str, Any], new_order: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -406,39 +884,38 @@ Bạn có xác nhận đơn hàng này không? Vui lòng trả lời "Xác nhậ
     
     def merge_banh_list(self, old_list: List[Dict], new_list: List[Dict]) -> List[Dict]:
         """
-        Merge danh sách bánh cũ và mới
+        Merge danh sách bánh cũ và mới, bánh được đưa về sản phẩm trong danh mục
+        nên các cách gõ khác nhau của cùng 1 loại bánh chỉ còn 1 dòng
         """
+        old_list = self.catalog.normalize_cakes(old_list)
+        new_list = self.catalog.normalize_cakes(new_list)
         if not old_list:
             return new_list
         
         if not new_list:
             return old_list
         
-        # Tạo dictionary để dễ merge
+        # Tạo dictionary để dễ merge, khoá là sku (hoặc tên đã bỏ dấu nếu không có trong danh mục)
         merged_dict = {}
         
         # Thêm bánh cũ
         for banh in old_list:
-            ten_banh = banh.get('ten_banh', '').lower().strip()
-            if ten_banh:
-                merged_dict[ten_banh] = {
-                    'ten_banh': banh.get('ten_banh', ''),
-                    'so_luong': banh.get('so_luong', 0)
-                }
+            key = self.catalog.cake_key(banh)
+            if key:
+                merged_dict[key] = dict(banh)
         
         # Merge với bánh mới (bánh mới sẽ override bánh cũ nếu trùng tên)
         for banh in new_list:
-            ten_banh = banh.get('ten_banh', '').lower().strip()
-            if ten_banh:
-                if ten_banh in merged_dict:
-                    # Cập nhật số lượng nếu bánh đã tồn tại
-                    merged_dict[ten_banh]['so_luong'] = banh.get('so_luong', merged_dict[ten_banh]['so_luong'])
-                else:
-                    # Thêm bánh mới
-                    merged_dict[ten_banh] = {
-                        'ten_banh': banh.get('ten_banh', ''),
-                        'so_luong': banh.get('so_luong', 0)
-                    }
+            key = self.catalog.cake_key(banh)
+            if not key:
+                continue
+            if key in merged_dict:
+                # Cập nhật số lượng nếu bánh đã tồn tại
+                if banh.get('so_luong') is not None:
+                    merged_dict[key]['so_luong'] = banh['so_luong']
+            else:
+                # Thêm bánh mới
+                merged_dict[key] = dict(banh)
         
         return list(merged_dict.values())
     
@@ -455,11 +932,7 @@ Bạn có xác nhận đơn hàng này không? Vui lòng trả lời "Xác nhậ
                 order_data = self.analyze_message(message)
             
             if 'error' in order_data:
-                return {
-                    'type': 'error',
-                    'message': f'❌ Có lỗi xảy ra: {order_data["error"]}',
-                    'data': order_data
-                }
+                return self.analysis_error_result(order_data)
             
             # Save order info (for tracking)
             if not order_id:  # Only save new orders
@@ -468,28 +941,8 @@ Bạn có xác nhận đơn hàng này không? Vui lòng trả lời "Xác nhậ
                 # For existing orders, they are already updated in update_incomplete_order method
                 pass
             
-            # Check completeness
-            completeness_check = self.check_order_completeness(order_data)
-            
-            if completeness_check['is_complete']:
-                # Order is complete, ask for confirmation
-                confirmation_msg = self.generate_confirmation_message(order_data)
-                return {
-                    'type': 'confirmation',
-                    'message': confirmation_msg,
-                    'data': order_data,
-                    'order_id': order_data.get('id')
-                }
-            else:
-                # Order is incomplete, ask for missing info
-                missing_info_msg = self.generate_missing_info_question(completeness_check['missing_fields'])
-                return {
-                    'type': 'missing_info',
-                    'message': missing_info_msg,
-                    'data': order_data,
-                    'missing_fields': completeness_check['missing_fields'],
-                    'order_id': order_data.get('id')
-                }
+            with metrics.stage('build_result'):
+                return self.build_process_result(order_data)
                 
         except Exception as e:
             return {
@@ -498,6 +951,40 @@ Bạn có xác nhận đơn hàng này không? Vui lòng trả lời "Xác nhậ
                 'data': {}
             }
     
+    def analysis_error_result(self, order_data: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'type': 'error',
+            'message': f'❌ Có lỗi xảy ra: {order_data["error"]}',
+            'data': order_data
+        }
+
+    def build_process_result(self, order_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Kiểm tra tính đầy đủ và tạo phản hồi (xác nhận hoặc hỏi thêm thông tin)
+        """
+        # Check completeness
+        completeness_check = self.check_order_completeness(order_data)
+        
+        if completeness_check['is_complete']:
+            # Order is complete, ask for confirmation
+            confirmation_msg = self.generate_confirmation_message(order_data)
+            return {
+                'type': 'confirmation',
+                'message': confirmation_msg,
+                'data': order_data,
+                'order_id': order_data.get('id')
+            }
+        else:
+            # Order is incomplete, ask for missing info
+            missing_info_msg = self.generate_missing_info_question(completeness_check['missing_fields'])
+            return {
+                'type': 'missing_info',
+                'message': missing_info_msg,
+                'data': order_data,
+                'missing_fields': completeness_check['missing_fields'],
+                'order_id': order_data.get('id')
+            }
+
     def debug_order_info(self, order_data: Dict[str, Any], stage: str = "") -> None:
         """
         Debug method để log thông tin đơn hàng
@@ -517,13 +1004,449 @@ Bạn có xác nhận đơn hàng này không? Vui lòng trả lời "Xác nhậ
 
     def clear_all_orders(self) -> bool:
         """
-        Xóa tất cả đơn hàng (cho testing)
+        Xóa tất cả đơn hàng nháp (cho testing)
         """
         try:
-            file_path = os.path.join(os.path.dirname(__file__), '..', '..', 'order_info.json')
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump([], f)
+            self.draft_store.clear()
+            self.order_stats.clear_drafts()
             return True
         except Exception as e:
             print(f"Error clearing orders: {str(e)}")
             return False
+
+class AsyncChatbotService(ChatbotService):
+    """
+    Phiên bản async của ChatbotService dùng cho các route FastAPI.
+
+    Gọi LLM qua AsyncOpenAI (dùng chung connection pool) nên không chặn event loop;
+    các thao tác đọc/ghi file được đẩy sang thread và tuần tự hoá bằng 1 asyncio.Lock
+    vì giờ nhiều request có thể chạy xen kẽ nhau.
+    """
+
+    def __init__(self, timeout: Optional[float] = None):
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise ValueError("OPENAI_API_KEY not found in environment variables")
+
+        self.client = openai.AsyncOpenAI(
+            api_key=api_key,
+            http_client=get_shared_http_client(),
+            timeout=timeout if timeout is not None else OPENAI_TIMEOUT,
+            # retry / backoff do scheduler đảm nhận để còn tính vào ngân sách RPM / TPM
+            max_retries=0
+        )
+        self.scheduler = LLMScheduler()
+        self._init_extraction()
+        self._init_storage()
+        self.sessions = SessionManager(shared=self.storage.shared)
+        self._storage_lock = asyncio.Lock()
+        self.committer = get_committer()
+        self._retention_task: Optional[asyncio.Task] = None
+
+    async def _run_storage(self, func, *args):
+        # thời gian tính cả lúc chờ lock, đúng với độ trễ mà request phải chịu
+        with metrics.stage(f'storage.{func.__name__}'):
+            async with self._storage_lock:
+                return await asyncio.to_thread(func, *args)
+
+    async def _run_write(self, func, *args):
+        # thay đổi đã nằm trong bộ nhớ, chờ nhóm chứa nó được ghi xuống đĩa rồi mới trả lời
+        result = await self._run_storage(func, *args)
+        await self.committer.commit()
+        return result
+
+    async def _create_completion(self, user_id: Optional[str], **kwargs) -> Any:
+        """
+        Gọi chat.completions.create qua scheduler (rate limit, chia lượt theo user, retry 429)
+        """
+        tokens = estimate_tokens(kwargs['messages'], kwargs.get('max_tokens', 0))
+        return await self.scheduler.submit(user_id or 'anonymous', tokens,
+                                           lambda: self.client.chat.completions.create(**kwargs))
+
+    def get_extraction_stats(self) -> Dict[str, Any]:
+        return {**super().get_extraction_stats(), 'scheduler': self.scheduler.stats(),
+                'sessions': self.sessions.stats()}
+
+    def _register_metrics(self) -> None:
+        super()._register_metrics()
+        counters = ('submitted', 'completed', 'failed', 'rejected', 'retries', 'rate_limited', 'throttled_waits')
+        metrics.callback_metric(
+            'bakery_llm_scheduler_events_total', 'Sự kiện của scheduler gọi LLM', ('event',),
+            lambda: {(event,): value for event, value in self.scheduler.stats().items() if event in counters},
+            kind='counter'
+        )
+        metrics.callback_metric(
+            'bakery_llm_scheduler_requests', 'Số lời gọi LLM đang xếp hàng / đang chạy', ('state',),
+            lambda: {('queued',): self.scheduler.stats()['queued'],
+                     ('in_flight',): self.scheduler.stats()['in_flight']}
+        )
+        session_counters = ('hits', 'misses', 'created', 'evictions', 'expirations', 'writes', 'writes_skipped')
+        metrics.callback_metric(
+            'bakery_chat_session_events_total', 'Sự kiện của bộ nhớ phiên hội thoại', ('event',),
+            lambda: {(event,): value for event, value in self.sessions.stats().items() if event in session_counters},
+            kind='counter'
+        )
+        metrics.callback_metric(
+            'bakery_chat_sessions', 'Số phiên hội thoại và dung lượng ước lượng (byte) trong bộ nhớ', ('kind',),
+            lambda: {('sessions',): self.sessions.stats()['sessions'], ('bytes',): self.sessions.stats()['bytes']}
+        )
+
+    async def analyze_message(self, message: str, existing_order: Optional[Dict[str, Any]] = None,
+                              user_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Phân tích tin nhắn chat và trích xuất thông tin đơn hàng (async)
+        """
+        cache_key = ExtractionCache.make_key(message, existing_order)
+        with metrics.stage('local_extract'):
+            local_result = self._try_local(message, existing_order, cache_key)
+        if local_result:
+            return await self.prefill_customer(local_result)
+
+        self.extraction_stats['llm'] += 1
+        try:
+            with metrics.stage('llm'):
+                response = await self._create_completion(user_id, **self._completion_kwargs(message, existing_order))
+
+            self._record_usage(existing_order, response.usage)
+            with metrics.stage('parse'):
+                result = self._parse_result(response.choices[0].message.content, message, existing_order)
+            self.extraction_cache.set(cache_key, result)
+            return await self.prefill_customer(result)
+
+        except SchedulerOverloaded:
+            raise
+        except Exception as e:
+            return self._error_result(e, message)
+
+    async def save_order_info(self, order_data: Dict[str, Any]) -> bool:
+        return await self._run_write(super().save_order_info, order_data)
+
+    async def save_orders_batch(self, orders: List[Dict[str, Any]]) -> List[int]:
+        return await self._run_write(super().save_orders_batch, orders)
+
+    async def get_all_orders(self) -> list:
+        return await self._run_storage(super().get_all_orders)
+
+    async def get_orders(self) -> list:
+        return await self._run_storage(super().get_orders)
+
+    async def get_confirmed_orders(self) -> list:
+        return await self._run_storage(super().get_confirmed_orders)
+
+    async def save_final_order(self, order_data: Dict[str, Any]) -> bool:
+        return await self._run_write(self._save_final, order_data)
+
+    async def confirm_order(self, order_id: int) -> Dict[str, Any]:
+        result = await self._run_write(super().confirm_order, order_id)
+        if result.get('saved'):
+            # lượt tiếp theo của user sẽ bắt đầu đơn mới
+            self.sessions.finish_order(order_id)
+        return result
+
+    async def get_order_stats(self, top: int = 10, days: int = 30) -> Dict[str, Any]:
+        return await self._run_storage(super().get_order_stats, top, days)
+
+    async def prefill_customer(self, order_data: Dict[str, Any]) -> Dict[str, Any]:
+        if self.storage.shared:
+            # phải đọc lại kho để thấy đơn của process khác
+            return await self._run_storage(super().prefill_customer, order_data)
+        return super().prefill_customer(order_data)
+
+    async def rebuild_order_stats(self) -> Dict[str, Any]:
+        return await self._run_storage(super().rebuild_order_stats)
+
+    async def page_final_orders(self, limit: int = 50, cursor: Optional[str] = None, status: Optional[str] = None,
+                                date_from: Optional[str] = None, date_to: Optional[str] = None, q: Optional[str] = None,
+                                sort: str = 'confirmed_at', descending: bool = True) -> Dict[str, Any]:
+        return await self._run_storage(super().page_final_orders, limit, cursor, status,
+                                       date_from, date_to, q, sort, descending)
+
+    async def iter_final_orders(self, status: Optional[str] = None, date_from: Optional[str] = None,
+                                date_to: Optional[str] = None, q: Optional[str] = None, descending: bool = False,
+                                batch_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Đơn đã xác nhận theo từng lô (cho export dạng stream), mỗi lô là 1 lần đọc kho
+        nên bộ nhớ không tăng theo số đơn và các request khác vẫn được chen vào giữa
+        """
+        cursor = None
+        while True:
+            page = await self.page_final_orders(limit=batch_size, cursor=cursor, status=status, date_from=date_from,
+                                                date_to=date_to, q=q, descending=descending)
+            if page['items']:
+                yield page['items']
+            cursor = page['next_cursor']
+            if not cursor:
+                return
+
+    async def find_order(self, order_id: int) -> Optional[Dict[str, Any]]:
+        return await self._run_storage(self._find_draft, order_id)
+
+    async def replace_order(self, order_id: int, updated_order: Dict[str, Any]) -> None:
+        return await self._run_write(super().replace_order, order_id, updated_order)
+
+    async def clear_all_orders(self) -> bool:
+        self.sessions.clear()
+        return await self._run_write(super().clear_all_orders)
+
+    async def expire_drafts(self, max_age_hours: float = retention.DRAFT_TTL_HOURS) -> List[int]:
+        expired = await self._run_write(super().expire_drafts, max_age_hours)
+        for order_id in expired:
+            self.sessions.finish_order(order_id)
+        return expired
+
+    def start_retention(self, interval: float = retention.RETENTION_INTERVAL) -> None:
+        """
+        Chạy expire_drafts định kỳ trong nền (gọi lúc app khởi động)
+        """
+        if interval > 0 and self._retention_task is None:
+            self._retention_task = asyncio.create_task(self._retention_loop(interval))
+
+    async def _retention_loop(self, interval: float) -> None:
+        while True:
+            try:
+                expired = await self.expire_drafts()
+                if expired:
+                    print(f"Expired {len(expired)} abandoned draft orders")
+            except Exception as e:
+                print(f"Error expiring draft orders: {str(e)}")
+            await asyncio.sleep(interval)
+
+    async def _load_draft(self, session: Optional[Session], order_id: Optional[int]) -> Optional[Dict[str, Any]]:
+        """
+        Đơn nháp của lượt này: lấy từ phiên nếu có, không thì đọc kho theo order_id
+        """
+        draft = self.sessions.cached_draft(session, order_id)
+        if draft is None and not order_id and session is not None:
+            order_id = session.order_id
+        if draft is None and order_id:
+            draft = await self.find_order(order_id)
+            if draft and session is not None:
+                self.sessions.set_draft(session, draft)
+        return draft
+
+    async def _store_draft(self, session: Optional[Session], target_order: Optional[Dict[str, Any]],
+                           order_data: Dict[str, Any]) -> None:
+        """
+        Ghi đơn nháp xuống kho khi là đơn mới hoặc có field thay đổi, rồi cập nhật phiên
+        """
+        dirty = False
+        if target_order:
+            order_data['id'] = target_order['id']
+            changed = any(order_data.get(field) != target_order.get(field) for field in ORDER_FIELDS)
+            if changed:
+                try:
+                    await self.replace_order(order_data['id'], order_data)
+                except Exception as e:
+                    # draft vẫn nằm trong phiên, sẽ ghi lại khi phiên bị bỏ khỏi bộ nhớ
+                    print(f"Error saving draft order {order_data['id']}: {str(e)}")
+                    dirty = True
+        else:
+            changed = True
+            await self.save_order_info(order_data)
+        self.sessions.record_write(changed)
+
+        if session is not None and order_data.get('id') is not None:
+            self.sessions.set_draft(session, {k: v for k, v in order_data.items()
+                                              if k not in ['timestamp', 'original_message']}, dirty)
+
+    async def _flush_dirty_sessions(self) -> None:
+        for session in self.sessions.pop_dirty():
+            try:
+                await self.replace_order(session.order_id, session.draft)
+            except Exception as e:
+                print(f"Error saving evicted draft order {session.order_id}: {str(e)}")
+
+    async def update_incomplete_order(self, order_id: int, new_message: str,
+                                      user_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Cập nhật đơn hàng chưa hoàn chỉnh (async).
+        Không giữ lock trong lúc chờ LLM để các request khác vẫn đọc/ghi được.
+        """
+        try:
+            target_order = await self.find_order(order_id)
+
+            if not target_order:
+                return {'error': 'Order not found'}
+
+            updated_order = await self.analyze_message(new_message, target_order, user_id)
+
+            if 'error' in updated_order:
+                return updated_order
+
+            updated_order['id'] = order_id
+            await self.replace_order(order_id, updated_order)
+
+            return updated_order
+
+        except SchedulerOverloaded:
+            raise
+        except Exception as e:
+            return {'error': f'Failed to update order: {str(e)}'}
+
+    async def process_order_logic(self, message: str, order_id: Optional[int] = None,
+                                  user_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Xử lý logic chính của đơn hàng (async end-to-end).
+        Có user_id thì đơn nháp lấy từ phiên trong bộ nhớ, không cần gửi order_id.
+        """
+        session = self.sessions.open(user_id) if user_id else None
+        try:
+            async with session.lock if session else nullcontext():
+                target_order = await self._load_draft(session, order_id)
+                if order_id and not target_order:
+                    return self.analysis_error_result({'error': 'Order not found'})
+
+                order_data = await self.analyze_message(message, target_order, user_id)
+
+                if 'error' in order_data:
+                    return self.analysis_error_result(order_data)
+
+                await self._store_draft(session, target_order, order_data)
+
+                with metrics.stage('build_result'):
+                    result = self.build_process_result(order_data)
+                if session is not None:
+                    self.sessions.add_turn(session, message, result['message'])
+                return result
+
+        except SchedulerOverloaded:
+            raise
+        except Exception as e:
+            return {
+                'type': 'error',
+                'message': f'❌ Có lỗi xảy ra khi xử lý đơn hàng: {str(e)}',
+                'data': {}
+            }
+        finally:
+            await self._flush_dirty_sessions()
+
+    async def process_order_events(self, message: str, order_id: Optional[int] = None,
+                                   user_id: Optional[str] = None) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Giống process_order_logic nhưng trả về từng bước xử lý dưới dạng (event, data)
+        để route stream về client qua SSE:
+        started -> field (mỗi field parse được từ completion đang stream)
+        -> completeness -> result (cùng cấu trúc với kết quả của /process)
+        """
+        session = self.sessions.open(user_id) if user_id else None
+        try:
+            async with session.lock if session else nullcontext():
+                async for event in self._order_events(session, message, order_id, user_id):
+                    yield event
+        finally:
+            await self._flush_dirty_sessions()
+
+    async def _order_events(self, session: Optional[Session], message: str, order_id: Optional[int],
+                            user_id: Optional[str]) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        try:
+            target_order = await self._load_draft(session, order_id)
+            yield 'started', {'order_id': target_order['id'] if target_order else order_id}
+            if order_id and not target_order:
+                yield 'result', self.analysis_error_result({'error': 'Order not found'})
+                return
+
+            cache_key = ExtractionCache.make_key(message, target_order)
+            with metrics.stage('local_extract'):
+                order_data = self._try_local(message, target_order, cache_key)
+            if order_data:
+                for name in ORDER_FIELDS:
+                    yield 'field', {'name': name, 'value': order_data.get(name)}
+            else:
+                self.extraction_stats['llm'] += 1
+                parser = PartialJSONFieldParser()
+                with metrics.stage('llm'):
+                    stream = await self._create_completion(
+                        user_id,
+                        **self._completion_kwargs(message, target_order),
+                        stream=True,
+                        stream_options={"include_usage": True}
+                    )
+                    # đóng stream (trả slot của scheduler) cả khi client ngắt giữa chừng
+                    async with aclosing(stream):
+                        async for chunk in stream:
+                            if chunk.usage:
+                                self._record_usage(target_order, chunk.usage)
+                            if not chunk.choices:
+                                continue
+                            delta = chunk.choices[0].delta.content
+                            if not delta:
+                                continue
+                            for name, value in parser.feed(delta):
+                                field = self._stream_field(name, value, target_order)
+                                if field:
+                                    yield 'field', field
+
+                try:
+                    with metrics.stage('parse'):
+                        order_data = self._parse_result(parser.buffer, message, target_order)
+                    self.extraction_cache.set(cache_key, order_data)
+                except Exception as e:
+                    yield 'result', self.analysis_error_result(self._error_result(e, message))
+                    return
+
+            before = {field: order_data.get(field) for field in PREFILL_FIELDS}
+            order_data = await self.prefill_customer(order_data)
+            for name in PREFILL_FIELDS:
+                if order_data.get(name) != before[name]:
+                    yield 'field', {'name': name, 'value': order_data.get(name)}
+
+            await self._store_draft(session, target_order, order_data)
+
+            with metrics.stage('build_result'):
+                result = self.build_process_result(order_data)
+            if session is not None:
+                self.sessions.add_turn(session, message, result['message'])
+            yield 'completeness', {
+                'is_complete': result['type'] == 'confirmation',
+                'missing_fields': result.get('missing_fields', [])
+            }
+            yield 'result', result
+
+        except SchedulerOverloaded as e:
+            # tương đương 503 + Retry-After của /process: client biết là quá tải, thử lại sau
+            retry_after = max(1, round(e.retry_after))
+            yield 'error', {'code': 'overloaded', 'status': 503, 'retry_after': retry_after}
+            yield 'result', {
+                'type': 'error',
+                'code': 'overloaded',
+                'retry_after': retry_after,
+                'message': 'Hệ thống đang quá tải, vui lòng thử lại sau ít phút.',
+                'data': {}
+            }
+        except Exception as e:
+            yield 'result', {
+                'type': 'error',
+                'message': f'❌ Có lỗi xảy ra khi xử lý đơn hàng: {str(e)}',
+                'data': {}
+            }
+
+    def _stream_field(self, name: str, value: Any,
+                      target_order: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """
+        Event 'field' cho 1 field vừa parse được từ completion đang stream, xử lý giống kết quả
+        cuối (ép kiểu, đưa bánh về danh mục, merge vào đơn hiện tại ở chế độ delta).
+        None nếu không phải field của đơn (id...) hoặc giá trị không dùng được.
+        """
+        if name not in ORDER_FIELDS:
+            return None
+        try:
+            value = validate_extraction({name: value}).get(name)
+        except ValueError:
+            return None
+        if name == 'danh_sach_banh' and value:
+            value = self.catalog.normalize_cakes(value)
+        if target_order and self.extraction_mode == 'delta':
+            value = self.merge_order_info(target_order, {name: value})[name]
+        return {'name': name, 'value': value}
+
+    async def aclose(self) -> None:
+        global _shared_http_client
+        if self._retention_task is not None:
+            self._retention_task.cancel()
+            self._retention_task = None
+        await self.scheduler.close()
+        await self.committer.close()
+        await self._run_storage(self.save_order_stats)
+        if _shared_http_client is not None and not _shared_http_client.is_closed:
+            await _shared_http_client.aclose()
+        _shared_http_client = None
@@ -0,0 +1,185 @@
+import asyncio
+import copy
+import json
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Any, List, Optional
+
+# Phiên không có tin nhắn mới sau SESSION_TTL giây bị bỏ khỏi bộ nhớ
+SESSION_TTL = float(os.getenv("SESSION_TTL", "1800"))
+# Tổng dung lượng ước lượng của các phiên, vượt thì bỏ phiên ít dùng nhất (LRU)
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(64 * 1024 * 1024)))
+# Số lượt hội thoại gần nhất giữ lại trong mỗi phiên
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", "20"))
+
+# Phần bộ nhớ cố định của 1 phiên (object, deque, lock...), dùng khi ước lượng dung lượng
+SESSION_OVERHEAD_BYTES = 1024
+
+
+class Session:
+    """
+    Trạng thái hội thoại của 1 user: đơn nháp đang làm và vài lượt gần nhất
+    """
+
+    def __init__(self, user_id: str, max_turns: int = SESSION_MAX_TURNS):
+        self.user_id = user_id
+        self.order_id: Optional[int] = None
+        self.draft: Optional[Dict[str, Any]] = None
+        # draft chưa ghi được xuống kho (lỗi ghi), sẽ ghi lại khi phiên bị bỏ khỏi bộ nhớ
+        self.dirty = False
+        self.turns: deque = deque(maxlen=max_turns)
+        self.last_seen = time.monotonic()
+        self.size = SESSION_OVERHEAD_BYTES
+        # tuần tự hoá các lượt của cùng 1 user (không để 2 request sửa cùng 1 draft)
+        self.lock = asyncio.Lock()
+
+    def estimate_size(self) -> int:
+        size = SESSION_OVERHEAD_BYTES + len(self.user_id)
+        if self.draft:
+            size += len(json.dumps(self.draft, ensure_ascii=False))
+        return size + sum(len(turn['content']) for turn in self.turns)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'user_id': self.user_id,
+            'order_id': self.order_id,
+            'draft': copy.deepcopy(self.draft),
+            'turns': list(self.turns),
+            'idle_seconds': time.monotonic() - self.last_seen
+        }
+
+
+class SessionManager:
+    """
+    Giữ phiên hội thoại của các user đang hoạt động trong bộ nhớ, theo user_id.
+
+    - Lượt tiếp theo lấy đơn nháp từ phiên, không phải đọc lại kho đơn nháp
+    - Phiên rảnh quá ttl giây hết hạn; tổng dung lượng vượt max_bytes thì bỏ phiên
+      ít dùng nhất (LRU) nên bộ nhớ không tăng theo số đơn nháp bị bỏ dở
+    - Phiên bị bỏ mà draft chưa ghi được (dirty) được trả về qua pop_dirty() để ghi lại
+    - shared=True (nhiều process dùng chung kho): process khác có thể đã sửa đơn, phiên chỉ
+      nhớ order_id và lượt nào cũng đọc lại draft từ kho
+    """
+
+    def __init__(self, ttl: float = SESSION_TTL, max_bytes: int = SESSION_MAX_BYTES,
+                 max_turns: int = SESSION_MAX_TURNS, shared: bool = False):
+        self.ttl = ttl
+        self.shared = shared
+        self.max_bytes = max_bytes
+        self.max_turns = max_turns
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._by_order: Dict[int, str] = {}
+        self._bytes = 0
+        self._dirty: List[Session] = []
+        self._stats = {'hits': 0, 'misses': 0, 'created': 0, 'evictions': 0, 'expirations': 0,
+                       'writes': 0, 'writes_skipped': 0}
+
+    def open(self, user_id: str) -> Session:
+        """
+        Lấy phiên của user (tạo mới nếu chưa có hoặc đã hết hạn)
+        """
+        self._expire()
+        session = self._sessions.get(user_id)
+        if session is None:
+            session = Session(user_id, self.max_turns)
+            self._sessions[user_id] = session
+            self._bytes += session.size
+            self._stats['created'] += 1
+        self._sessions.move_to_end(user_id)
+        session.last_seen = time.monotonic()
+        return session
+
+    def get(self, user_id: str) -> Optional[Session]:
+        self._expire()
+        return self._sessions.get(user_id)
+
+    def cached_draft(self, session: Optional[Session], order_id: Optional[int]) -> Optional[Dict[str, Any]]:
+        """
+        Bản sao draft trong phiên nếu khớp order_id (hoặc không truyền order_id), None nếu phải đọc kho
+        """
+        if session is not None and session.draft is not None and order_id in (None, session.order_id) \
+                and (session.dirty or not self.shared):
+            self._stats['hits'] += 1
+            return copy.deepcopy(session.draft)
+        if order_id or (session is not None and session.order_id is not None):
+            self._stats['misses'] += 1
+        return None
+
+    def set_draft(self, session: Session, draft: Optional[Dict[str, Any]], dirty: bool = False) -> None:
+        if session.order_id is not None and self._by_order.get(session.order_id) == session.user_id:
+            del self._by_order[session.order_id]
+        session.draft = copy.deepcopy(draft) if draft else None
+        session.order_id = draft.get('id') if draft else None
+        session.dirty = dirty
+        if session.order_id is not None:
+            self._by_order[session.order_id] = session.user_id
+        self._resize(session)
+
+    def add_turn(self, session: Session, user_message: str, reply: str) -> None:
+        timestamp = time.time()
+        session.turns.append({'role': 'user', 'content': user_message, 'timestamp': timestamp})
+        session.turns.append({'role': 'agent', 'content': reply, 'timestamp': timestamp})
+        self._resize(session)
+
+    def record_write(self, written: bool) -> None:
+        self._stats['writes' if written else 'writes_skipped'] += 1
+
+    def finish_order(self, order_id: int) -> None:
+        """
+        Đơn đã xác nhận: phiên đang giữ đơn đó bắt đầu đơn mới ở lượt sau
+        """
+        user_id = self._by_order.get(order_id)
+        session = self._sessions.get(user_id) if user_id is not None else None
+        if session is not None and session.order_id == order_id:
+            self.set_draft(session, None)
+
+    def order_for(self, user_id: str) -> Optional[int]:
+        session = self.get(user_id)
+        return session.order_id if session else None
+
+    def pop_dirty(self) -> List[Session]:
+        dirty, self._dirty = self._dirty, []
+        return dirty
+
+    def clear(self) -> None:
+        self._sessions.clear()
+        self._by_order.clear()
+        self._dirty.clear()
+        self._bytes = 0
+
+    def _resize(self, session: Session) -> None:
+        size = session.estimate_size()
+        if self._sessions.get(session.user_id) is session:
+            self._bytes += size - session.size
+        session.size = size
+        while self._bytes > self.max_bytes and len(self._sessions) > 1:
+            self._drop(next(iter(self._sessions)), 'evictions')
+
+    def _expire(self) -> None:
+        # phiên ít dùng nhất nằm đầu OrderedDict nên chỉ cần xét từ đầu
+        deadline = time.monotonic() - self.ttl
+        while self._sessions:
+            user_id, session = next(iter(self._sessions.items()))
+            if session.last_seen >= deadline:
+                break
+            self._drop(user_id, 'expirations')
+
+    def _drop(self, user_id: str, reason: str) -> None:
+        session = self._sessions.pop(user_id)
+        self._bytes -= session.size
+        if session.order_id is not None and self._by_order.get(session.order_id) == user_id:
+            del self._by_order[session.order_id]
+        if session.dirty:
+            self._dirty.append(session)
+        self._stats[reason] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self._stats['hits'] + self._stats['misses']
+        return {
+            **self._stats,
+            'sessions': len(self._sessions),
+            'bytes': self._bytes,
+            'max_bytes': self.max_bytes,
+            'hit_ratio': self._stats['hits'] / lookups if lookups else 0.0
+        }
@@ -0,0 +1,118 @@
+import json
+from typing import Any, List, Optional, Tuple
+
+
+def sse_event(event: str, data: Any) -> str:
+    """
+    Định dạng 1 event Server-Sent Events
+    """
+    payload = json.dumps(data, ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+class PartialJSONFieldParser:
+    """
+    Parse dần JSON object đang được stream từ LLM.
+
+    Mỗi lần feed() thêm 1 đoạn text, trả về các field cấp 1 vừa có giá trị hoàn chỉnh
+    (ví dụ ("so_dien_thoai", "0901234567")) để có thể gửi về client ngay, không cần chờ
+    hết completion. Text trước dấu '{' đầu tiên (ví dụ ```json) được bỏ qua.
+    """
+
+    def __init__(self):
+        self.buffer = ''
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._expect = 'key'
+        self._key: Optional[str] = None
+        self._token_start: Optional[int] = None
+        self._value_start: Optional[int] = None
+
+    def feed(self, text: str) -> List[Tuple[str, Any]]:
+        self.buffer += text
+        completed = []
+        while self._pos < len(self.buffer):
+            field = self._step(self.buffer[self._pos])
+            self._pos += 1
+            if field:
+                completed.append(field)
+        return completed
+
+    def _finish_value(self, end: int) -> Optional[Tuple[str, Any]]:
+        raw = self.buffer[self._value_start:end].strip()
+        key = self._key
+        self._key, self._value_start = None, None
+        self._expect = 'comma'
+        try:
+            return key, json.loads(raw)
+        except ValueError:
+            return None
+
+    def _step(self, ch: str) -> Optional[Tuple[str, Any]]:
+        pos = self._pos
+
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif ch == '\\':
+                self._escape = True
+            elif ch == '"':
+                self._in_string = False
+                if self._depth == 1:
+                    if self._expect == 'key':
+                        try:
+                            self._key = json.loads(self.buffer[self._token_start:pos + 1])
+                        except ValueError:
+                            self._key = None
+                        self._expect = 'colon'
+                    elif self._expect == 'value':
+                        return self._finish_value(pos + 1)
+            return None
+
+        if self._depth == 0:
+            if ch == '{':
+                self._depth = 1
+                self._expect = 'key'
+            return None
+
+        if ch == '"':
+            self._in_string = True
+            if self._depth == 1:
+                if self._expect == 'key':
+                    self._token_start = pos
+                elif self._expect == 'value' and self._value_start is None:
+                    self._value_start = pos
+            return None
+
+        if ch in '[{':
+            if self._depth == 1 and self._expect == 'value' and self._value_start is None:
+                self._value_start = pos
+            self._depth += 1
+            return None
+
+        if ch in ']}':
+            self._depth -= 1
+            if self._depth == 1 and self._value_start is not None:
+                return self._finish_value(pos + 1)
+            if self._depth == 0 and self._value_start is not None:
+                # literal/number là field cuối cùng của object
+                return self._finish_value(pos)
+            return None
+
+        if self._depth != 1:
+            return None
+
+        if ch == ':' and self._expect == 'colon':
+            self._expect = 'value'
+        elif ch == ',':
+            field = None
+            if self._expect == 'value' and self._value_start is not None:
+                field = self._finish_value(pos)
+            self._expect = 'key'
+            return field
+        elif self._expect == 'value' and self._value_start is None and not ch.isspace():
+            # number / true / false / null
+            self._value_start = pos
+        return None
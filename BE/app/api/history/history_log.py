@@ -0,0 +1,791 @@
+import base64
+import gzip
+import json
+import os
+import secrets
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Tuple, Iterator
+from app.utils.text import fold_text
+from app.storage.base import HistoryRepository, append_bytes, truncate_file
+from app.storage.file_lock import FileLock
+from app.utils.metrics import count_bytes
+
+# Kích thước tối đa của 1 segment trước khi mở segment mới
+DEFAULT_MAX_SEGMENT_BYTES = int(os.getenv("HISTORY_SEGMENT_MAX_BYTES", str(16 * 1024 * 1024)))
+# Mở segment mới khi sang ngày (UTC): mỗi segment chỉ chứa message của 1 ngày
+HISTORY_ROTATE_DAILY = os.getenv("HISTORY_ROTATE_DAILY", "1") != "0"
+# Segment đã đóng có message cuối cũ hơn số ngày này được nén thành archive (0 = không nén)
+HISTORY_HOT_DAYS = float(os.getenv("HISTORY_HOT_DAYS", "7"))
+# Số archive đã giải nén được giữ trong bộ nhớ
+HISTORY_ARCHIVE_CACHE = int(os.getenv("HISTORY_ARCHIVE_CACHE", "4"))
+
+# nhãn 'store' của metrics số byte đọc / ghi
+METRICS_STORE = 'chat_history'
+
+SEGMENT_PREFIX = 'segment-'
+SEGMENT_SUFFIX = '.jsonl'
+ARCHIVE_SUFFIX = '.jsonl.gz'
+INDEX_FILE = 'index.jsonl'
+MANIFEST_FILE = 'archives.jsonl'
+LOCK_FILE = 'history.lock'
+
+
+class HistoryLog(HistoryRepository):
+    """
+    Lưu lịch sử chat dạng append-only.
+
+    - Message được ghi nối tiếp vào các segment JSONL (segment-000001.jsonl, ...)
+    - File index.jsonl lưu vị trí của từng message: [id, segment, offset, user_id]
+    - Khi khởi động, index được đọc lại để dựng map user_id -> [(id, segment, offset)]
+      trong bộ nhớ, nhờ vậy add_message là O(1) và get_history(user_id)
+      chỉ đọc đúng các bản ghi của user đó.
+    - Id tăng dần theo thời gian ghi nên các danh sách vị trí vừa là thứ tự id
+      vừa là thứ tự timestamp -> phân trang / lọc theo thời gian bằng tìm kiếm nhị phân.
+    - Ở chế độ write_behind, dòng mới nằm trong bộ đệm tới khi sync() (group commit)
+      hoặc tới lần đọc kế tiếp.
+    - shared=True: nhiều process cùng ghi 1 thư mục. Mỗi thao tác giữ flock trên
+      history.lock và đọc bù các dòng index process khác đã ghi thêm, nên id cấp
+      theo bộ đếm chung và offset luôn tính theo kích thước thật của segment.
+    - Segment xoay vòng theo kích thước hoặc theo ngày. archive_cold() nén các segment
+      cũ thành segment-N.jsonl.gz (mô tả trong archives.jsonl: khoảng id, khoảng thời
+      gian, danh sách user) và bỏ chúng khỏi index, nên index trong bộ nhớ và thời gian
+      khởi động chỉ tỷ lệ với lượng message còn "nóng". Archive vẫn đọc được, bỏ qua
+      những archive nằm ngoài khoảng thời gian / không có user cần tìm.
+    """
+
+    def __init__(self, directory: str, legacy_file: Optional[str] = None,
+                 max_segment_bytes: int = DEFAULT_MAX_SEGMENT_BYTES, shared: bool = False,
+                 rotate_daily: bool = HISTORY_ROTATE_DAILY, archive_cache: int = HISTORY_ARCHIVE_CACHE):
+        self.directory = directory
+        self.legacy_file = legacy_file
+        self.max_segment_bytes = max_segment_bytes
+        self.rotate_daily = rotate_daily
+        self.archive_cache = archive_cache
+
+        self._user_offsets: Dict[str, List[Tuple[int, int, int]]] = {}
+        self._entries: List[Tuple[int, int, int]] = []
+        self._next_id = 1
+        self._last_indexed: Optional[Tuple[int, int]] = None
+        self._active_segment = 0
+        self._active_size = 0
+        self._segment_fh = None
+        self._index_fh = None
+        self._pending_segment: List[bytes] = []
+        self._pending_index: List[bytes] = []
+        # số byte của index.jsonl đã đọc vào bộ nhớ
+        self._index_size = 0
+        # tăng mỗi khi có message mới trong bộ nhớ (tổng và theo user), epoch khác nhau mỗi lần mở
+        self._version = 0
+        self._user_versions: Dict[str, int] = {}
+        self._epoch = secrets.token_hex(4)
+        # ngày (YYYY-MM-DD) của message cuối trong segment đang ghi, None = chưa biết
+        self._active_day: Optional[str] = None
+
+        # manifest của các segment đã nén, theo thứ tự segment (cũng là thứ tự id)
+        self._archives: List[Dict[str, Any]] = []
+        self._archive_starts: List[int] = []
+        self._archived: set = set()
+        self._manifest_size = 0
+        # số entry index còn trỏ vào segment đã nén (nén dở khi crash)
+        self._stale_entries = 0
+        # segment -> message đã giải nén, cũ nhất ở đầu
+        self._archive_messages_cache: 'OrderedDict[int, List[Dict[str, Any]]]' = OrderedDict()
+        self._lock = FileLock(os.path.join(directory, LOCK_FILE) if shared else None)
+
+    # ------------------------------------------------------------------
+    # Khởi tạo / phục hồi
+    # ------------------------------------------------------------------
+    def open(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock.hold():
+            fresh = not self._segment_numbers() and not os.path.exists(self._index_path())
+
+            self._load_archives()
+            self._load_index()
+            self._finish_archiving()
+            self._recover_unindexed()
+            self._open_writers()
+
+            # Lần chạy đầu tiên: import dữ liệu từ chat_history.json cũ
+            if fresh and self.legacy_file and os.path.exists(self.legacy_file):
+                self._import_legacy()
+
+    @contextmanager
+    def _locked(self, exclusive: bool = True) -> Iterator[None]:
+        with self._lock.hold(exclusive) as outermost:
+            if outermost and self._lock.shared and self._index_fh is not None:
+                self._catch_up()
+            yield
+
+    def _catch_up(self) -> None:
+        if self._manifest_bytes() != self._manifest_size:
+            # process khác vừa nén segment và viết lại index.jsonl
+            self._load_archives()
+            self._reload_index()
+        elif os.path.getsize(self._index_path()) != self._index_size:
+            # đọc các entry index mà process khác đã ghi thêm
+            self._load_index(self._index_size)
+            self._active_day = None
+        # process khác có thể đã mở segment mới
+        if self._last_indexed and self._last_indexed[0] > self._active_segment:
+            self._segment_fh.close()
+            self._active_segment = self._last_indexed[0]
+            self._segment_fh = open(self._segment_path(self._active_segment), 'ab')
+        self._active_size = os.fstat(self._segment_fh.fileno()).st_size
+
+    def close(self) -> None:
+        with self._lock.hold():
+            if self._segment_fh:
+                self._write_pending()
+            for fh in (self._segment_fh, self._index_fh):
+                if fh:
+                    fh.close()
+            self._segment_fh = None
+            self._index_fh = None
+        self._lock.close()
+
+    def _index_path(self) -> str:
+        return os.path.join(self.directory, INDEX_FILE)
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{segment:06d}{SEGMENT_SUFFIX}")
+
+    def _archive_path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{segment:06d}{ARCHIVE_SUFFIX}")
+
+    def _manifest_path(self) -> str:
+        return os.path.join(self.directory, MANIFEST_FILE)
+
+    def _manifest_bytes(self) -> int:
+        path = self._manifest_path()
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+    def _segment_numbers(self) -> List[int]:
+        if not os.path.isdir(self.directory):
+            return []
+        numbers = []
+        for name in os.listdir(self.directory):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+                try:
+                    numbers.append(int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]))
+                except ValueError:
+                    continue
+        return sorted(numbers)
+
+    def _remember(self, msg_id: int, user_id: str, segment: int, offset: int) -> None:
+        entry = (msg_id, segment, offset)
+        self._user_offsets.setdefault(user_id, []).append(entry)
+        self._entries.append(entry)
+        # không reset khi đọc lại index (sau khi nén) để version không quay về giá trị cũ
+        self._version += 1
+        self._user_versions[user_id] = self._user_versions.get(user_id, 0) + 1
+        if msg_id >= self._next_id:
+            self._next_id = msg_id + 1
+
+    def _load_index(self, start: int = 0) -> None:
+        path = self._index_path()
+        if not os.path.exists(path):
+            return
+        valid_bytes = start
+        segment_sizes: Dict[int, int] = {}
+        with open(path, 'rb') as f:
+            f.seek(start)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # dòng ghi dở khi crash
+                try:
+                    msg_id, segment, offset, user_id = json.loads(line)
+                except (ValueError, TypeError):
+                    break
+                if segment in self._archived:
+                    # segment đã nén nhưng index chưa kịp viết lại
+                    self._stale_entries += 1
+                    valid_bytes += len(line)
+                    continue
+                if segment not in segment_sizes:
+                    segment_path = self._segment_path(segment)
+                    segment_sizes[segment] = os.path.getsize(segment_path) if os.path.exists(segment_path) else 0
+                if offset >= segment_sizes[segment]:
+                    break  # index đã xuống đĩa nhưng segment thì chưa (mất điện giữa 2 lần fsync)
+                self._remember(msg_id, user_id, segment, offset)
+                self._last_indexed = (segment, offset)
+                valid_bytes += len(line)
+        count_bytes(METRICS_STORE, 'read', valid_bytes - start)
+        if valid_bytes != os.path.getsize(path):
+            with open(path, 'r+b') as f:
+                f.truncate(valid_bytes)
+        self._index_size = valid_bytes
+
+    def _recover_unindexed(self) -> None:
+        """
+        Đánh index lại các message đã ghi vào segment nhưng chưa kịp ghi index
+        (ví dụ process bị kill giữa 2 lần ghi), và cắt bỏ dòng ghi dở ở cuối segment.
+        """
+        segments = self._segment_numbers()
+        if not segments:
+            return
+
+        if self._last_indexed:
+            start_segment, start_offset = self._last_indexed
+            with open(self._segment_path(start_segment), 'rb') as f:
+                f.seek(start_offset)
+                start_offset += len(f.readline())
+        else:
+            start_segment, start_offset = segments[0], 0
+
+        pending = []
+        for segment in segments:
+            if segment < start_segment:
+                continue
+            path = self._segment_path(segment)
+            offset = start_offset if segment == start_segment else 0
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break
+                    msg = json.loads(line)
+                    pending.append((msg['id'], segment, offset, msg['user_id']))
+                    offset += len(line)
+            if offset != os.path.getsize(path):
+                with open(path, 'r+b') as f:
+                    f.truncate(offset)
+
+        if pending:
+            with open(self._index_path(), 'ab') as f:
+                for msg_id, segment, offset, user_id in pending:
+                    f.write(self._index_line(msg_id, segment, offset, user_id))
+                    self._remember(msg_id, user_id, segment, offset)
+
+    def _open_writers(self) -> None:
+        segments = self._segment_numbers()
+        if segments:
+            self._active_segment = segments[-1]
+        else:
+            self._active_segment = self._archives[-1]['segment'] + 1 if self._archives else 1
+        path = self._segment_path(self._active_segment)
+        self._segment_fh = open(path, 'ab')
+        self._active_size = os.path.getsize(path)
+        self._index_fh = open(self._index_path(), 'ab')
+        self._index_size = os.fstat(self._index_fh.fileno()).st_size
+        self._active_day = None
+
+    def _reload_index(self) -> None:
+        # đọc lại index.jsonl từ đầu (file đã bị thay bằng bản viết lại)
+        self._user_offsets = {}
+        self._entries = []
+        self._last_indexed = None
+        self._stale_entries = 0
+        self._index_fh.close()
+        self._load_index()
+        self._index_fh = open(self._index_path(), 'ab')
+        self._index_size = os.fstat(self._index_fh.fileno()).st_size
+        self._active_day = None
+
+    def _load_archives(self) -> None:
+        path = self._manifest_path()
+        archives: Dict[int, Dict[str, Any]] = {}
+        valid_bytes = 0
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break
+                    try:
+                        meta = json.loads(line)
+                    except ValueError:
+                        break
+                    meta['users'] = frozenset(meta['users'])
+                    archives[meta['segment']] = meta
+                    valid_bytes += len(line)
+            if valid_bytes != os.path.getsize(path):
+                with open(path, 'r+b') as f:
+                    f.truncate(valid_bytes)
+        self._archives = [archives[segment] for segment in sorted(archives)]
+        self._archive_starts = [meta['first_id'] for meta in self._archives]
+        self._archived = set(archives)
+        self._manifest_size = valid_bytes
+        if self._archives and self._archives[-1]['last_id'] >= self._next_id:
+            self._next_id = self._archives[-1]['last_id'] + 1
+
+    def _finish_archiving(self) -> None:
+        # lần nén trước dừng giữa chừng: bỏ entry của segment đã nén khỏi index, xoá segment gốc
+        if self._stale_entries:
+            self._rewrite_index()
+        for segment in self._segment_numbers():
+            if segment in self._archived:
+                os.remove(self._segment_path(segment))
+
+    def _import_legacy(self) -> None:
+        with open(self.legacy_file, 'r', encoding='utf-8') as f:
+            try:
+                legacy = json.load(f)
+            except json.JSONDecodeError:
+                return
+        for msg in legacy:
+            self._write(msg)
+        self._write_pending()
+
+    # ------------------------------------------------------------------
+    # Ghi
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _index_line(msg_id: int, segment: int, offset: int, user_id: str) -> bytes:
+        return (json.dumps([msg_id, segment, offset, user_id], ensure_ascii=False) + '\n').encode('utf-8')
+
+    def _rotate_if_needed(self, day: str) -> None:
+        if self._active_size == 0:
+            return
+        new_day = self.rotate_daily and day and day != self._current_day()
+        if self._active_size < self.max_segment_bytes and not new_day:
+            return
+        self._write_pending()
+        self._segment_fh.close()
+        self._active_segment += 1
+        self._segment_fh = open(self._segment_path(self._active_segment), 'ab')
+        self._active_size = 0
+
+    def _current_day(self) -> Optional[str]:
+        # sau khi mở / đọc bù index thì lấy ngày từ message cuối của segment đang ghi
+        if self._active_day is None and self._entries and self._entries[-1][1] == self._active_segment:
+            self._write_pending()
+            with SegmentReader(self) as reader:
+                _, segment, offset = self._entries[-1]
+                self._active_day = reader.read(segment, offset).get('timestamp', '')[:10]
+        return self._active_day
+
+    def _write(self, msg: Dict[str, Any]) -> None:
+        day = (msg.get('timestamp') or '')[:10]
+        self._rotate_if_needed(day)
+        line = (json.dumps(msg, ensure_ascii=False) + '\n').encode('utf-8')
+        offset = self._active_size
+        self._pending_segment.append(line)
+        self._active_size += len(line)
+        self._active_day = day
+        self._pending_index.append(self._index_line(msg['id'], self._active_segment, offset, msg['user_id']))
+        self._remember(msg['id'], msg['user_id'], self._active_segment, offset)
+
+    def _write_pending(self) -> None:
+        if not self._pending_segment:
+            return
+        # segment phải được ghi trước index để index không trỏ tới dữ liệu chưa ghi
+        data = b''.join(self._pending_segment)
+        index_data = b''.join(self._pending_index)
+        # _active_size đã tính cả các dòng đang chờ
+        segment_size = self._active_size - len(data)
+        try:
+            append_bytes(self._segment_fh, data)
+            try:
+                append_bytes(self._index_fh, index_data)
+            except OSError:
+                truncate_file(self._index_fh, self._index_size)
+                raise
+        except OSError:
+            # ghi dở (ENOSPC, EIO): bỏ phần đã ghi, giữ bộ đệm (offset trong index vẫn đúng)
+            # để lần sync sau ghi lại
+            truncate_file(self._segment_fh, segment_size)
+            raise
+        self._index_size += len(index_data)
+        self._pending_segment.clear()
+        self._pending_index.clear()
+        count_bytes(METRICS_STORE, 'write', len(data) + len(index_data))
+
+    def sync(self, fsync: bool = False) -> None:
+        """
+        Ghi các message đang chờ (1 lần write cho segment, 1 cho index), fsync nếu cần.
+        Index có thể xuống đĩa trước segment khi mất điện; _load_index bỏ các entry đó.
+        """
+        with self._lock.hold():
+            if self._segment_fh is None:
+                return
+            self._write_pending()
+            fds = [os.dup(fh.fileno()) for fh in (self._segment_fh, self._index_fh)] if fsync else []
+        for fd in fds:
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def append(self, user_id: str, role: str, content: str) -> Dict[str, Any]:
+        """
+        Ghi 1 message mới vào cuối log, trả về message vừa ghi
+        """
+        with self._locked():
+            msg = {
+                "id": self._next_id,
+                "user_id": user_id,
+                "role": role,
+                "content": content,
+                "timestamp": datetime.utcnow().isoformat() + 'Z'
+            }
+            self._write(msg)
+            if not self.write_behind:
+                self._write_pending()
+        return msg
+
+    # ------------------------------------------------------------------
+    # Nén segment cũ
+    # ------------------------------------------------------------------
+    def archive_cold(self, hot_days: float = HISTORY_HOT_DAYS, now: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """
+        Nén các segment đã đóng có message cuối cũ hơn hot_days ngày, trả về manifest
+        của các archive vừa tạo. Thứ tự ghi để crash ở bước nào cũng không mất message:
+        file .gz (ghi tạm rồi rename) -> dòng manifest -> index.jsonl viết lại -> xoá segment gốc.
+        """
+        if hot_days <= 0:
+            return []
+        cutoff = ((now or datetime.utcnow()) - timedelta(days=hot_days)).isoformat() + 'Z'
+        with self._locked():
+            self._write_pending()
+            cold = []
+            with SegmentReader(self) as reader:
+                for segment in self._segment_numbers():
+                    last = self._last_entry(segment)
+                    if segment >= self._active_segment or last is None:
+                        break
+                    if reader.read(segment, last[2]).get('timestamp', '') >= cutoff:
+                        break  # các segment sau còn mới hơn
+                    cold.append(segment)
+
+        # segment đã đóng không còn bị ghi thêm nên nén ngoài lock, không chặn append
+        built = [self._build_archive(segment) for segment in cold]
+        if not built:
+            return []
+
+        with self._locked():
+            # process khác có thể đã nén cùng segment trong lúc này
+            created = [meta for meta in built if meta['segment'] not in self._archived]
+            if created:
+                lines = b''.join((json.dumps({**meta, 'users': sorted(meta['users'])}, ensure_ascii=False)
+                                  + '\n').encode('utf-8') for meta in created)
+                with open(self._manifest_path(), 'ab') as f:
+                    f.write(lines)
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._load_archives()
+
+                self._index_fh.close()
+                self._rewrite_index()
+                self._index_fh = open(self._index_path(), 'ab')
+                self._entries = [entry for entry in self._entries if entry[1] not in self._archived]
+                for user_id in list(self._user_offsets):
+                    kept = [entry for entry in self._user_offsets[user_id] if entry[1] not in self._archived]
+                    if kept:
+                        self._user_offsets[user_id] = kept
+                    else:
+                        del self._user_offsets[user_id]
+            for meta in built:
+                if os.path.exists(self._segment_path(meta['segment'])):
+                    os.remove(self._segment_path(meta['segment']))
+        return created
+
+    def _last_entry(self, segment: int) -> Optional[Tuple[int, int, int]]:
+        # segment tăng dần theo id nên tìm nhị phân được trên _entries
+        position = bisect_right(self._entries, segment, key=lambda entry: entry[1])
+        if position and self._entries[position - 1][1] == segment:
+            return self._entries[position - 1]
+        return None
+
+    def _build_archive(self, segment: int) -> Dict[str, Any]:
+        meta = {'segment': segment, 'count': 0, 'first_id': None, 'last_id': None,
+                'first_ts': None, 'last_ts': None, 'users': set()}
+        path = self._archive_path(segment)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(self._segment_path(segment), 'rb') as src, open(tmp_path, 'wb') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='wb', mtime=0) as dst:
+                for line in src:
+                    if not line.endswith(b'\n'):
+                        break
+                    msg = json.loads(line)
+                    if meta['first_id'] is None:
+                        meta['first_id'], meta['first_ts'] = msg['id'], msg.get('timestamp', '')
+                    meta['last_id'], meta['last_ts'] = msg['id'], msg.get('timestamp', '')
+                    meta['count'] += 1
+                    meta['users'].add(msg['user_id'])
+                    dst.write(line)
+            raw.flush()
+            os.fsync(raw.fileno())
+            count_bytes(METRICS_STORE, 'read', src.tell())
+            count_bytes(METRICS_STORE, 'write', raw.tell())
+        os.replace(tmp_path, path)
+        meta['bytes'] = os.path.getsize(path)
+        return meta
+
+    def _rewrite_index(self) -> None:
+        # giữ lại entry của các segment chưa nén (ghi file tạm rồi thay thế)
+        path = self._index_path()
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        size = 0
+        with open(path, 'rb') as src, open(tmp_path, 'wb') as dst:
+            for line in src:
+                if json.loads(line)[1] not in self._archived:
+                    dst.write(line)
+                    size += len(line)
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.replace(tmp_path, path)
+        self._index_size = size
+        self._stale_entries = 0
+
+    def _archive_messages(self, meta: Dict[str, Any], cache: bool = True) -> List[Dict[str, Any]]:
+        segment = meta['segment']
+        messages = self._archive_messages_cache.get(segment)
+        if messages is not None:
+            self._archive_messages_cache.move_to_end(segment)
+            return messages
+        with gzip.open(self._archive_path(segment), 'rb') as f:
+            messages = [json.loads(line) for line in f.read().splitlines() if line]
+        count_bytes(METRICS_STORE, 'read', meta.get('bytes', 0))
+        if cache and self.archive_cache > 0:
+            self._archive_messages_cache[segment] = messages
+            while len(self._archive_messages_cache) > self.archive_cache:
+                self._archive_messages_cache.popitem(last=False)
+        return messages
+
+    def _matching_archives(self, user_id: Optional[str] = None, since: Optional[str] = None,
+                           until: Optional[str] = None) -> List[Dict[str, Any]]:
+        # bỏ qua archive không có user cần tìm hoặc nằm ngoài khoảng thời gian, không cần giải nén
+        return [meta for meta in self._archives
+                if (not user_id or user_id in meta['users'])
+                and (not since or meta['last_ts'] >= since)
+                and (not until or meta['first_ts'][:len(until)] <= until)]
+
+    def _archived_matches(self, meta: Dict[str, Any], user_id: Optional[str], since: Optional[str],
+                          until: Optional[str], cache: bool = True) -> List[Dict[str, Any]]:
+        # bản sao, vì message trong cache được dùng lại cho các lần đọc sau
+        return [dict(msg) for msg in self._archive_messages(meta, cache)
+                if (not user_id or msg.get('user_id') == user_id)
+                and in_time_range(msg.get('timestamp', ''), since, until)]
+
+    def version(self, user_id: Optional[str] = None) -> str:
+        if self._lock.shared:
+            with self._locked(exclusive=False):
+                return self._version_of(user_id)
+        return self._version_of(user_id)
+
+    def _version_of(self, user_id: Optional[str]) -> str:
+        return f'{self._epoch}.{self._user_versions.get(user_id, 0) if user_id else self._version}'
+
+    def archive_stats(self) -> Dict[str, Any]:
+        with self._locked(exclusive=False):
+            return {
+                'archives': len(self._archives),
+                'archived_messages': sum(meta['count'] for meta in self._archives),
+                'archived_bytes': sum(meta.get('bytes', 0) for meta in self._archives),
+                'hot_segments': len(self._segment_numbers()),
+                'hot_messages': len(self._entries),
+            }
+
+    # ------------------------------------------------------------------
+    # Đọc
+    # ------------------------------------------------------------------
+    def read_user(self, user_id: str, since: Optional[str] = None,
+                  until: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Đọc các message của 1 user: phần đã nén (chỉ các archive có user đó) rồi phần
+        còn nóng theo offset trong index
+        """
+        with self._locked(exclusive=False):
+            self._write_pending()
+            messages = [msg for meta in self._matching_archives(user_id, since, until)
+                        for msg in self._archived_matches(meta, user_id, since, until)]
+            entries = self._user_offsets.get(user_id, [])
+            with SegmentReader(self) as reader:
+                lo, hi = self._time_bounds(entries, reader, since, until)
+                messages.extend(reader.read(segment, offset) for _, segment, offset in entries[lo:hi])
+            return messages
+
+    def read_ids(self, ids: List[int]) -> List[Dict[str, Any]]:
+        """
+        Đọc các message theo id (tìm vị trí trong index hoặc archive bằng tìm kiếm nhị phân)
+        """
+        with self._locked(exclusive=False):
+            self._write_pending()
+            messages = []
+            with SegmentReader(self) as reader:
+                for msg_id in ids:
+                    position = bisect_left(self._entries, (msg_id,))
+                    if position < len(self._entries) and self._entries[position][0] == msg_id:
+                        _, segment, offset = self._entries[position]
+                        messages.append(reader.read(segment, offset))
+                        continue
+                    number = bisect_right(self._archive_starts, msg_id) - 1
+                    if number < 0 or self._archives[number]['last_id'] < msg_id:
+                        continue
+                    archived = self._archive_messages(self._archives[number])
+                    position = bisect_left(archived, msg_id, key=lambda msg: msg['id'])
+                    if position < len(archived) and archived[position]['id'] == msg_id:
+                        messages.append(dict(archived[position]))
+            return messages
+
+    def read_all(self, since: Optional[str] = None, until: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Đọc toàn bộ log theo thứ tự ghi (archive trong khoảng thời gian rồi các segment nóng)
+        """
+        with self._locked(exclusive=False):
+            self._write_pending()
+            # không đưa vào cache: đọc 1 lượt hết các archive sẽ đẩy hết archive đang dùng ra
+            messages = [msg for meta in self._matching_archives(since=since, until=until)
+                        for msg in self._archived_matches(meta, None, since, until, cache=False)]
+            if since or until:
+                with SegmentReader(self) as reader:
+                    lo, hi = self._time_bounds(self._entries, reader, since, until)
+                    messages.extend(reader.read(segment, offset) for _, segment, offset in self._entries[lo:hi])
+                return messages
+            for segment in self._segment_numbers():
+                with open(self._segment_path(segment), 'rb') as f:
+                    for line in f:
+                        if line.endswith(b'\n'):
+                            messages.append(json.loads(line))
+                    count_bytes(METRICS_STORE, 'read', f.tell())
+            return messages
+
+    def page(self, user_id: Optional[str] = None, limit: int = 50, cursor: Optional[str] = None,
+             since: Optional[str] = None, until: Optional[str] = None, role: Optional[str] = None,
+             q: Optional[str] = None, descending: bool = False) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Phân trang theo id (cursor = id cuối của trang trước).
+        since / until (ISO, có thể chỉ là ngày) được giới hạn bằng tìm kiếm nhị phân trên
+        timestamp (archive thì theo khoảng thời gian trong manifest); role và q
+        (không phân biệt dấu) được lọc khi duyệt trang.
+        """
+        with self._locked(exclusive=False):
+            self._write_pending()
+            cursor_id = decode_cursor(cursor) if cursor else None
+            needle = fold_text(q) if q else None
+
+            items: List[Dict[str, Any]] = []
+            has_more = False
+            with SegmentReader(self) as reader:
+                candidates = self._iter_candidates(reader, user_id, since, until, cursor_id, descending)
+                for msg in candidates:
+                    if role and msg.get('role') != role:
+                        continue
+                    if needle and needle not in fold_text(msg.get('content', '')):
+                        continue
+                    items.append(msg)
+                    if len(items) >= limit:
+                        # còn message chưa duyệt thì trả cursor (trang sau có thể rỗng nếu có lọc)
+                        has_more = next(candidates, None) is not None
+                        break
+
+            next_cursor = encode_cursor(items[-1]['id']) if has_more else None
+            return items, next_cursor
+
+    def _iter_candidates(self, reader: 'SegmentReader', user_id: Optional[str], since: Optional[str],
+                         until: Optional[str], cursor_id: Optional[int], descending: bool) -> Iterator[Dict[str, Any]]:
+        """
+        Các message của user_id trong khoảng thời gian, sau cursor, theo thứ tự id:
+        archive (cũ hơn) rồi segment nóng, ngược lại nếu descending
+        """
+        archives = self._matching_archives(user_id, since, until)
+        if cursor_id is not None:
+            archives = [meta for meta in archives
+                        if (meta['first_id'] < cursor_id if descending else meta['last_id'] > cursor_id)]
+
+        def archived(meta):
+            messages = self._archive_messages(meta)
+            if cursor_id is None:
+                positions = range(len(messages))
+            elif descending:
+                positions = range(bisect_left(messages, cursor_id, key=lambda msg: msg['id']))
+            else:
+                positions = range(bisect_right(messages, cursor_id, key=lambda msg: msg['id']), len(messages))
+            for position in (reversed(positions) if descending else positions):
+                msg = messages[position]
+                if (not user_id or msg.get('user_id') == user_id) \
+                        and in_time_range(msg.get('timestamp', ''), since, until):
+                    yield dict(msg)
+
+        entries = self._user_offsets.get(user_id, []) if user_id else self._entries
+        lo, hi = self._time_bounds(entries, reader, since, until)
+        if cursor_id is not None:
+            if descending:
+                hi = min(hi, bisect_left(entries, (cursor_id,)))
+            else:
+                lo = max(lo, bisect_left(entries, (cursor_id + 1,)))
+        positions = range(hi - 1, lo - 1, -1) if descending else range(lo, hi)
+        hot = (reader.read(entries[position][1], entries[position][2]) for position in positions)
+
+        if descending:
+            yield from hot
+            for meta in reversed(archives):
+                yield from archived(meta)
+        else:
+            for meta in archives:
+                yield from archived(meta)
+            yield from hot
+
+    def _time_bounds(self, entries, reader: 'SegmentReader', since: Optional[str],
+                     until: Optional[str]) -> Tuple[int, int]:
+        lo, hi = 0, len(entries)
+        if since:
+            lo = self._bisect_time(entries, reader, lambda ts: ts < since)
+        if until:
+            hi = self._bisect_time(entries, reader, lambda ts: ts[:len(until)] <= until)
+        return lo, hi
+
+    @staticmethod
+    def _bisect_time(entries, reader: 'SegmentReader', before) -> int:
+        """
+        Vị trí đầu tiên mà before(timestamp) là False (timestamp tăng dần theo vị trí)
+        """
+        lo, hi = 0, len(entries)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            _, segment, offset = entries[mid]
+            if before(reader.read(segment, offset).get('timestamp', '')):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+
+def in_time_range(timestamp: str, since: Optional[str] = None, until: Optional[str] = None) -> bool:
+    # cùng quy ước với page(): until chỉ có ngày thì tính cả ngày đó
+    return (not since or timestamp >= since) and (not until or timestamp[:len(until)] <= until)
+
+
+def encode_cursor(msg_id: int) -> str:
+    return base64.urlsafe_b64encode(str(msg_id).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        return int(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+
+class SegmentReader:
+    """
+    Đọc bản ghi theo (segment, offset), giữ file handle của các segment đã mở
+    trong suốt 1 lần truy vấn
+    """
+
+    def __init__(self, log: HistoryLog):
+        self._log = log
+        self._handles = {}
+
+    def read(self, segment: int, offset: int) -> Dict[str, Any]:
+        fh = self._handles.get(segment)
+        if fh is None:
+            fh = self._handles[segment] = open(self._log._segment_path(segment), 'rb')
+        fh.seek(offset)
+        line = fh.readline()
+        count_bytes(METRICS_STORE, 'read', len(line))
+        return json.loads(line)
+
+    def close(self) -> None:
+        for fh in self._handles.values():
+            fh.close()
+        self._handles.clear()
+
+    def __enter__(self) -> 'SegmentReader':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -1,10 +1,21 @@
-from fastapi import APIRouter, HTTPException, status, Query
+from fastapi import APIRouter, HTTPException, status, Query, Request
 from pydantic import BaseModel
-from typing import List, Optional
-from .services import add_message, get_history
+from typing import List, Optional, Union
+from .services import (add_message, get_history, get_history_page, history_version, search_history,
+                       save_search_index, start_retention, stop_retention)
+from app.utils.http_cache import response_cache
 
 router = APIRouter(prefix="/history", tags=["history"])
 
+@router.on_event("startup")
+async def start_history_retention():
+    start_retention()
+
+@router.on_event("shutdown")
+async def close_search_index():
+    stop_retention()
+    await save_search_index()
+
 class MessageIn(BaseModel):
     user_id: str
     role: str  # 'user' hoặc 'agent'
@@ -14,6 +25,19 @@ class MessageOut(MessageIn):
     id: int
     timestamp: str
 
+class MessagePage(BaseModel):
+    items: List[MessageOut]
+    next_cursor: Optional[str] = None
+
+class SearchHit(MessageOut):
+    score: Optional[float] = None
+
+class SearchPage(BaseModel):
+    items: List[SearchHit]
+    next_cursor: Optional[str] = None
+    total: Optional[int] = None  # số kết quả (chỉ có khi sort=relevance)
+    truncated: bool = False      # True: chỉ xếp hạng trong SEARCH_MAX_CANDIDATES kết quả mới nhất
+
 @router.post("/", response_model=MessageOut, status_code=status.HTTP_201_CREATED)
 async def post_message(msg: MessageIn):
     if msg.role not in ("user", "agent"):
@@ -21,7 +45,52 @@ async def post_message(msg: MessageIn):
     saved = await add_message(msg.user_id, msg.role, msg.content)
     return saved
 
-@router.get("/", response_model=List[MessageOut])
-async def read_history(user_id: Optional[str] = Query(None, description="lọc theo user_id")):
-    history = await get_history(user_id)
-    return history
+@router.get("/", response_model=Union[List[MessageOut], MessagePage])
+async def read_history(
+    request: Request,
+    user_id: Optional[str] = Query(None, description="lọc theo user_id"),
+    limit: Optional[int] = Query(None, ge=1, le=500, description="số message mỗi trang; bỏ trống để lấy toàn bộ"),
+    cursor: Optional[str] = Query(None, description="next_cursor của trang trước"),
+    since: Optional[str] = Query(None, description="từ thời điểm (ISO, ví dụ 2025-06-24)"),
+    until: Optional[str] = Query(None, description="đến thời điểm (ISO, tính cả ngày nếu chỉ có ngày)"),
+    role: Optional[str] = Query(None, description="'user' hoặc 'agent'"),
+    q: Optional[str] = Query(None, description="tìm trong nội dung (không phân biệt dấu)"),
+    order: str = Query("asc", pattern="^(asc|desc)$")
+):
+    """
+    Có ETag theo version của lịch sử (của user_id nếu có): If-None-Match -> 304 không đọc log
+    """
+    async def produce():
+        if limit is None:
+            return await get_history(user_id, since, until)
+        items, next_cursor = await get_history_page(
+            user_id=user_id, limit=limit, cursor=cursor, since=since, until=until,
+            role=role, q=q, descending=order == "desc"
+        )
+        return MessagePage(items=items, next_cursor=next_cursor)
+
+    try:
+        return await response_cache.respond(request, history_version(user_id), produce)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/search", response_model=SearchPage)
+async def search_messages(
+    q: str = Query(..., min_length=1, description="từ khoá, không phân biệt dấu ('banh kem' khớp 'bánh kem')"),
+    user_id: Optional[str] = Query(None, description="lọc theo user_id"),
+    role: Optional[str] = Query(None, description="'user' hoặc 'agent'"),
+    since: Optional[str] = Query(None, description="từ thời điểm (ISO, ví dụ 2025-06-24)"),
+    until: Optional[str] = Query(None, description="đến thời điểm (ISO, tính cả ngày nếu chỉ có ngày)"),
+    sort: str = Query("relevance", pattern="^(relevance|recent)$"),
+    limit: int = Query(20, ge=1, le=200),
+    cursor: Optional[str] = Query(None, description="next_cursor của trang trước")
+):
+    """
+    Tìm message chứa mọi từ trong q, xếp theo độ liên quan (BM25, cụm từ liền nhau được
+    ưu tiên) hoặc mới nhất trước
+    """
+    try:
+        return await search_history(q, user_id=user_id, role=role, since=since, until=until,
+                                    sort=sort, limit=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
@@ -0,0 +1,397 @@
+"""
+Chỉ mục tìm kiếm toàn văn cho lịch sử chat.
+
+Dựng lại từ đầu từ kho lịch sử (ghi đè file chỉ mục đã lưu):
+
+    cd BE && python -m app.api.history.search_index --rebuild
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta, timezone
+from math import log
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+from app.storage.base import HistoryRepository, data_path
+from app.utils.text import fold_text
+from .history_log import encode_cursor, decode_cursor
+
+INDEX_FILE = 'chat_search.idx'
+INDEX_VERSION = 2
+# File chỉ mục: dòng magic, 1 dòng header JSON, rồi các mảng dạng byte thô (không dùng pickle
+# nên đọc file không chạy được code)
+INDEX_MAGIC = b'CHATIDX\n'
+# Các mảng song song được lưu theo thứ tự này, kèm typecode cố định
+INDEX_ARRAYS = (('ids', 'q'), ('times', 'd'), ('roles', 'b'), ('lengths', 'H'))
+POSTING_TYPECODE = 'q'
+
+# Số kết quả khớp (mới nhất trước) tối đa được chấm điểm khi sắp xếp theo độ liên quan
+SEARCH_MAX_CANDIDATES = int(os.getenv("SEARCH_MAX_CANDIDATES", "2000"))
+# Số message đọc mỗi lần khi dựng / đọc bù chỉ mục từ kho
+BUILD_BATCH = 5000
+
+# tf được gói vào 3 bit thấp của phần tử posting: (id << 3) | min(tf, 7)
+TF_BITS = 3
+TF_MAX = (1 << TF_BITS) - 1
+
+ROLES = {'user': 1, 'agent': 2}
+# term riêng cho mỗi user_id (không trùng được với âm tiết) để lọc theo user bằng posting list
+USER_TERM = '\x00user:'
+
+# BM25
+K1 = 1.2
+B = 0.75
+
+_SYLLABLE_RE = re.compile(r'[a-z0-9]+')
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Tách âm tiết sau khi bỏ dấu: "Bánh cưới, 2 tầng!" -> ['banh', 'cuoi', '2', 'tang']
+    """
+    return _SYLLABLE_RE.findall(fold_text(text or ''))
+
+
+def index_terms(tokens: List[str]) -> Dict[str, int]:
+    """
+    Âm tiết và cặp âm tiết liền nhau (phần lớn từ tiếng Việt là 1-2 âm tiết: "bánh cưới",
+    "sinh nhật"), kèm số lần xuất hiện
+    """
+    counts: Dict[str, int] = {}
+    for token in tokens:
+        counts[token] = counts.get(token, 0) + 1
+    for first, second in zip(tokens, tokens[1:]):
+        term = f'{first} {second}'
+        counts[term] = counts.get(term, 0) + 1
+    return counts
+
+
+def parse_time(value: str, end: bool = False) -> float:
+    """
+    Mốc thời gian ISO (có thể chỉ là ngày) -> epoch giây (UTC). end=True với ngày không
+    có giờ: tính hết ngày đó
+    """
+    try:
+        moment = datetime.fromisoformat(value.strip().rstrip('Z'))
+    except ValueError:
+        raise ValueError(f'Invalid time: {value}')
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    if end and len(value.strip()) <= 10:
+        moment += timedelta(days=1) - timedelta(microseconds=1)
+    return moment.timestamp()
+
+
+class SearchIndex:
+    """
+    Chỉ mục ngược trong bộ nhớ: term (âm tiết / cặp âm tiết đã bỏ dấu) -> posting list các
+    message id (tăng dần, gói kèm tf). Role, thời gian và độ dài nằm trong các mảng song
+    song theo thứ tự id, nên tìm kiếm không phải đọc file log:
+
+    - Lọc user: user_id cũng là 1 term, ghép như các âm tiết
+    - Lọc thời gian: tìm kiếm nhị phân trên mảng timestamp -> khoảng id
+    - Ghép các term: duyệt posting list ngắn nhất, tra các list còn lại bằng bisect
+    - sort='recent': duyệt từ mới về cũ, dừng khi đủ 1 trang
+    - sort='relevance': chấm BM25 cho tối đa max_candidates kết quả khớp mới nhất;
+      cặp âm tiết liền nhau được cộng điểm nên "bánh cưới" đứng trước "bánh ... cưới"
+    """
+
+    def __init__(self, max_candidates: int = SEARCH_MAX_CANDIDATES):
+        self.max_candidates = max_candidates
+        self._ids = array('q')
+        self._times = array('d')
+        self._roles = array('b')
+        self._lengths = array('H')
+        self._total_length = 0
+        self._users = 0
+        self._postings: Dict[str, array] = {}
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    @property
+    def last_id(self) -> int:
+        return self._ids[-1] if self._ids else 0
+
+    # ------------------------------------------------------------------
+    # Ghi
+    # ------------------------------------------------------------------
+    def add(self, msg: Dict[str, Any]) -> bool:
+        """
+        Thêm 1 message (id phải lớn hơn các id đã có; id cũ được bỏ qua)
+        """
+        with self._lock:
+            msg_id = msg['id']
+            if msg_id <= self.last_id:
+                return False
+            tokens = tokenize(msg.get('content', ''))
+            try:
+                timestamp = parse_time(msg.get('timestamp') or '')
+            except ValueError:
+                timestamp = self._times[-1] if self._times else 0.0
+            terms = index_terms(tokens)
+            terms[USER_TERM + msg.get('user_id', '')] = 1
+
+            self._ids.append(msg_id)
+            self._times.append(timestamp)
+            self._roles.append(ROLES.get(msg.get('role'), 0))
+            self._lengths.append(min(len(tokens), 0xFFFF))
+            self._total_length += len(tokens)
+            for term, tf in terms.items():
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = self._postings[term] = array('q')
+                    if term.startswith(USER_TERM):
+                        self._users += 1
+                postings.append((msg_id << TF_BITS) | min(tf, TF_MAX))
+            return True
+
+    def add_many(self, messages: Iterable[Dict[str, Any]]) -> int:
+        return sum(1 for msg in messages if self.add(msg))
+
+    def catch_up(self, log: HistoryRepository) -> int:
+        """
+        Thêm các message trong kho có id lớn hơn last_id (dựng lần đầu, hoặc message do
+        process khác ghi)
+        """
+        added = 0
+        cursor = encode_cursor(self.last_id) if self.last_id else None
+        while True:
+            items, cursor = log.page(limit=BUILD_BATCH, cursor=cursor)
+            added += self.add_many(items)
+            if not cursor:
+                return added
+
+    # ------------------------------------------------------------------
+    # Tìm
+    # ------------------------------------------------------------------
+    def search(self, q: str, user_id: Optional[str] = None, role: Optional[str] = None,
+               since: Optional[str] = None, until: Optional[str] = None, sort: str = 'relevance',
+               limit: int = 20, cursor: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Tìm các message chứa mọi âm tiết của q (không phân biệt dấu).
+        Trả về {'hits': [(id, score)], 'next_cursor', 'total', 'truncated'}.
+        Cursor: vị trí trong bảng xếp hạng (relevance) hoặc id cuối trang trước (recent).
+        """
+        tokens = tokenize(q)
+        if not tokens:
+            raise ValueError('q must contain letters or digits')
+        if sort not in ('relevance', 'recent'):
+            raise ValueError(f'Invalid sort: {sort}')
+        since_time = parse_time(since) if since else None
+        until_time = parse_time(until, end=True) if until else None
+
+        with self._lock:
+            terms = list(dict.fromkeys(tokens)) + ([USER_TERM + user_id] if user_id else [])
+            required = [self._postings.get(term) for term in terms]
+            if any(postings is None for postings in required):
+                return {'hits': [], 'next_cursor': None, 'total': 0, 'truncated': False}
+            # user term chỉ để lọc, không tính điểm
+            weights = [0.0 if term.startswith(USER_TERM) else self._idf(len(postings))
+                       for term, postings in zip(terms, required)]
+            order = sorted(range(len(required)), key=lambda n: len(required[n]))
+            required = [required[n] for n in order]
+            weights = [weights[n] for n in order]
+            # cặp âm tiết liền nhau: không bắt buộc, có thì cộng điểm
+            optional = [self._postings[term] for term in dict.fromkeys(f'{a} {b}' for a, b in zip(tokens, tokens[1:]))
+                        if term in self._postings] if sort == 'relevance' else []
+            weights += [self._idf(len(postings)) for postings in optional]
+
+            lo_id, hi_id = 1, self.last_id
+            if since_time is not None:
+                position = bisect_left(self._times, since_time)
+                lo_id = self._ids[position] if position < len(self._ids) else hi_id + 1
+            if until_time is not None:
+                position = bisect_right(self._times, until_time)
+                hi_id = self._ids[position - 1] if position else 0
+            if sort == 'recent' and cursor:
+                hi_id = min(hi_id, decode_cursor(cursor) - 1)
+
+            role_code = ROLES.get(role, -1) if role else None
+            want = limit + 1 if sort == 'recent' else self.max_candidates
+            matches = self._match(required, optional, weights, lo_id, hi_id, role_code, want)
+
+            if sort == 'recent':
+                hits = [(msg_id, 0.0) for msg_id, _ in matches[:limit]]
+                next_cursor = encode_cursor(hits[-1][0]) if len(matches) > limit else None
+                return {'hits': hits, 'next_cursor': next_cursor, 'total': None, 'truncated': False}
+
+            matches.sort(key=lambda hit: (-hit[1], -hit[0]))
+            offset = decode_cursor(cursor) if cursor else 0
+            hits = matches[offset:offset + limit]
+            next_cursor = encode_cursor(offset + limit) if offset + limit < len(matches) else None
+            return {'hits': hits, 'next_cursor': next_cursor, 'total': len(matches),
+                    'truncated': len(matches) >= self.max_candidates}
+
+    def _match(self, required: List[array], optional: List[array], weights: List[float], lo_id: int,
+               hi_id: int, role_code: Optional[int], want: int) -> List[Tuple[int, float]]:
+        """
+        Các message (mới nhất trước) có mặt trong mọi list của required và qua bộ lọc,
+        kèm điểm BM25 (weights theo thứ tự required + optional)
+        """
+        if lo_id > hi_id:
+            return []
+        first, rest = required[0], required[1:]
+        start = bisect_left(first, lo_id << TF_BITS)
+        position = bisect_left(first, (hi_id + 1) << TF_BITS)
+        others = rest + optional
+        # các list khác chỉ cần tìm trong khoảng id nhỏ hơn message vừa xét (đi từ mới về cũ)
+        bounds = [bisect_left(postings, (hi_id + 1) << TF_BITS) for postings in others]
+        ids, roles, lengths = self._ids, self._roles, self._lengths
+        # id liền nhau (trường hợp thường gặp): vị trí trong các mảng song song = id - id đầu
+        base = ids[0] if ids and ids[-1] - ids[0] + 1 == len(ids) else None
+        avg_length = self._total_length / len(ids) if ids else 1.0
+        norm_base, norm_scale, k1_plus = K1 * (1 - B), K1 * B / (avg_length or 1.0), K1 + 1
+        need = len(rest)
+        matches = []
+        while position > start and len(matches) < want:
+            position -= 1
+            value = first[position]
+            msg_id = value >> TF_BITS
+            key = msg_id << TF_BITS
+            tfs = [value & TF_MAX]
+            for n, postings in enumerate(others):
+                found = bisect_left(postings, key, 0, bounds[n])
+                bounds[n] = found
+                if found < len(postings) and postings[found] >> TF_BITS == msg_id:
+                    tfs.append(postings[found] & TF_MAX)
+                elif n < need:
+                    break
+                else:
+                    tfs.append(0)
+            else:
+                row = msg_id - base if base is not None else bisect_left(ids, msg_id)
+                if role_code is not None and roles[row] != role_code:
+                    continue
+                norm = norm_base + norm_scale * (lengths[row] or 1)
+                score = sum(weight * tf * k1_plus / (tf + norm) for weight, tf in zip(weights, tfs) if tf)
+                matches.append((msg_id, round(score, 4)))
+        return matches
+
+    def _idf(self, term_count: int) -> float:
+        count = len(self._ids)
+        return log(1 + (count - term_count + 0.5) / (term_count + 0.5))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'messages': len(self._ids), 'terms': len(self._postings) - self._users, 'users': self._users,
+                    'postings': sum(len(postings) for postings in self._postings.values())}
+
+    # ------------------------------------------------------------------
+    # Lưu / đọc file chỉ mục
+    # ------------------------------------------------------------------
+    def save(self, path: str) -> None:
+        with self._lock:
+            header = {
+                'version': INDEX_VERSION, 'byteorder': sys.byteorder, 'total_length': self._total_length,
+                'users': self._users,
+                'arrays': [[name, len(getattr(self, '_' + name))] for name, _ in INDEX_ARRAYS],
+                'postings': [[term, len(postings)] for term, postings in self._postings.items()],
+            }
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(INDEX_MAGIC)
+                f.write(json.dumps(header).encode('ascii') + b'\n')
+                for name, _ in INDEX_ARRAYS:
+                    f.write(getattr(self, '_' + name).tobytes())
+                for postings in self._postings.values():
+                    f.write(postings.tobytes())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional['SearchIndex']:
+        """
+        Đọc file chỉ mục; file cũ (pickle), sai phiên bản hoặc hỏng thì trả về None để dựng lại
+        """
+        try:
+            with open(path, 'rb') as f:
+                if f.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+                    return None
+                header = json.loads(f.readline())
+                if header.get('version') != INDEX_VERSION:
+                    return None
+                swap = header['byteorder'] != sys.byteorder
+                index = cls()
+                for (name, typecode), (saved_name, count) in zip(INDEX_ARRAYS, header['arrays'], strict=True):
+                    if saved_name != name:
+                        raise ValueError(f"unexpected array {saved_name}")
+                    setattr(index, '_' + name, _read_array(f, typecode, count, swap))
+                index._postings = {term: _read_array(f, POSTING_TYPECODE, count, swap)
+                                   for term, count in header['postings']}
+                if f.read(1):
+                    raise ValueError("trailing data")
+                if len({len(getattr(index, '_' + name)) for name, _ in INDEX_ARRAYS}) != 1:
+                    raise ValueError("array lengths differ")
+                index._total_length, index._users = int(header['total_length']), int(header['users'])
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Error loading search index: {str(e)}")
+            return None
+        return index
+
+
+def _read_array(f, typecode: str, count: int, swap: bool) -> array:
+    """
+    Đọc đúng count phần tử kiểu typecode từ file
+    """
+    values = array(typecode)
+    data = f.read(count * values.itemsize)
+    if len(data) != count * values.itemsize:
+        raise ValueError("truncated index file")
+    values.frombytes(data)
+    if swap:
+        values.byteswap()
+    return values
+
+
+def open_index(log: HistoryRepository, path: Optional[str] = None) -> SearchIndex:
+    """
+    Đọc chỉ mục đã lưu rồi đọc bù các message mới hơn; chưa có (hoặc kho đã bị
+    làm lại, id cuối của chỉ mục vượt kho) thì dựng từ đầu
+    """
+    path = path or data_path(INDEX_FILE)
+    index = SearchIndex.load(path)
+    if index is not None and index.last_id:
+        newest, _ = log.page(limit=1, descending=True)
+        if not newest or newest[0]['id'] < index.last_id:
+            index = None
+    index = index or SearchIndex()
+    index.catch_up(log)
+    return index
+
+
+def main():
+    from app.storage.factory import get_backend
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rebuild', action='store_true', help="bỏ chỉ mục cũ, dựng lại từ kho")
+    parser.add_argument('--search', help="thử 1 truy vấn")
+    args = parser.parse_args()
+
+    backend = get_backend()
+    try:
+        start = time.perf_counter()
+        index = SearchIndex() if args.rebuild else open_index(backend.history())
+        if args.rebuild:
+            index.catch_up(backend.history())
+        index.save(data_path(INDEX_FILE))
+        print(f"{index.stats()} trong {time.perf_counter() - start:.1f}s")
+        if args.search:
+            start = time.perf_counter()
+            result = index.search(args.search)
+            print(f"{result['total']} kết quả trong {(time.perf_counter() - start) * 1000:.1f} ms")
+            for msg in backend.history().read_ids([msg_id for msg_id, _ in result['hits']]):
+                print(f"  [{msg['id']}] {msg['user_id']} {msg['role']}: {msg['content'][:100]}")
+    finally:
+        backend.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,53 +1,130 @@
-import json
-import os
 import asyncio
-from datetime import datetime
-from typing import Dict, Any, List, Optional
-
-# file path để lưu cache
-DATA_FILE = os.path.join(os.path.dirname(__file__), '..', '..', 'chat_history.json')
+from typing import Dict, Any, List, Optional, Tuple
+from app.storage.base import HistoryRepository, data_path
+from app.storage.factory import get_backend, get_committer
+from app.storage.retention import RETENTION_INTERVAL
+from app.utils import metrics
+from .history_log import HISTORY_HOT_DAYS
+from .search_index import INDEX_FILE, SearchIndex, open_index
 
 # lock để đảm bảo thread-safe khi ghi file
 _lock = asyncio.Lock()
+# chỉ mục tìm kiếm, mở / dựng ở lần tìm đầu tiên
+_search_index: Optional[SearchIndex] = None
+# task nén lịch sử cũ định kỳ
+_retention_task: Optional[asyncio.Task] = None
 
-async def _load_history() -> List[Dict[str, Any]]:
-    if not os.path.exists(DATA_FILE):
-        return []
-    async with _lock:
-        with open(DATA_FILE, 'r', encoding='utf-8') as f:
-            try:
-                return json.load(f)
-            except json.JSONDecodeError:
-                return []
-
-async def _save_history(history: List[Dict[str, Any]]):
-    async with _lock:
-        with open(DATA_FILE, 'w', encoding='utf-8') as f:
-            json.dump(history, f, ensure_ascii=False, indent=2)
+def _get_log() -> HistoryRepository:
+    # kho lịch sử của backend đang dùng (JSONL segment hoặc SQLite), mở 1 lần rồi giữ lại
+    return get_backend().history()
 
 async def add_message(user_id: str, role: str, content: str) -> Dict[str, Any]:
     """
     Thêm 1 message mới vào history, trả về message vừa thêm
     role: 'user' hoặc 'agent'
     """
-    history = await _load_history()
-    msg = {
-        "id": len(history) + 1,
-        "user_id": user_id,
-        "role": role,
-        "content": content,
-        "timestamp": datetime.utcnow().isoformat() + 'Z'
-    }
-    history.append(msg)
-    await _save_history(history)
-    return msg
-
-async def get_history(user_id: Optional[str] = None) -> List[Dict[str, Any]]:
-    """
-    Lấy toàn bộ lịch sử.
-    Nếu có user_id thì filter theo user.
-    """
-    history = await _load_history()
-    if user_id:
-        history = [m for m in history if m["user_id"] == user_id]
-    return history
+    with metrics.stage('history.add_message'):
+        async with _lock:
+            message = _get_log().append(user_id, role, content)
+            if _search_index is not None:
+                _search_index.add(message)
+        # ghi xuống đĩa cùng nhóm với các message / đơn hàng của request khác
+        await get_committer().commit()
+        return message
+
+async def get_history(user_id: Optional[str] = None, since: Optional[str] = None,
+                      until: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Lấy toàn bộ lịch sử (kể cả phần đã nén).
+    Nếu có user_id thì chỉ đọc các message của user đó; since / until (ISO) giới hạn
+    theo thời gian, archive nằm ngoài khoảng được bỏ qua không cần giải nén.
+    """
+    with metrics.stage('history.get_history'):
+        async with _lock:
+            log = _get_log()
+            if user_id:
+                return log.read_user(user_id, since, until)
+            return log.read_all(since, until)
+
+def history_version(user_id: Optional[str] = None) -> str:
+    """
+    Version của lịch sử (của user_id nếu có), đổi khi có message mới - dùng cho ETag
+    """
+    return _get_log().version(user_id)
+
+async def get_history_page(user_id: Optional[str] = None, limit: int = 50, cursor: Optional[str] = None,
+                           since: Optional[str] = None, until: Optional[str] = None,
+                           role: Optional[str] = None, q: Optional[str] = None,
+                           descending: bool = False) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Lấy 1 trang lịch sử (phân trang bằng cursor), trả về (items, next_cursor)
+    """
+    with metrics.stage('history.get_history_page'):
+        async with _lock:
+            return _get_log().page(user_id=user_id, limit=limit, cursor=cursor, since=since,
+                                   until=until, role=role, q=q, descending=descending)
+
+async def search_history(q: str, user_id: Optional[str] = None, role: Optional[str] = None,
+                         since: Optional[str] = None, until: Optional[str] = None, sort: str = 'relevance',
+                         limit: int = 20, cursor: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Tìm message theo nội dung qua chỉ mục ngược, trả về {items, next_cursor, total, truncated};
+    mỗi item có thêm 'score' khi sắp xếp theo độ liên quan
+    """
+    global _search_index
+    with metrics.stage('history.search'):
+        async with _lock:
+            if _search_index is None:
+                _search_index = await asyncio.to_thread(open_index, _get_log())
+            elif get_backend().shared:
+                # message do process khác ghi
+                await asyncio.to_thread(_search_index.catch_up, _get_log())
+            result = _search_index.search(q, user_id=user_id, role=role, since=since, until=until,
+                                          sort=sort, limit=limit, cursor=cursor)
+            scores = dict(result['hits'])
+            items = _get_log().read_ids([msg_id for msg_id, _ in result['hits']])
+        if sort == 'relevance':
+            for msg in items:
+                msg['score'] = scores[msg['id']]
+        return {'items': items, 'next_cursor': result['next_cursor'], 'total': result['total'],
+                'truncated': result['truncated']}
+
+async def save_search_index() -> None:
+    """
+    Lưu chỉ mục tìm kiếm để lần khởi động sau chỉ phải đọc bù message mới
+    """
+    if _search_index is None:
+        return
+    try:
+        await asyncio.to_thread(_search_index.save, data_path(INDEX_FILE))
+    except Exception as e:
+        print(f"Error saving search index: {str(e)}")
+
+async def archive_history(hot_days: float = HISTORY_HOT_DAYS) -> List[Dict[str, Any]]:
+    """
+    Nén các segment lịch sử cũ hơn hot_days ngày. Không giữ _lock: log tự khoá lúc chọn
+    segment và lúc cập nhật index, phần nén chạy song song với add_message.
+    """
+    return await asyncio.to_thread(_get_log().archive_cold, hot_days)
+
+async def _retention_loop(interval: float) -> None:
+    while True:
+        try:
+            archives = await archive_history()
+            if archives:
+                print(f"Archived {len(archives)} history segments "
+                      f"({sum(meta['count'] for meta in archives)} messages)")
+        except Exception as e:
+            print(f"Error archiving chat history: {str(e)}")
+        await asyncio.sleep(interval)
+
+def start_retention(interval: float = RETENTION_INTERVAL) -> None:
+    global _retention_task
+    if interval > 0 and _retention_task is None:
+        _retention_task = asyncio.create_task(_retention_loop(interval))
+
+def stop_retention() -> None:
+    global _retention_task
+    if _retention_task is not None:
+        _retention_task.cancel()
+        _retention_task = None
@@ -0,0 +1,92 @@
+import os
+import time
+import uuid
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from starlette.routing import Match
+from app.utils import metrics
+
+router = APIRouter(tags=["metrics"])
+
+# Request chậm hơn ngưỡng này (giây) được in ra kèm thời gian từng bước
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "2"))
+
+REQUEST_SECONDS = metrics.histogram(
+    'http_request_duration_seconds', 'Thời gian xử lý HTTP request', ('method', 'path', 'status')
+)
+REQUEST_HEADER = b'x-request-id'
+
+
+def route_path(scope) -> str:
+    """
+    Mẫu path của route đã xử lý request ('/chatbot/sessions/{user_id}'), để mỗi giá trị
+    path parameter không tạo thêm 1 series metrics; 'unmatched' nếu không khớp route nào
+    """
+    if not scope.get('endpoint'):
+        return 'unmatched'
+    partial = None
+    for route in getattr(scope.get('app'), 'routes', ()):
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+        if match == Match.PARTIAL and partial is None:
+            partial = route.path  # đúng path, sai method (405)
+    return partial or 'unmatched'
+
+
+class RequestMetricsMiddleware:
+    """
+    ASGI middleware: gán X-Request-ID cho mỗi request (giữ nguyên nếu client đã gửi),
+    đo thời gian request và gom thời gian từng bước (metrics.stage) của request đó.
+    Response có header X-Request-ID và Server-Timing; request chậm được in ra stdout.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get('headers') or [])
+        request_id = headers.get(REQUEST_HEADER, b'').decode('latin-1')[:64] or uuid.uuid4().hex
+        trace = []
+        rid_token = metrics.request_id_var.set(request_id)
+        trace_token = metrics.trace_var.set(trace)
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                response_headers = list(message.get('headers') or [])
+                response_headers.append((REQUEST_HEADER, request_id.encode('latin-1')))
+                if trace:
+                    timing = ', '.join(f'{name.replace(".", "-")};dur={seconds * 1000:.1f}' for name, seconds in trace)
+                    response_headers.append((b'server-timing', timing.encode('latin-1')))
+                message = {**message, 'headers': response_headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            # nhãn theo mẫu path của route, request không khớp route nào (404) gom chung
+            path = route_path(scope)
+            REQUEST_SECONDS.labels(scope['method'], path, str(status)).observe(elapsed)
+            if elapsed >= SLOW_REQUEST_SECONDS:
+                stages = ' '.join(f'{name}={seconds:.3f}s' for name, seconds in trace)
+                print(f"[slow request] id={request_id} {scope['method']} {scope['path']} "
+                      f"status={status} total={elapsed:.3f}s {stages}")
+            metrics.trace_var.reset(trace_token)
+            metrics.request_id_var.reset(rid_token)
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Metrics dạng Prometheus text format
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
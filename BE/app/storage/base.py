@@ -0,0 +1,242 @@
+import os
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Tuple, Callable, Iterator
+
+# Thư mục chứa dữ liệu mặc định (BE/app), đổi được bằng biến môi trường DATA_DIR
+DEFAULT_DATA_DIR = os.path.normpath(os.path.join(os.path.dirname(__file__), '..'))
+# Nhiều process (uvicorn --workers N, nhiều bản chạy trên 1 máy) cùng dùng 1 kho dữ liệu
+STORAGE_MULTI_PROCESS = os.getenv("STORAGE_MULTI_PROCESS", "0").lower() in ("1", "true", "yes")
+
+
+def get_data_dir() -> str:
+    return os.getenv('DATA_DIR') or DEFAULT_DATA_DIR
+
+
+def data_path(file_name: str, data_dir: Optional[str] = None) -> str:
+    return os.path.join(data_dir or get_data_dir(), file_name)
+
+
+def append_bytes(fh, data: bytes) -> None:
+    """
+    Ghi hết data vào cuối file mở ở chế độ 'ab' bằng os.write, không qua bộ đệm của fh:
+    lỗi giữa chừng (ENOSPC, EIO) thì không còn byte nào nằm lại trong bộ đệm để bị ghi sau
+    """
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fh.fileno(), view):]
+
+
+def truncate_file(fh, size: int) -> None:
+    """
+    Cắt file về size byte (bỏ phần ghi dở sau lỗi); lỗi thì chỉ in ra, lần mở sau
+    vẫn bỏ dòng ghi dở ở cuối
+    """
+    try:
+        os.ftruncate(fh.fileno(), size)
+    except OSError as e:
+        print(f"Error truncating {fh.name}: {str(e)}")
+
+
+class OrderRepository(ABC):
+    """
+    Kho đơn hàng (đơn nháp hoặc đơn đã xác nhận), id do kho cấp và tăng dần
+    """
+
+    # True: thay đổi được giữ trong bộ đệm tới khi sync() (group commit), False: ghi ngay
+    write_behind = False
+
+    def sync(self, fsync: bool = False) -> None:
+        """
+        Ghi xuống đĩa các thay đổi còn trong bộ đệm (write-behind)
+        """
+
+    @abstractmethod
+    def open(self) -> None: ...
+
+    @abstractmethod
+    def close(self) -> None: ...
+
+    @abstractmethod
+    def add(self, order: Dict[str, Any]) -> int: ...
+
+    @abstractmethod
+    def add_many(self, orders: List[Dict[str, Any]]) -> List[int]: ...
+
+    @abstractmethod
+    def put(self, order_id: int, order: Dict[str, Any]) -> None: ...
+
+    @abstractmethod
+    def delete(self, order_id: int) -> bool: ...
+
+    @abstractmethod
+    def clear(self) -> None: ...
+
+    @abstractmethod
+    def get(self, order_id: int) -> Optional[Dict[str, Any]]: ...
+
+    @abstractmethod
+    def all(self) -> List[Dict[str, Any]]: ...
+
+    @abstractmethod
+    def __len__(self) -> int: ...
+
+    @property
+    @abstractmethod
+    def next_id(self) -> int: ...
+
+    @abstractmethod
+    def version(self) -> str:
+        """
+        Phiên bản dữ liệu của kho, đổi sau mỗi lần ghi (kể cả của process khác) và khác
+        nhau giữa các lần khởi động - dùng để dựng ETag mà không phải đọc dữ liệu
+        """
+
+    @abstractmethod
+    def page(self, sort: str, descending: bool = False, limit: int = 50, cursor: Optional[str] = None,
+             status: Optional[str] = None, date_from: Optional[str] = None, date_to: Optional[str] = None,
+             q: Optional[str] = None, date_index: str = 'confirmed_at') -> Dict[str, Any]: ...
+
+
+class HistoryRepository(ABC):
+    """
+    Kho lịch sử chat, message có id tăng dần theo thứ tự ghi
+    """
+
+    write_behind = False
+
+    def sync(self, fsync: bool = False) -> None:
+        """
+        Ghi xuống đĩa các message còn trong bộ đệm (write-behind)
+        """
+
+    @abstractmethod
+    def open(self) -> None: ...
+
+    @abstractmethod
+    def close(self) -> None: ...
+
+    @abstractmethod
+    def append(self, user_id: str, role: str, content: str) -> Dict[str, Any]: ...
+
+    def archive_cold(self, hot_days: float) -> List[Dict[str, Any]]:
+        """
+        Nén phần lịch sử cũ hơn hot_days ngày, trả về mô tả các archive vừa tạo
+        (backend không cần nén thì không làm gì)
+        """
+        return []
+
+    @abstractmethod
+    def read_user(self, user_id: str, since: Optional[str] = None,
+                  until: Optional[str] = None) -> List[Dict[str, Any]]: ...
+
+    @abstractmethod
+    def read_all(self, since: Optional[str] = None, until: Optional[str] = None) -> List[Dict[str, Any]]: ...
+
+    @abstractmethod
+    def read_ids(self, ids: List[int]) -> List[Dict[str, Any]]:
+        """
+        Đọc các message theo id, giữ thứ tự của ids (bỏ qua id không có)
+        """
+
+    @abstractmethod
+    def page(self, user_id: Optional[str] = None, limit: int = 50, cursor: Optional[str] = None,
+             since: Optional[str] = None, until: Optional[str] = None, role: Optional[str] = None,
+             q: Optional[str] = None, descending: bool = False) -> Tuple[List[Dict[str, Any]], Optional[str]]: ...
+
+    @abstractmethod
+    def version(self, user_id: Optional[str] = None) -> str:
+        """
+        Giống OrderRepository.version; có user_id thì chỉ đổi khi user đó có message mới
+        """
+
+
+class StorageBackend(ABC):
+    """
+    1 backend lưu trữ: cấp các kho đơn hàng theo tên ('order_info', 'data_final')
+    và kho lịch sử chat. Các kho đã mở được giữ lại để ChatbotService và
+    history services dùng chung.
+    """
+
+    # backend có hỗ trợ gom ghi (group commit) qua set_write_behind() / sync() không
+    supports_write_behind = False
+
+    def __init__(self):
+        # True: process khác có thể ghi cùng kho, không được tin dữ liệu cache trong process
+        self.shared = STORAGE_MULTI_PROCESS
+        self._orders: Dict[str, OrderRepository] = {}
+        self._history: Optional[HistoryRepository] = None
+        self._lock = threading.RLock()
+        self._write_behind = False
+
+    @abstractmethod
+    def _create_orders(self, name: str,
+                       indexes: Optional[Dict[str, Callable[[Dict[str, Any]], Any]]]) -> OrderRepository: ...
+
+    @abstractmethod
+    def _create_history(self) -> HistoryRepository: ...
+
+    def orders(self, name: str,
+               indexes: Optional[Dict[str, Callable[[Dict[str, Any]], Any]]] = None) -> OrderRepository:
+        with self._lock:
+            if name not in self._orders:
+                store = self._create_orders(name, indexes)
+                store.open()
+                store.write_behind = self._write_behind
+                self._orders[name] = store
+            return self._orders[name]
+
+    def history(self) -> HistoryRepository:
+        with self._lock:
+            if self._history is None:
+                history = self._create_history()
+                history.open()
+                history.write_behind = self._write_behind
+                self._history = history
+            return self._history
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        """
+        Gom nhiều thao tác đọc/ghi thành 1 giao dịch. Backend JSON chỉ tuần tự hoá
+        bằng lock; backend SQLite commit / rollback cả khối.
+        """
+        with self._lock:
+            yield
+
+    def _stores(self) -> List[Any]:
+        stores: List[Any] = list(self._orders.values())
+        if self._history is not None:
+            stores.append(self._history)
+        return stores
+
+    def set_write_behind(self, enabled: bool) -> None:
+        """
+        Bật / tắt chế độ write-behind cho mọi kho (đang mở và mở sau này).
+        Khi bật, thay đổi chỉ nằm trong bộ đệm tới lần sync() kế tiếp.
+        """
+        with self._lock:
+            self._write_behind = enabled
+            for store in self._stores():
+                store.write_behind = enabled
+                if not enabled:
+                    store.sync()
+
+    def sync(self, fsync: bool = False) -> None:
+        """
+        Ghi bộ đệm của tất cả các kho xuống đĩa (1 lần ghi cho mỗi file), fsync nếu cần
+        """
+        with self._lock:
+            stores = self._stores()
+        for store in stores:
+            store.sync(fsync)
+
+    def close(self) -> None:
+        with self._lock:
+            for store in self._orders.values():
+                store.close()
+            self._orders.clear()
+            if self._history is not None:
+                self._history.close()
+                self._history = None
@@ -0,0 +1,47 @@
+import os
+import threading
+from typing import Optional
+from .base import StorageBackend
+from .group_commit import GroupCommitter
+
+_backend: Optional[StorageBackend] = None
+_committer: Optional[GroupCommitter] = None
+_lock = threading.Lock()
+
+
+def create_backend(kind: Optional[str] = None) -> StorageBackend:
+    """
+    Tạo backend theo STORAGE_BACKEND: 'json' (mặc định, các file JSONL trong DATA_DIR)
+    hoặc 'sqlite' (file STORAGE_SQLITE_PATH, mặc định DATA_DIR/bakery.db)
+    """
+    kind = (kind or os.getenv('STORAGE_BACKEND') or 'json').lower()
+    if kind == 'json':
+        from .json_backend import JsonBackend
+        return JsonBackend()
+    if kind == 'sqlite':
+        from .sqlite_backend import SQLiteBackend
+        return SQLiteBackend(os.getenv('STORAGE_SQLITE_PATH') or None)
+    raise ValueError(f'Unknown STORAGE_BACKEND: {kind}')
+
+
+def get_backend() -> StorageBackend:
+    """
+    Backend dùng chung cho cả chatbot và history trong 1 process
+    """
+    global _backend
+    with _lock:
+        if _backend is None:
+            _backend = create_backend()
+        return _backend
+
+
+def get_committer() -> GroupCommitter:
+    """
+    Group commit dùng chung cho các route async (đơn hàng và lịch sử được ghi cùng nhóm)
+    """
+    global _committer
+    backend = get_backend()
+    with _lock:
+        if _committer is None:
+            _committer = GroupCommitter(backend)
+        return _committer
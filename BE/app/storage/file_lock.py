@@ -0,0 +1,57 @@
+import os
+import threading
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+class FileLock:
+    """
+    Khoá dùng chung giữa các thread trong process và (nếu có path) giữa các process
+    qua fcntl.flock trên file <path>. Lồng nhau được trong cùng 1 thread; hold() trả
+    về True ở lớp ngoài cùng, là lúc store cần đọc bù thay đổi của process khác.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        if path and fcntl is None:
+            raise ValueError('STORAGE_MULTI_PROCESS requires fcntl (Linux / macOS); '
+                             'use STORAGE_BACKEND=sqlite instead')
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._fd: Optional[int] = None
+        self._depth = 0
+        self._exclusive = False
+
+    @property
+    def shared(self) -> bool:
+        return self.path is not None
+
+    @contextmanager
+    def hold(self, exclusive: bool = True) -> Iterator[bool]:
+        with self._thread_lock:
+            outermost = self._depth == 0
+            if outermost and self.path:
+                if self._fd is None:
+                    os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                    self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                fcntl.flock(self._fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                self._exclusive = exclusive
+            elif exclusive and self.path and not self._exclusive:
+                raise RuntimeError('Cannot upgrade a shared file lock to exclusive')
+            self._depth += 1
+            try:
+                yield outermost
+            finally:
+                self._depth -= 1
+                if self._depth == 0 and self.path:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def close(self) -> None:
+        with self._thread_lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
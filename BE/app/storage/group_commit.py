@@ -0,0 +1,134 @@
+import asyncio
+import contextvars
+import os
+from typing import List, Optional
+from app.utils import metrics
+from .base import StorageBackend
+
+# Bật / tắt group commit (chỉ áp dụng cho backend JSON)
+GROUP_COMMIT_ENABLED = os.getenv("STORAGE_GROUP_COMMIT", "1").lower() not in ("0", "false", "no")
+# Chờ thêm bao lâu (ms) để gom lần ghi trước khi ghi cả nhóm. Mặc định 0: ghi ngay,
+# các lần ghi đến trong lúc nhóm trước đang ghi / fsync tự dồn vào nhóm sau
+GROUP_COMMIT_DELAY_MS = float(os.getenv("STORAGE_GROUP_COMMIT_DELAY_MS", "0"))
+# Đủ bao nhiêu lần ghi thì ghi ngay không chờ hết thời gian
+GROUP_COMMIT_MAX_RECORDS = int(os.getenv("STORAGE_GROUP_COMMIT_MAX_RECORDS", "256"))
+# fsync 1 lần cho mỗi nhóm (bền khi mất điện, chậm hơn)
+STORAGE_FSYNC = os.getenv("STORAGE_FSYNC", "0").lower() in ("1", "true", "yes")
+
+GROUP_SIZE = metrics.histogram(
+    'bakery_storage_group_commit_size', 'Số lần ghi được gom trong 1 nhóm',
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+)
+
+
+class GroupCommitter:
+    """
+    Gom các lần ghi đơn hàng / lịch sử của nhiều request thành 1 lần ghi đĩa.
+
+    Thay đổi được áp vào bộ nhớ ngay (kho ở chế độ write-behind), người gọi
+    `await commit()` để nhận xác nhận khi nhóm chứa thay đổi đó đã được ghi xuống
+    file (và fsync nếu bật). Nhóm được ghi khi đủ max_records lần ghi hoặc sau
+    max_delay giây kể từ lần ghi đầu tiên của nhóm; trong lúc 1 nhóm đang ghi,
+    các lần ghi mới dồn vào nhóm sau nên số lần ghi / fsync không tăng theo số
+    request đồng thời.
+    """
+
+    def __init__(self, backend: StorageBackend, enabled: bool = GROUP_COMMIT_ENABLED,
+                 max_delay: float = GROUP_COMMIT_DELAY_MS / 1000, max_records: int = GROUP_COMMIT_MAX_RECORDS,
+                 fsync: bool = STORAGE_FSYNC):
+        self.backend = backend
+        self.enabled = enabled and backend.supports_write_behind
+        self.max_delay = max_delay
+        self.max_records = max_records
+        self.fsync = fsync
+        self.stats = {'commits': 0, 'groups': 0, 'largest_group': 0, 'errors': 0}
+
+        self._waiters: List[asyncio.Future] = []
+        # nhóm đang được ghi
+        self._group: List[asyncio.Future] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._full: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        if self.enabled:
+            backend.set_write_behind(True)
+
+    def _ensure_task(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            # lần đầu hoặc event loop mới (ví dụ mỗi lần asyncio.run trong script)
+            self._waiters = []
+            self._wakeup = asyncio.Event()
+            self._full = asyncio.Event()
+            # context rỗng: task chạy nền không được ghi vào trace của request đã tạo ra nó
+            self._task = loop.create_task(self._run(), context=contextvars.Context())
+
+    async def commit(self) -> None:
+        """
+        Chờ tới khi các thay đổi đã áp vào kho trước lời gọi này được ghi xuống đĩa
+        """
+        if not self.enabled:
+            return
+        self._ensure_task()
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        self.stats['commits'] += 1
+        self._wakeup.set()
+        if len(self._waiters) >= self.max_records:
+            self._full.set()
+        await future
+
+    async def _run(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            if len(self._waiters) < self.max_records and self.max_delay > 0:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.max_delay)
+                except asyncio.TimeoutError:
+                    pass
+            self._wakeup.clear()
+            self._full.clear()
+            waiters = self._group = self._waiters
+            self._waiters = []
+            if not waiters:
+                continue
+
+            self.stats['groups'] += 1
+            self.stats['largest_group'] = max(self.stats['largest_group'], len(waiters))
+            GROUP_SIZE.observe(len(waiters))
+            try:
+                with metrics.stage('storage.group_commit'):
+                    if self.fsync or self.backend.shared:
+                        # fsync chờ đĩa, chế độ shared giữ flock chung với process khác
+                        await asyncio.to_thread(self.backend.sync, self.fsync)
+                    else:
+                        # chỉ ghi vào page cache của OS, nhanh hơn 1 lần chuyển sang thread
+                        self.backend.sync()
+            except Exception as e:
+                print(f"Error writing storage group: {str(e)}")
+                self.stats['errors'] += 1
+                for future in waiters:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for future in waiters:
+                    if not future.done():
+                        future.set_result(None)
+
+    async def close(self) -> None:
+        """
+        Dừng task ghi nền và ghi nốt phần còn trong bộ đệm
+        """
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        if self.enabled:
+            await asyncio.to_thread(self.backend.sync, self.fsync)
+            for future in self._group + self._waiters:
+                if not future.done():
+                    future.set_result(None)
+            self._group = []
+            self._waiters = []
@@ -0,0 +1,47 @@
+import os
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, Callable, Iterator
+from app.api.chatbot.order_store import OrderStore
+from app.api.history.history_log import HistoryLog
+from .file_lock import FileLock
+from .base import StorageBackend, OrderRepository, HistoryRepository, get_data_dir
+
+
+class JsonBackend(StorageBackend):
+    """
+    Backend file: mỗi kho đơn là 1 log JSONL (<name>.jsonl), lịch sử chat là thư mục
+    segment chat_history/. File <name>.json cũ được import ở lần mở đầu tiên.
+
+    shared=True (STORAGE_MULTI_PROCESS=1): các kho khoá file (flock) khi đọc / ghi và đọc
+    bù thay đổi của process khác, id được cấp theo bộ đếm chung trên đĩa. Mỗi lần ghi
+    phải giữ khoá nên chế độ này không dùng group commit. transaction() khoá cả DATA_DIR.
+    """
+
+    def __init__(self, data_dir: Optional[str] = None, shared: Optional[bool] = None):
+        super().__init__()
+        self.data_dir = data_dir or get_data_dir()
+        if shared is not None:
+            self.shared = shared
+        self.supports_write_behind = not self.shared
+        # transaction() giữ khoá này để thao tác trên nhiều kho không xen với process khác
+        self._transaction_lock = FileLock(os.path.join(self.data_dir, 'transaction.lock') if self.shared else None)
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        with self._lock, self._transaction_lock.hold():
+            yield
+
+    def close(self) -> None:
+        super().close()
+        self._transaction_lock.close()
+
+    def _create_orders(self, name: str,
+                       indexes: Optional[Dict[str, Callable[[Dict[str, Any]], Any]]]) -> OrderRepository:
+        return OrderStore(os.path.join(self.data_dir, f'{name}.jsonl'),
+                          legacy_file=os.path.join(self.data_dir, f'{name}.json'),
+                          indexes=indexes, shared=self.shared)
+
+    def _create_history(self) -> HistoryRepository:
+        return HistoryLog(os.path.join(self.data_dir, 'chat_history'),
+                          legacy_file=os.path.join(self.data_dir, 'chat_history.json'),
+                          shared=self.shared)
@@ -0,0 +1,61 @@
+"""
+Chuyển dữ liệu từ backend JSON (order_info, data_final, chat_history — cả file .json
+cũ lẫn log .jsonl) sang backend SQLite.
+
+    cd BE && python -m app.storage.migrate --db app/bakery.db
+
+Chạy lại nhiều lần được: bản ghi trùng id sẽ bị ghi đè.
+"""
+import argparse
+from app.api.chatbot.order_store import FINAL_ORDER_INDEXES
+from .base import get_data_dir, data_path
+from .json_backend import JsonBackend
+from .sqlite_backend import SQLiteBackend
+
+ORDER_STORES = {
+    'order_info': None,
+    'data_final': FINAL_ORDER_INDEXES,
+}
+
+
+def migrate(source_dir: str, db_path: str) -> dict:
+    source = JsonBackend(source_dir)
+    target = SQLiteBackend(db_path)
+    counts = {}
+    try:
+        with target.transaction():
+            for name, indexes in ORDER_STORES.items():
+                orders = source.orders(name, indexes)
+                target_orders = target.orders(name, indexes)
+                for order in orders.all():
+                    target_orders.put(order['id'], order)
+                # giữ bộ đếm id để đơn mới không trùng id đã từng cấp
+                if orders.next_id > target_orders.next_id:
+                    updated = target.conn.execute('UPDATE sqlite_sequence SET seq = ? WHERE name = ?',
+                                                  (orders.next_id - 1, target_orders.table)).rowcount
+                    if not updated:
+                        target.conn.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)',
+                                            (target_orders.table, orders.next_id - 1))
+                counts[name] = len(orders)
+
+            messages = source.history().read_all()
+            target.history().import_messages(messages)
+            counts['chat_history'] = len(messages)
+    finally:
+        source.close()
+        target.close()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source', default=get_data_dir(), help='thư mục chứa dữ liệu JSON')
+    parser.add_argument('--db', default=data_path('bakery.db'), help='file SQLite đích')
+    args = parser.parse_args()
+
+    for name, count in migrate(args.source, args.db).items():
+        print(f'{name}: {count} bản ghi')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Dọn dữ liệu cũ để phần dữ liệu "nóng" chỉ tỷ lệ với lượng truy cập gần đây:
+- xoá đơn nháp bỏ dở (không cập nhật quá DRAFT_TTL_HOURS giờ)
+- nén các segment lịch sử chat cũ hơn HISTORY_HOT_DAYS ngày (backend JSON)
+
+Server tự chạy mỗi RETENTION_INTERVAL giây; chạy tay 1 lần:
+
+    cd BE && python -m app.storage.retention
+    cd BE && python -m app.storage.retention --draft-ttl-hours 24 --hot-days 3
+"""
+import argparse
+import os
+from datetime import datetime, timedelta
+from typing import List, Optional
+from app.api.history.history_log import HISTORY_HOT_DAYS
+from .base import OrderRepository
+
+# Đơn nháp không được cập nhật quá số giờ này thì bị xoá (0 = giữ mãi)
+DRAFT_TTL_HOURS = float(os.getenv("DRAFT_TTL_HOURS", "72"))
+# Chu kỳ (giây) chạy dọn dữ liệu trong server (0 = không tự chạy)
+RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL", "3600"))
+
+
+def expire_drafts(draft_store: OrderRepository, max_age_hours: float = DRAFT_TTL_HOURS,
+                  now: Optional[datetime] = None) -> List[int]:
+    """
+    Xoá đơn nháp có updated_at cũ hơn max_age_hours giờ, trả về id đã xoá.
+    Đơn nháp lưu từ trước khi có updated_at được gắn thời điểm hiện tại (tính tuổi từ lần quét này).
+    """
+    if max_age_hours <= 0:
+        return []
+    now = now or datetime.now()
+    cutoff = (now - timedelta(hours=max_age_hours)).isoformat()
+    expired = []
+    for order in draft_store.all():
+        updated_at = order.get('updated_at')
+        if not updated_at:
+            draft_store.put(order['id'], {**order, 'updated_at': now.isoformat()})
+        elif updated_at < cutoff:
+            draft_store.delete(order['id'])
+            expired.append(order['id'])
+    return expired
+
+
+def main():
+    from .factory import get_backend
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--draft-ttl-hours', type=float, default=DRAFT_TTL_HOURS)
+    parser.add_argument('--hot-days', type=float, default=HISTORY_HOT_DAYS)
+    args = parser.parse_args()
+
+    backend = get_backend()
+    try:
+        with backend.transaction():
+            expired = expire_drafts(backend.orders('order_info'), args.draft_ttl_hours)
+        archives = backend.history().archive_cold(args.hot_days)
+    finally:
+        backend.close()
+    # thống kê đơn (order_stats) tự dựng lại ở lần khởi động sau vì số đơn nháp đã đổi
+    print(f"Đã xoá {len(expired)} đơn nháp quá {args.draft_ttl_hours:g} giờ")
+    for meta in archives:
+        print(f"Nén segment {meta['segment']}: {meta['count']} message, {meta['bytes']} byte "
+              f"({meta['first_ts']} -> {meta['last_ts']})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,362 @@
+import copy
+import json
+import os
+import re
+import secrets
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple, Callable, Iterator
+from app.utils.text import fold_text
+from app.api.chatbot.order_store import order_status, order_search_text, encode_cursor, decode_cursor
+from app.api.history.history_log import encode_cursor as encode_message_cursor
+from app.api.history.history_log import decode_cursor as decode_message_cursor
+from .base import StorageBackend, OrderRepository, HistoryRepository, data_path
+
+NAME_RE = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+def _like_pattern(needle: str) -> str:
+    escaped = needle.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    Backend SQLite nhúng (1 file, chế độ WAL).
+
+    - WAL: các process khác đọc song song trong lúc đang ghi
+    - Mọi câu lệnh đều có tham số cố định nên được sqlite3 prepare 1 lần rồi dùng lại
+      (cache statement của connection)
+    - transaction() gom nhiều thao tác thành 1 giao dịch BEGIN IMMEDIATE ... COMMIT,
+      các thao tác ghi lẻ tự mở giao dịch riêng
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        super().__init__()
+        self.db_path = db_path or data_path('bakery.db')
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False,
+                                    isolation_level=None, cached_statements=256)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('PRAGMA busy_timeout=5000')
+        self._depth = 0
+
+    def _create_orders(self, name: str,
+                       indexes: Optional[Dict[str, Callable[[Dict[str, Any]], Any]]]) -> OrderRepository:
+        return SQLiteOrderStore(self, name, indexes)
+
+    def _create_history(self) -> HistoryRepository:
+        return SQLiteHistoryStore(self)
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        with self._lock:
+            if self._depth == 0:
+                self.conn.execute('BEGIN IMMEDIATE')
+            self._depth += 1
+            try:
+                yield
+            except BaseException:
+                self._depth -= 1
+                if self._depth == 0:
+                    self.conn.execute('ROLLBACK')
+                raise
+            self._depth -= 1
+            if self._depth == 0:
+                self.conn.execute('COMMIT')
+
+    def query(self, sql: str, params: Tuple = ()) -> List[Tuple]:
+        with self._lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def data_version(self) -> int:
+        # đổi khi connection khác (process khác) commit; commit của chính connection này không tính
+        return self.query('PRAGMA data_version')[0][0]
+
+    def close(self) -> None:
+        super().close()
+        with self._lock:
+            self.conn.close()
+
+
+class SQLiteOrderStore(OrderRepository):
+    """
+    Kho đơn trong bảng orders_<name>: đơn được lưu nguyên dạng JSON ở cột data,
+    các cột status, phone, key_<index> được tách ra để đánh index cho lọc / sắp xếp.
+    """
+
+    def __init__(self, backend: SQLiteBackend, name: str,
+                 indexes: Optional[Dict[str, Callable[[Dict[str, Any]], Any]]] = None):
+        if not NAME_RE.match(name) or not all(NAME_RE.match(index) for index in indexes or {}):
+            raise ValueError(f'Invalid store name: {name}')
+        self.backend = backend
+        self.table = f'orders_{name}'
+        self._indexes = dict(indexes or {})
+        # số lần ghi từ process này, cộng với data_version thành version của kho
+        self._version = 0
+        self._epoch = secrets.token_hex(4)
+
+        key_columns = ''.join(f', key_{index}' for index in self._indexes)
+        placeholders = ', ?' * len(self._indexes)
+        self._insert_sql = (f'INSERT OR REPLACE INTO {self.table} (id, status, phone, search_text, data{key_columns}) '
+                            f'VALUES (?, ?, ?, ?, ?{placeholders})')
+
+    def open(self) -> None:
+        key_columns = ''.join(f', key_{index} TEXT' for index in self._indexes)
+        with self.backend.transaction():
+            self.backend.conn.execute(
+                f'CREATE TABLE IF NOT EXISTS {self.table} ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, status TEXT NOT NULL, phone TEXT, '
+                f'search_text TEXT NOT NULL, data TEXT NOT NULL{key_columns})'
+            )
+            self.backend.conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{self.table}_status ON {self.table} (status)')
+            self.backend.conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{self.table}_phone ON {self.table} (phone)')
+            for index in self._indexes:
+                self.backend.conn.execute(
+                    f'CREATE INDEX IF NOT EXISTS idx_{self.table}_{index} ON {self.table} (key_{index}, id)'
+                )
+                self.backend.conn.execute(
+                    f'CREATE INDEX IF NOT EXISTS idx_{self.table}_status_{index} ON {self.table} (status, key_{index}, id)'
+                )
+
+    def close(self) -> None:
+        # connection thuộc về backend
+        pass
+
+    def _row(self, order: Dict[str, Any]) -> Tuple:
+        return (order['id'], order_status(order), order.get('so_dien_thoai') or None,
+                order_search_text(order), json.dumps(order, ensure_ascii=False),
+                *(key_func(order) for key_func in self._indexes.values()))
+
+    # ------------------------------------------------------------------
+    # Ghi
+    # ------------------------------------------------------------------
+    def add(self, order: Dict[str, Any]) -> int:
+        return self.add_many([order])[0]
+
+    def add_many(self, orders: List[Dict[str, Any]]) -> List[int]:
+        with self.backend.transaction():
+            first_id = self.next_id
+            rows = []
+            for offset, order in enumerate(orders):
+                order = copy.deepcopy(order)
+                order['id'] = first_id + offset
+                rows.append(self._row(order))
+            self.backend.conn.executemany(self._insert_sql, rows)
+            self._version += 1
+        return [row[0] for row in rows]
+
+    def put(self, order_id: int, order: Dict[str, Any]) -> None:
+        order = copy.deepcopy(order)
+        order['id'] = order_id
+        with self.backend.transaction():
+            self.backend.conn.execute(self._insert_sql, self._row(order))
+            self._version += 1
+
+    def delete(self, order_id: int) -> bool:
+        with self.backend.transaction():
+            self._version += 1
+            return self.backend.conn.execute(f'DELETE FROM {self.table} WHERE id = ?', (order_id,)).rowcount > 0
+
+    def clear(self) -> None:
+        # AUTOINCREMENT giữ nguyên bộ đếm trong sqlite_sequence nên id không bị dùng lại
+        with self.backend.transaction():
+            self.backend.conn.execute(f'DELETE FROM {self.table}')
+            self._version += 1
+
+    # ------------------------------------------------------------------
+    # Đọc
+    # ------------------------------------------------------------------
+    def get(self, order_id: int) -> Optional[Dict[str, Any]]:
+        rows = self.backend.query(f'SELECT data FROM {self.table} WHERE id = ?', (order_id,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def all(self) -> List[Dict[str, Any]]:
+        return [json.loads(data) for data, in self.backend.query(f'SELECT data FROM {self.table} ORDER BY id')]
+
+    def __len__(self) -> int:
+        return self.backend.query(f'SELECT COUNT(*) FROM {self.table}')[0][0]
+
+    @property
+    def next_id(self) -> int:
+        rows = self.backend.query('SELECT seq FROM sqlite_sequence WHERE name = ?', (self.table,))
+        return (rows[0][0] if rows else 0) + 1
+
+    def version(self) -> str:
+        return f'{self._epoch}.{self._version}.{self.backend.data_version()}'
+
+    def page(self, sort: str, descending: bool = False, limit: int = 50, cursor: Optional[str] = None,
+             status: Optional[str] = None, date_from: Optional[str] = None, date_to: Optional[str] = None,
+             q: Optional[str] = None, date_index: str = 'confirmed_at') -> Dict[str, Any]:
+        """
+        Giống OrderStore.page nhưng lọc / sắp xếp / phân trang (keyset) bằng SQL trên index
+        """
+        if sort not in self._indexes:
+            raise ValueError(f'Unsupported sort key: {sort}')
+
+        where, params = [], []
+        if status:
+            where.append('status = ?')
+            params.append(status)
+        if date_index in self._indexes:
+            if date_from:
+                where.append(f'key_{date_index} >= ?')
+                params.append(date_from)
+            if date_to:
+                where.append(f'key_{date_index} <= ?')
+                params.append(date_to + '\uffff')
+        if q:
+            where.append("search_text LIKE ? ESCAPE '\\'")
+            params.append(_like_pattern(fold_text(q)))
+
+        filter_sql = ' AND '.join(where) or '1'
+        total = None
+        if not cursor:
+            total = self.backend.query(f'SELECT COUNT(*) FROM {self.table} WHERE {filter_sql}', tuple(params))[0][0]
+
+        page_where, page_params = list(where), list(params)
+        if cursor:
+            page_where.append(f"(key_{sort}, id) {'<' if descending else '>'} (?, ?)")
+            page_params.extend(decode_cursor(cursor))
+        direction = 'DESC' if descending else 'ASC'
+        rows = self.backend.query(
+            f"SELECT key_{sort}, id, data FROM {self.table} WHERE {' AND '.join(page_where) or '1'} "
+            f'ORDER BY key_{sort} {direction}, id {direction} LIMIT ?',
+            tuple(page_params) + (limit + 1,)
+        )
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        counts = dict(self.backend.query(f'SELECT status, COUNT(*) FROM {self.table} GROUP BY status'))
+        return {
+            'items': [json.loads(data) for _, _, data in rows],
+            'next_cursor': encode_cursor((rows[-1][0], rows[-1][1])) if has_more else None,
+            'total': total,
+            'counts': counts
+        }
+
+
+class SQLiteHistoryStore(HistoryRepository):
+    """
+    Lịch sử chat trong bảng messages, index theo (user_id, id) và timestamp
+    """
+
+    COLUMNS = 'id, user_id, role, content, timestamp'
+
+    def __init__(self, backend: SQLiteBackend):
+        self.backend = backend
+        # số lần ghi từ process này (tổng, theo user, import) - xem SQLiteOrderStore.version
+        self._version = 0
+        self._user_versions: Dict[str, int] = {}
+        self._imports = 0
+        self._epoch = secrets.token_hex(4)
+
+    def open(self) -> None:
+        with self.backend.transaction():
+            self.backend.conn.execute(
+                'CREATE TABLE IF NOT EXISTS messages ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL, role TEXT NOT NULL, '
+                'content TEXT NOT NULL, timestamp TEXT NOT NULL, folded TEXT NOT NULL)'
+            )
+            self.backend.conn.execute('CREATE INDEX IF NOT EXISTS idx_messages_user ON messages (user_id, id)')
+            self.backend.conn.execute('CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages (timestamp)')
+
+    def close(self) -> None:
+        pass
+
+    @staticmethod
+    def _message(row: Tuple) -> Dict[str, Any]:
+        msg_id, user_id, role, content, timestamp = row
+        return {"id": msg_id, "user_id": user_id, "role": role, "content": content, "timestamp": timestamp}
+
+    def append(self, user_id: str, role: str, content: str) -> Dict[str, Any]:
+        timestamp = datetime.utcnow().isoformat() + 'Z'
+        with self.backend.transaction():
+            cursor = self.backend.conn.execute(
+                'INSERT INTO messages (user_id, role, content, timestamp, folded) VALUES (?, ?, ?, ?, ?)',
+                (user_id, role, content, timestamp, fold_text(content))
+            )
+            self._version += 1
+            self._user_versions[user_id] = self._user_versions.get(user_id, 0) + 1
+        return self._message((cursor.lastrowid, user_id, role, content, timestamp))
+
+    def import_messages(self, messages: List[Dict[str, Any]]) -> None:
+        """
+        Ghi các message đã có id / timestamp (dùng khi migrate)
+        """
+        with self.backend.transaction():
+            self.backend.conn.executemany(
+                'INSERT OR REPLACE INTO messages (id, user_id, role, content, timestamp, folded) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                [(m['id'], m.get('user_id', ''), m.get('role', ''), m.get('content', ''),
+                  m.get('timestamp', ''), fold_text(m.get('content', ''))) for m in messages]
+            )
+            self._imports += 1
+
+    @staticmethod
+    def _time_where(since: Optional[str], until: Optional[str]) -> Tuple[List[str], List[Any]]:
+        where, params = [], []
+        if since:
+            where.append('timestamp >= ?')
+            params.append(since)
+        if until:
+            where.append('timestamp <= ?')
+            params.append(until + '\uffff')
+        return where, params
+
+    def read_user(self, user_id: str, since: Optional[str] = None,
+                  until: Optional[str] = None) -> List[Dict[str, Any]]:
+        where, params = self._time_where(since, until)
+        rows = self.backend.query(
+            f"SELECT {self.COLUMNS} FROM messages WHERE {' AND '.join(['user_id = ?'] + where)} ORDER BY id",
+            (user_id, *params)
+        )
+        return [self._message(row) for row in rows]
+
+    def read_all(self, since: Optional[str] = None, until: Optional[str] = None) -> List[Dict[str, Any]]:
+        where, params = self._time_where(since, until)
+        rows = self.backend.query(
+            f"SELECT {self.COLUMNS} FROM messages WHERE {' AND '.join(where) or '1'} ORDER BY id", tuple(params)
+        )
+        return [self._message(row) for row in rows]
+
+    def read_ids(self, ids: List[int]) -> List[Dict[str, Any]]:
+        if not ids:
+            return []
+        rows = self.backend.query(
+            f"SELECT {self.COLUMNS} FROM messages WHERE id IN ({', '.join('?' * len(ids))})", tuple(ids)
+        )
+        by_id = {row[0]: self._message(row) for row in rows}
+        return [by_id[msg_id] for msg_id in ids if msg_id in by_id]
+
+    def version(self, user_id: Optional[str] = None) -> str:
+        local = self._user_versions.get(user_id, 0) if user_id else self._version
+        return f'{self._epoch}.{self._imports}.{local}.{self.backend.data_version()}'
+
+    def page(self, user_id: Optional[str] = None, limit: int = 50, cursor: Optional[str] = None,
+             since: Optional[str] = None, until: Optional[str] = None, role: Optional[str] = None,
+             q: Optional[str] = None, descending: bool = False) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        where, params = self._time_where(since, until)
+        if user_id:
+            where.insert(0, 'user_id = ?')
+            params.insert(0, user_id)
+        if role:
+            where.append('role = ?')
+            params.append(role)
+        if q:
+            where.append("folded LIKE ? ESCAPE '\\'")
+            params.append(_like_pattern(fold_text(q)))
+        if cursor:
+            where.append(f"id {'<' if descending else '>'} ?")
+            params.append(decode_message_cursor(cursor))
+
+        rows = self.backend.query(
+            f"SELECT {self.COLUMNS} FROM messages WHERE {' AND '.join(where) or '1'} "
+            f"ORDER BY id {'DESC' if descending else 'ASC'} LIMIT ?",
+            tuple(params) + (limit + 1,)
+        )
+        has_more = len(rows) > limit
+        items = [self._message(row) for row in rows[:limit]]
+        return items, encode_message_cursor(items[-1]['id']) if has_more else None
@@ -0,0 +1,196 @@
+"""
+ETag + cache response cho các route GET trả danh sách (đơn hàng, lịch sử chat).
+
+ETag được dựng từ version của kho (đổi sau mỗi lần ghi) và URL của request nên
+If-None-Match được trả 304 mà không đọc kho. Body JSON đã serialize được giữ lại theo
+URL cùng các bản nén (gzip, brotli nếu có cài) để lần gọi sau với cùng version chỉ
+việc gửi lại bytes có sẵn.
+"""
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from app.utils import metrics
+
+try:
+    import brotli
+except ImportError:  # brotli là tuỳ chọn, không có thì chỉ nén gzip
+    brotli = None
+
+# Số URL / tổng số byte (kể cả bản nén) được giữ trong cache
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "256"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Mức nén: nén 1 lần cho mỗi version nên chọn mức vừa phải (brotli 11 chậm hơn gzip hàng chục lần)
+RESPONSE_GZIP_LEVEL = int(os.getenv("RESPONSE_GZIP_LEVEL", "6"))
+RESPONSE_BROTLI_QUALITY = int(os.getenv("RESPONSE_BROTLI_QUALITY", "5"))
+
+# body nhỏ hơn thì gửi nguyên (phần header của bản nén còn lớn hơn phần tiết kiệm được)
+COMPRESS_MIN_BYTES = 1024
+
+CACHE_RESULTS = metrics.counter(
+    'bakery_http_cache_total', 'Kết quả cache response của các route GET danh sách', ('result',)
+)
+
+
+def _compress(body: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(body, quality=RESPONSE_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=RESPONSE_GZIP_LEVEL, mtime=0)
+
+
+def negotiate_encoding(accept_encoding: str) -> str:
+    """
+    'br' / 'gzip' / 'identity' theo Accept-Encoding (có q), cùng q thì ưu tiên br
+    """
+    accepted: Dict[str, float] = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name.strip():
+            accepted[name.strip().lower()] = quality
+
+    options = (('br',) if brotli else ()) + ('gzip',)
+    scores = {encoding: accepted.get(encoding, accepted.get('*', 0.0)) for encoding in options}
+    best = max(options, key=lambda encoding: scores[encoding])
+    return best if scores[best] > 0 else 'identity'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> Optional[str]:
+    """
+    Tag trong If-None-Match khớp với etag (bỏ qua W/ và hậu tố -gzip / -br của bản nén),
+    None nếu không khớp
+    """
+    if not if_none_match:
+        return None
+    base = etag.strip('"')
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag == '*':
+            return etag
+        value = tag[2:] if tag.startswith('W/') else tag
+        value = value.strip('"')
+        for suffix in ('-gzip', '-br'):
+            if value.endswith(suffix):
+                value = value[:-len(suffix)]
+        if value == base:
+            return tag
+    return None
+
+
+class CachedBody:
+    """
+    Body JSON của 1 URL ở 1 version, cùng các bản nén đã tạo
+    """
+
+    __slots__ = ('etag', 'body', 'encoded')
+
+    def __init__(self, etag: str, body: bytes):
+        self.etag = etag
+        self.body = body
+        self.encoded: Dict[str, bytes] = {}
+
+    @property
+    def size(self) -> int:
+        return len(self.body) + sum(len(data) for data in self.encoded.values())
+
+
+class ResponseCache:
+    """
+    LRU theo URL (path + query đã sắp xếp), giới hạn theo số URL và tổng số byte
+    """
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_SIZE, max_bytes: int = RESPONSE_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: 'OrderedDict[str, CachedBody]' = OrderedDict()
+        self._bytes = 0
+
+    @staticmethod
+    def cache_key(request: Request) -> str:
+        query = '&'.join(sorted(f'{key}={value}' for key, value in request.query_params.multi_items()))
+        return f'{request.url.path}?{query}'
+
+    @staticmethod
+    def make_etag(key: str, version: str) -> str:
+        digest = hashlib.blake2b(f'{key}\n{version}'.encode('utf-8'), digest_size=12).hexdigest()
+        return f'"{digest}"'
+
+    async def respond(self, request: Request, version: str, produce: Callable[[], Awaitable[Any]]) -> Response:
+        """
+        Trả 304 nếu If-None-Match khớp, không thì body từ cache (hoặc produce() nếu cache
+        đã cũ), nén theo Accept-Encoding. version phải được đọc trước khi gọi produce()
+        để body không bao giờ cũ hơn ETag đi kèm.
+        """
+        key = self.cache_key(request)
+        etag = self.make_etag(key, version)
+        headers = {'Vary': 'Accept-Encoding', 'Cache-Control': 'no-cache'}
+
+        matched = etag_matches(request.headers.get('if-none-match'), etag)
+        if matched:
+            CACHE_RESULTS.labels('not_modified').inc()
+            return Response(status_code=304, headers={**headers, 'ETag': matched})
+
+        entry = self._entries.get(key)
+        if entry is not None and entry.etag == etag:
+            CACHE_RESULTS.labels('hit').inc()
+            self._entries.move_to_end(key)
+        else:
+            CACHE_RESULTS.labels('miss').inc()
+            data = await produce()
+            body = json.dumps(jsonable_encoder(data), ensure_ascii=False, allow_nan=False,
+                              separators=(',', ':')).encode('utf-8')
+            entry = CachedBody(etag, body)
+            self._put(key, entry)
+
+        payload, encoding = await self._encode(key, entry, negotiate_encoding(request.headers.get('accept-encoding', '')))
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+        headers['ETag'] = etag if encoding == 'identity' else f'{etag[:-1]}-{encoding}"'
+        return Response(content=payload, media_type='application/json', headers=headers)
+
+    async def _encode(self, key: str, entry: CachedBody, encoding: str) -> Tuple[bytes, str]:
+        if encoding == 'identity' or len(entry.body) < COMPRESS_MIN_BYTES:
+            return entry.body, 'identity'
+        data = entry.encoded.get(encoding)
+        if data is None:
+            # nén body lớn mất vài chục ms, không chặn event loop
+            data = await asyncio.to_thread(_compress, entry.body, encoding)
+            if self._entries.get(key) is entry:
+                entry.encoded[encoding] = data
+                self._bytes += len(data)
+                self._evict()
+        return data, encoding
+
+    def _put(self, key: str, entry: CachedBody) -> None:
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old.size
+        if entry.size > self.max_bytes or self.max_entries <= 0:
+            return
+        self._entries[key] = entry
+        self._bytes += entry.size
+        self._evict()
+
+    def _evict(self) -> None:
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            _, entry = self._entries.popitem(last=False)
+            self._bytes -= entry.size
+
+    def stats(self) -> Dict[str, Any]:
+        return {'entries': len(self._entries), 'bytes': self._bytes}
+
+
+# dùng chung cho mọi route
+response_cache = ResponseCache()
@@ -0,0 +1,227 @@
+"""
+Metrics dạng Prometheus (text exposition format 0.0.4) không cần thư viện ngoài.
+
+    REQUEST_SECONDS = histogram('http_request_duration_seconds', 'Thời gian xử lý request', ('method', 'path'))
+    REQUEST_SECONDS.labels('POST', '/chatbot/process').observe(0.42)
+
+    with stage('llm'):      # ghi vào histogram bakery_stage_duration_seconds{stage="llm"}
+        ...                 # và vào trace của request hiện tại (theo X-Request-ID)
+
+render() trả về toàn bộ metrics cho route GET /metrics.
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# Bucket mặc định (giây): từ thao tác file nhỏ tới lời gọi LLM chậm
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+
+# id của request đang xử lý và danh sách (stage, giây) của request đó
+request_id_var: ContextVar[Optional[str]] = ContextVar('request_id', default=None)
+trace_var: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar('trace', default=None)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values: str):
+        key = tuple(str(v) for v in values)
+        if len(key) != len(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}')
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+
+class _CounterChild:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1) -> None:
+        self.labels().inc(amount)
+
+    def samples(self) -> Iterable[str]:
+        for key, child in sorted(self._children.items()):
+            yield f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.value)}'
+
+
+class _HistogramChild:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self.sum += value
+            self.count += 1
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def samples(self) -> Iterable[str]:
+        for key, child in sorted(self._children.items()):
+            with child._lock:
+                counts, total, count = list(child.counts), child.sum, child.count
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            yield f'{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}'
+            yield f'{self.name}_count{_format_labels(self.labelnames, key)} {count}'
+
+
+class CallbackMetric(_Metric):
+    """
+    Metric lấy giá trị lúc render từ các bộ đếm sẵn có (vd. stats của cache / scheduler),
+    callback trả về {tuple giá trị label: số}
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str],
+                 callback: Callable[[], Dict[Tuple[str, ...], float]], kind: str = 'gauge'):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+        self.kind = kind
+
+    def samples(self) -> Iterable[str]:
+        try:
+            values = self.callback()
+        except Exception as e:
+            print(f"Error collecting metric {self.name}: {str(e)}")
+            return
+        for key, value in sorted(values.items()):
+            yield f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+
+
+_registry: Dict[str, _Metric] = {}
+_registry_lock = threading.Lock()
+
+
+def _register(metric: _Metric) -> _Metric:
+    with _registry_lock:
+        # module được import lại (uvicorn reload) thì dùng lại metric cũ
+        return _registry.setdefault(metric.name, metric)
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    return _register(Counter(name, documentation, labelnames))
+
+
+def histogram(name: str, documentation: str, labelnames: Sequence[str] = (),
+              buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+    return _register(Histogram(name, documentation, labelnames, buckets))
+
+
+def callback_metric(name: str, documentation: str, labelnames: Sequence[str],
+                    callback: Callable[[], Dict[Tuple[str, ...], float]], kind: str = 'gauge') -> CallbackMetric:
+    # callback luôn được thay bằng cái mới nhất (vd. service được khởi tạo lại)
+    with _registry_lock:
+        metric = CallbackMetric(name, documentation, labelnames, callback, kind)
+        _registry[name] = metric
+        return metric
+
+
+def render() -> str:
+    with _registry_lock:
+        metrics = list(_registry.values())
+    return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+# ----------------------------------------------------------------------
+# Metrics dùng chung
+# ----------------------------------------------------------------------
+STAGE_SECONDS = histogram('bakery_stage_duration_seconds', 'Thời gian từng bước xử lý', ('stage',))
+FILE_BYTES = counter('bakery_storage_bytes_total', 'Số byte đọc / ghi file dữ liệu', ('store', 'op'))
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    Đo thời gian 1 bước xử lý: ghi vào histogram và vào trace của request hiện tại
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.labels(name).observe(elapsed)
+        trace = trace_var.get()
+        if trace is not None:
+            trace.append((name, elapsed))
+
+
+def count_bytes(store: str, op: str, amount: int) -> None:
+    if amount:
+        FILE_BYTES.labels(store, op).inc(amount)
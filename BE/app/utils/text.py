@@ -0,0 +1,10 @@
+import unicodedata
+
+
+def fold_text(text: str) -> str:
+    """
+    Bỏ dấu tiếng Việt, chữ thường, gom khoảng trắng: "  Bánh   Kem " -> "banh kem"
+    """
+    text = unicodedata.normalize('NFD', text.replace('đ', 'd').replace('Đ', 'D'))
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return ' '.join(text.lower().split())
@@ -0,0 +1,123 @@
+"""
+Micro-benchmark cho danh mục bánh (app.api.chatbot.catalog): thời gian dựng chỉ mục,
+độ trễ tra 1 tên (không cache) và thông lượng khi có cache, độ chính xác với tên
+bị gõ sai / bỏ dấu / thêm bớt chữ, trên danh mục giả lập từ 100 tới 20.000 sản phẩm.
+
+    cd BE && python -m bench.catalog --sizes 100,1000,5000,20000
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+from itertools import product as combinations
+
+from app.api.chatbot.catalog import Catalog
+from app.utils.text import fold_text
+
+KINDS = ['bánh kem', 'bánh mousse', 'bánh cheesecake', 'bánh cupcake', 'bánh tart', 'bánh bông lan',
+         'bánh croissant', 'bánh su', 'bánh tiramisu', 'bánh macaron', 'bánh brownie', 'bánh flan',
+         'bánh cookie', 'bánh muffin', 'bánh donut', 'panna cotta', 'bánh mì', 'bánh pudding',
+         'bánh cuộn', 'bánh waffle']
+FLAVORS = ['chocolate', 'vanilla', 'dâu', 'matcha', 'xoài', 'chanh dây', 'việt quất', 'cam', 'dừa',
+           'sầu riêng', 'cà phê', 'caramel', 'trà sữa', 'khoai môn', 'đậu đỏ', 'phô mai', 'hạnh nhân',
+           'hạt dẻ', 'mè đen', 'trứng muối', 'bơ', 'chuối', 'nho', 'đào', 'mật ong']
+VARIANTS = ['', 'mini', '16cm', '20cm', '24cm', '2 tầng', 'ít ngọt', 'không đường', 'nhân kem',
+            'phủ hạt', 'hình gấu', 'hình tim', 'cao cấp', 'gia đình', 'lá dứa', 'sữa chua', 'kem tươi',
+            'bắp', 'trái cây', 'lạnh', 'nướng', 'hoa hồng', 'cổ điển', 'Nhật', 'Pháp', 'Hàn Quốc',
+            'thuần chay', 'socola chip', 'muối biển', 'cốm', 'dâu tằm', 'kem cheese', 'than tre', 'gạo lứt',
+            'yến mạch', 'quế', 'gừng', 'rượu rum', 'cherry', 'kiwi']
+SYNONYMS = {'socola': 'chocolate', 'vani': 'vanilla', 'tra xanh': 'matcha'}
+STOPWORDS = ['banh', 'cai', 'chiec', 'sinh nhat']
+
+
+def make_products(size: int, rng: random.Random) -> list:
+    names = [' '.join(part for part in parts if part) for parts in combinations(KINDS, FLAVORS, VARIANTS)]
+    rng.shuffle(names)
+    return [{'sku': f'SKU{i:05d}', 'ten_banh': name} for i, name in enumerate(names[:size])]
+
+
+def perturb(name: str, rng: random.Random) -> str:
+    """
+    Các kiểu khách hay gõ: bỏ dấu, bỏ chữ "bánh", thêm "sinh nhật", gõ sai 1 ký tự, viết hoa
+    """
+    kind = rng.randrange(6)
+    if kind == 0:
+        return fold_text(name)
+    if kind == 1:
+        return name.replace('bánh ', '')
+    if kind == 2:
+        return name + ' sinh nhật'
+    if kind == 3:
+        position = rng.randrange(1, len(name))
+        return name[:position] + name[position - 1] + name[position:]
+    if kind == 4:
+        return name.replace('chocolate', 'socola').replace('vanilla', 'vani')
+    return name.upper()
+
+
+def timed(func, items) -> tuple:
+    samples = []
+    for item in items:
+        start = time.perf_counter()
+        func(item)
+        samples.append((time.perf_counter() - start) * 1e6)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.99) - 1], sum(samples)
+
+
+def bench_size(size: int, queries: int) -> dict:
+    rng = random.Random(size)
+    products = make_products(size, rng)
+    start = time.perf_counter()
+    catalog = Catalog(products, SYNONYMS, STOPWORDS, cache_size=0)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    picks = [rng.choice(products) for _ in range(queries)]
+    names = [perturb(product['ten_banh'], rng) for product in picks]
+    p50, p99, _ = timed(catalog.resolve, names)
+
+    correct = unmatched = 0
+    for product, name in zip(picks, names):
+        match = catalog.resolve(name)
+        if match is None:
+            unmatched += 1
+        elif match[0]['sku'] == product['sku']:
+            correct += 1
+
+    # tên bánh lặp lại giữa các đơn: phần lớn lượt tra trúng cache
+    cached = Catalog(products, SYNONYMS, STOPWORDS)
+    repeated = [rng.choice(names[:max(1, queries // 20)]) for _ in range(queries)]
+    _, _, total_us = timed(cached.resolve, repeated)
+    return {
+        'size': size,
+        'build_ms': build_ms,
+        'p50_us': p50,
+        'p99_us': p99,
+        'correct': correct / queries,
+        'unmatched': unmatched / queries,
+        'wrong': (queries - correct - unmatched) / queries,
+        'cached_per_sec': queries / (total_us / 1e6),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', default='100,1000,5000,20000')
+    parser.add_argument('--queries', type=int, default=5000)
+    parser.add_argument('--json', action='store_true', help="in kết quả dạng JSON")
+    args = parser.parse_args()
+
+    results = [bench_size(int(size), args.queries) for size in args.sizes.split(',')]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'products':>9} | {'build ms':>8} | {'p50 µs':>7} {'p99 µs':>7} | {'đúng':>6} {'không khớp':>10} {'sai':>6} "
+          f"| {'cache ops/s':>11}")
+    for r in results:
+        print(f"{r['size']:>9} | {r['build_ms']:>8.1f} | {r['p50_us']:>7.1f} {r['p99_us']:>7.1f} | "
+              f"{r['correct']:>6.1%} {r['unmatched']:>10.1%} {r['wrong']:>6.1%} | {r['cached_per_sec']:>11,.0f}")
+
+
+if __name__ == '__main__':
+    main()
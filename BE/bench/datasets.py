@@ -0,0 +1,145 @@
+"""
+Sinh dữ liệu giả cùng định dạng với file thật trong app/ để benchmark:
+order_info.json (đơn nháp), data_final.json (đơn đã xác nhận), chat_history.json.
+File được ghi dạng stream nên sinh được cả 1.000.000 bản ghi mà không tốn nhiều RAM;
+khi service mở thư mục này lần đầu, các file JSON được import sang log JSONL như dữ liệu thật.
+
+    cd BE && python -m bench.datasets --size 100000 --out /tmp/bakery_100k
+"""
+import argparse
+import json
+import os
+import random
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable
+
+FIRST_NAMES = ['An', 'Bình', 'Chi', 'Dũng', 'Giang', 'Hà', 'Hải', 'Hương', 'Khánh', 'Lan',
+               'Linh', 'Minh', 'Nam', 'Ngọc', 'Phương', 'Quân', 'Thảo', 'Trang', 'Tuấn', 'Vy']
+LAST_NAMES = ['Nguyễn', 'Trần', 'Lê', 'Phạm', 'Hoàng', 'Huỳnh', 'Phan', 'Vũ', 'Võ', 'Đặng']
+MIDDLE_NAMES = ['Văn', 'Thị', 'Minh', 'Ngọc', 'Thanh', 'Đức', 'Gia']
+CAKES = ['bánh kem sinh nhật chocolate', 'bánh cupcake vanilla', 'bánh tiramisu', 'bánh bông lan trứng muối',
+         'bánh mousse chanh dây', 'bánh su kem', 'bánh flan', 'bánh red velvet', 'bánh cheesecake dâu',
+         'bánh kem bắp', 'bánh croissant bơ', 'bánh tart trứng']
+STREETS = ['Lê Lợi', 'Nguyễn Huệ', 'Hai Bà Trưng', 'Lý Tự Trọng', 'Điện Biên Phủ', 'Cách Mạng Tháng 8',
+           'Võ Văn Tần', 'Pasteur', 'Nam Kỳ Khởi Nghĩa', 'Trần Hưng Đạo']
+NOTES = ['', '', 'Giao trước 15h, sinh nhật con.', 'Ghi chữ Happy Birthday', 'Ít ngọt', 'Gọi trước khi giao']
+USER_MESSAGES = [
+    'Chào shop, mình muốn đặt {so_luong} {ten_banh}',
+    'Tên mình là {ten_khach_hang}, số điện thoại {so_dien_thoai}',
+    'Giao tới {dia_chi} lúc {gio_giao} nhé',
+    'Xác nhận đơn',
+]
+AGENT_MESSAGES = [
+    'Xin chào! Tôi là trợ lý đặt bánh. Bạn muốn đặt bánh gì?',
+    'Vui lòng cho biết tên và số điện thoại của bạn.',
+    '✅ XÁC NHẬN ĐƠN HÀNG. Bạn kiểm tra lại thông tin giúp mình nhé.',
+    '🎉 Đơn hàng đã được xác nhận thành công!',
+]
+
+START_TIME = datetime(2025, 1, 1, 8, 0, 0)
+
+
+def make_order(i: int, rng: random.Random, complete: bool = True) -> Dict[str, Any]:
+    name = f"{rng.choice(LAST_NAMES)} {rng.choice(MIDDLE_NAMES)} {rng.choice(FIRST_NAMES)}"
+    order = {
+        "id": i,
+        "ten_khach_hang": name,
+        "so_dien_thoai": f"09{rng.randrange(10 ** 8):08d}",
+        "danh_sach_banh": [
+            {"ten_banh": cake, "so_luong": rng.randint(1, 6)}
+            for cake in rng.sample(CAKES, rng.randint(1, 3))
+        ],
+        "dia_chi": f"{rng.randint(1, 500)} Đường {rng.choice(STREETS)}, Quận {rng.randint(1, 12)}, TP.HCM",
+        "gio_giao": f"{rng.randint(7, 20):02d}:{rng.choice(['00', '15', '30', '45'])}",
+        "ghi_chu": rng.choice(NOTES)
+    }
+    if not complete:
+        # đơn nháp đang dở: thiếu 1-2 field bắt buộc
+        for field in rng.sample(['ten_khach_hang', 'so_dien_thoai', 'dia_chi', 'gio_giao'], rng.randint(1, 2)):
+            order[field] = ''
+    return order
+
+
+def iter_drafts(size: int, seed: int = 1) -> Iterable[Dict[str, Any]]:
+    rng = random.Random(seed)
+    for i in range(1, size + 1):
+        yield make_order(i, rng, complete=rng.random() < 0.6)
+
+
+def iter_finals(size: int, seed: int = 2) -> Iterable[Dict[str, Any]]:
+    rng = random.Random(seed)
+    # đơn xác nhận rải đều trong 1 năm, theo thứ tự thời gian như khi ghi thật
+    step = timedelta(days=365) / max(1, size)
+    for i in range(1, size + 1):
+        order = make_order(i, rng)
+        order['confirmed_at'] = (START_TIME + step * i).isoformat()
+        order['status'] = rng.choice(['confirmed'] * 6 + ['delivering', 'delivered', 'cancelled'])
+        yield order
+
+
+def iter_messages(size: int, seed: int = 3) -> Iterable[Dict[str, Any]]:
+    rng = random.Random(seed)
+    # mỗi user có 1 hội thoại ~10 message, các hội thoại xen kẽ nhau theo thời gian
+    users = max(1, size // 10)
+    step = timedelta(days=365) / max(1, size)
+    turns: Dict[int, int] = {}
+    for i in range(1, size + 1):
+        user = rng.randrange(users)
+        turn = turns.get(user, 0)
+        turns[user] = turn + 1
+        if turn % 2 == 0:
+            order = make_order(i, rng)
+            cake = order['danh_sach_banh'][0]
+            content = USER_MESSAGES[(turn // 2) % len(USER_MESSAGES)].format(**order, **cake)
+            role = 'user'
+        else:
+            content = AGENT_MESSAGES[(turn // 2) % len(AGENT_MESSAGES)]
+            role = 'agent'
+        yield {
+            "id": i,
+            "user_id": f"user_{user:07d}",
+            "role": role,
+            "content": content,
+            "timestamp": (START_TIME + step * i).isoformat() + 'Z'
+        }
+
+
+def write_json_array(path: str, items: Iterable[Dict[str, Any]]) -> int:
+    """
+    Ghi 1 JSON list theo từng phần tử, trả về số byte đã ghi
+    """
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('[')
+        for index, item in enumerate(items):
+            f.write(',\n' if index else '\n')
+            f.write(json.dumps(item, ensure_ascii=False))
+        f.write('\n]')
+        return f.tell()
+
+
+def generate(data_dir: str, size: int, seed: int = 0) -> Dict[str, int]:
+    """
+    Sinh 3 file dữ liệu, mỗi file `size` bản ghi, trả về kích thước từng file (byte)
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    return {
+        'order_info.json': write_json_array(os.path.join(data_dir, 'order_info.json'), iter_drafts(size, seed + 1)),
+        'data_final.json': write_json_array(os.path.join(data_dir, 'data_final.json'), iter_finals(size, seed + 2)),
+        'chat_history.json': write_json_array(os.path.join(data_dir, 'chat_history.json'),
+                                              iter_messages(size, seed + 3)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=1000, help="số bản ghi mỗi file")
+    parser.add_argument('--out', required=True, help="thư mục đích (dùng làm DATA_DIR)")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    for name, size in generate(args.out, args.size, args.seed).items():
+        print(f"{name}: {size / 1e6:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
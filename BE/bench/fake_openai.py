@@ -0,0 +1,317 @@
+"""
+Server giả lập OpenAI Chat Completions API chạy local, dùng cho benchmark.
+
+    python -m bench.fake_openai --port 8100 --latency 0.5
+    python -m bench.fake_openai --rpm-limit 120 --error-rate 0.05   # giả lập 429
+    python -m bench.fake_openai --latency lognormal:0.8,0.5 --server-error-rate 0.01
+
+rồi trỏ service vào đó: OPENAI_BASE_URL=http://127.0.0.1:8100/v1
+
+StubAsyncOpenAI là bản chạy trong process (không qua HTTP, kết quả tất định) để gán
+thẳng vào service.client khi micro-benchmark.
+"""
+import argparse
+import json
+import math
+import random
+import threading
+import time
+import zlib
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Optional, Union
+
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+from bench.datasets import make_order
+
+DEFAULT_ORDER = {
+    "id": None,
+    "ten_khach_hang": "Nguyễn Văn An",
+    "so_dien_thoai": "0901234567",
+    "danh_sach_banh": [{"ten_banh": "bánh kem sinh nhật chocolate", "so_luong": 1}],
+    "dia_chi": "123 Đường Lê Lợi, Quận 1, TP.HCM",
+    "gio_giao": "14:30",
+    "ghi_chu": ""
+}
+
+# Trả lời cho prompt cập nhật chế độ delta (chỉ các field thay đổi)
+DEFAULT_DELTA = {"gio_giao": "14:30"}
+DELTA_PROMPT_MARKER = "ĐƠN HIỆN TẠI"
+
+
+def estimate_tokens(text: str) -> int:
+    # ước lượng thô ~4 ký tự / token, đủ để so sánh các kiểu prompt với nhau
+    return max(1, len(text) // 4)
+
+
+class LatencyModel:
+    """
+    Phân phối độ trễ của 1 completion, khai báo bằng chuỗi:
+        "0.5"                   cố định 0.5s
+        "uniform:0.2,1.5"       đều trong [0.2, 1.5]
+        "normal:0.8,0.2"        chuẩn (mean, std), không âm
+        "lognormal:0.8,0.5"     log-chuẩn (median, sigma) - đuôi dài giống API thật
+        "exp:0.8"               mũ với mean 0.8
+    """
+
+    def __init__(self, spec: Union[str, float]):
+        self.spec = str(spec)
+        kind, _, params = self.spec.partition(':')
+        if not params:
+            kind, params = 'fixed', kind
+        self.kind = kind
+        self.params = [float(p) for p in params.split(',')]
+        if kind not in ('fixed', 'uniform', 'normal', 'lognormal', 'exp'):
+            raise ValueError(f'Unknown latency distribution: {kind}')
+
+    def sample(self) -> float:
+        p = self.params
+        if self.kind == 'fixed':
+            return p[0]
+        if self.kind == 'uniform':
+            return random.uniform(p[0], p[1])
+        if self.kind == 'normal':
+            return max(0.0, random.gauss(p[0], p[1]))
+        if self.kind == 'lognormal':
+            return p[0] * math.exp(random.gauss(0, p[1]))
+        return random.expovariate(1 / p[0])
+
+
+def fake_answer(request: dict, order: dict, delta: dict) -> tuple:
+    """
+    Trả về (content, usage) cho 1 request chat completions: prompt cập nhật chế độ delta
+    nhận `delta`, còn lại nhận `order`
+    """
+    prompt = ''.join(m.get('content') or '' for m in request.get('messages', []))
+    answer = delta if DELTA_PROMPT_MARKER in prompt else order
+    content = json.dumps(answer, ensure_ascii=False)
+    usage = {
+        "prompt_tokens": estimate_tokens(prompt),
+        "completion_tokens": estimate_tokens(content),
+    }
+    usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+    return content, usage
+
+
+def completion_payload(request: dict, content: str, usage: dict) -> dict:
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.get("model", "gpt-4o-mini"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop"
+        }],
+        "usage": usage
+    }
+
+
+def chunk_payload(request: dict, content: Optional[str] = None, usage: Optional[dict] = None) -> dict:
+    chunk = {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": request.get("model", "gpt-4o-mini"),
+        "choices": [] if content is None else [
+            {"index": 0, "delta": {"content": content}, "finish_reason": None}
+        ]
+    }
+    if usage is not None:
+        chunk["usage"] = usage
+    return chunk
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    server_version = "FakeOpenAI/1.0"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+
+        if not self.path.endswith('/chat/completions'):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+
+        retry_after = self.server.check_rate_limit()
+        if retry_after is not None:
+            self._send_json(429, {"error": {
+                "message": "Rate limit reached for requests",
+                "type": "requests",
+                "code": "rate_limit_exceeded"
+            }}, {'Retry-After': f'{retry_after:.3g}'})
+            return
+
+        status = self.server.check_server_error()
+        if status:
+            self._send_json(status, {"error": {"message": "The server had an error while processing your request.",
+                                               "type": "server_error"}})
+            return
+
+        time.sleep(self.server.latency.sample())
+        content, usage = fake_answer(request, self.server.order, self.server.delta)
+        if request.get('stream'):
+            self._send_stream(request, content, usage)
+            return
+        self._send_json(200, completion_payload(request, content, usage))
+
+    def _send_stream(self, request: dict, content: str, usage: dict, chunk_size: int = 8):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        for i in range(0, len(content), chunk_size):
+            chunk = chunk_payload(request, content[i:i + chunk_size])
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+            time.sleep(self.server.token_delay)
+        if (request.get('stream_options') or {}).get('include_usage'):
+            chunk = chunk_payload(request, usage=usage)
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+    def _send_json(self, status: int, payload: dict, headers: Optional[dict] = None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # backlog mặc định (5) làm rơi SYN khi nhiều kết nối mở cùng lúc -> client chờ gửi lại ~1s
+    request_queue_size = 128
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: Union[float, str] = 0.5,
+                 order: Optional[dict] = None, token_delay: float = 0.01, delta: Optional[dict] = None,
+                 rpm_limit: int = 0, error_rate: float = 0.0, retry_after: float = 1.0,
+                 server_error_rate: float = 0.0):
+        super().__init__((host, port), FakeOpenAIHandler)
+        self.latency = latency if isinstance(latency, LatencyModel) else LatencyModel(latency)
+        self.token_delay = token_delay
+        self.order = order or DEFAULT_ORDER
+        self.delta = delta if delta is not None else DEFAULT_DELTA
+        # 429 khi vượt rpm_limit request trong 60s gần nhất (Retry-After = lúc cửa sổ có chỗ trống),
+        # hoặc ngẫu nhiên theo error_rate (Retry-After = retry_after)
+        self.rpm_limit = rpm_limit
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        # 500 / 503 ngẫu nhiên theo server_error_rate
+        self.server_error_rate = server_error_rate
+        self.stats = {'requests': 0, 'rate_limited': 0, 'server_errors': 0}
+        self._window: deque = deque()
+        self._stats_lock = threading.Lock()
+
+    def check_rate_limit(self) -> Optional[float]:
+        """
+        Trả về số giây Retry-After nếu request này bị 429, None nếu được xử lý
+        """
+        with self._stats_lock:
+            self.stats['requests'] += 1
+            now = time.monotonic()
+            while self._window and now - self._window[0] >= 60:
+                self._window.popleft()
+            retry_after = None
+            if self.rpm_limit and len(self._window) >= self.rpm_limit:
+                retry_after = 60 - (now - self._window[0])
+            elif random.random() < self.error_rate:
+                retry_after = self.retry_after
+            if retry_after is None:
+                self._window.append(now)
+            else:
+                self.stats['rate_limited'] += 1
+            return retry_after
+
+    def check_server_error(self) -> Optional[int]:
+        if random.random() >= self.server_error_rate:
+            return None
+        with self._stats_lock:
+            self.stats['server_errors'] += 1
+        return random.choice([500, 503])
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start_in_background(self) -> threading.Thread:
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+class StubAsyncOpenAI:
+    """
+    Thay cho openai.AsyncOpenAI trong micro-benchmark: trả lời ngay, tất định.
+    Với vary=True, đơn trả về được sinh từ hash của tin nhắn nên các tin nhắn khác nhau
+    cho ra đơn khác nhau (tên, bánh, địa chỉ...) nhưng chạy lại vẫn y hệt.
+    """
+
+    def __init__(self, order: Optional[dict] = None, delta: Optional[dict] = None, vary: bool = True):
+        self.order = order or DEFAULT_ORDER
+        self.delta = delta if delta is not None else DEFAULT_DELTA
+        self.vary = vary
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _order_for(self, request: dict) -> dict:
+        if not self.vary:
+            return self.order
+        message = (request.get('messages') or [{}])[-1].get('content') or ''
+        return make_order(None, random.Random(zlib.crc32(message.encode('utf-8'))))
+
+    async def _create(self, **request) -> Any:
+        self.calls += 1
+        content, usage = fake_answer(request, self._order_for(request), self.delta)
+        if request.get('stream'):
+            return self._stream(request, content, usage)
+        return ChatCompletion.model_validate(completion_payload(request, content, usage))
+
+    async def _stream(self, request: dict, content: str, usage: dict, chunk_size: int = 8) -> AsyncIterator[Any]:
+        for i in range(0, len(content), chunk_size):
+            yield ChatCompletionChunk.model_validate(chunk_payload(request, content[i:i + chunk_size]))
+        if (request.get('stream_options') or {}).get('include_usage'):
+            yield ChatCompletionChunk.model_validate(chunk_payload(request, usage=usage))
+
+    async def close(self) -> None:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake OpenAI chat completions server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8100)
+    parser.add_argument('--latency', default='0.5',
+                        help="độ trễ mỗi completion: số giây hoặc uniform:a,b / normal:mean,std / "
+                             "lognormal:median,sigma / exp:mean")
+    parser.add_argument('--server-error-rate', type=float, default=0.0, help="tỉ lệ trả 500 / 503 ngẫu nhiên")
+    parser.add_argument('--rpm-limit', type=int, default=0, help="trả 429 khi vượt số request / phút (0 = không giới hạn)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="tỉ lệ trả 429 ngẫu nhiên")
+    parser.add_argument('--retry-after', type=float, default=1.0, help="giá trị header Retry-After (giây)")
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(args.host, args.port, args.latency, rpm_limit=args.rpm_limit,
+                              error_rate=args.error_rate, retry_after=args.retry_after,
+                              server_error_rate=args.server_error_rate)
+    print(f"Fake OpenAI server listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+So sánh throughput ghi (1 message lịch sử + 1 cập nhật đơn nháp mỗi lần) khi N request
+ghi đồng thời: ghi ngay từng lần (như trước) và gom nhóm qua GroupCommitter.
+Với --fsync, chế độ ghi ngay fsync sau mỗi lần ghi còn group commit fsync 1 lần mỗi nhóm.
+
+    cd BE && python -m bench.group_commit --levels 1,8,64,256 --fsync
+"""
+import argparse
+import asyncio
+import shutil
+import tempfile
+import time
+
+from app.storage.group_commit import GroupCommitter
+from app.storage.json_backend import JsonBackend
+
+
+async def run_level(backend: JsonBackend, committer: GroupCommitter, concurrency: int, writes: int,
+                    fsync: bool) -> float:
+    history = backend.history()
+    drafts = backend.orders('order_info')
+    lock = asyncio.Lock()
+
+    async def worker(worker_id: int):
+        for i in range(writes):
+            # giống add_message + save_order_info: thao tác trong bộ nhớ tuần tự hoá bằng lock
+            async with lock:
+                history.append(f'user_{worker_id}', 'user', f'tin nhắn {i} của user {worker_id}')
+                drafts.add({'ten_khach_hang': f'Khách {worker_id}', 'danh_sach_banh': [], 'ghi_chu': str(i)})
+                if not committer.enabled and fsync:
+                    history.sync(True)
+                    drafts.sync(True)
+            await committer.commit()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(n) for n in range(concurrency)))
+    return concurrency * writes / (time.perf_counter() - start)
+
+
+async def main_async(levels, writes: int, fsync: bool, delay_ms: float):
+    print(f"{'N':>5} {'direct w/s':>12} {'group w/s':>12} {'speedup':>9} {'avg group':>10}")
+    for n in levels:
+        results = []
+        for enabled in (False, True):
+            data_dir = tempfile.mkdtemp(prefix='bakery_group_commit_')
+            backend = JsonBackend(data_dir)
+            committer = GroupCommitter(backend, enabled=enabled, max_delay=delay_ms / 1000, fsync=fsync)
+            try:
+                results.append(await run_level(backend, committer, n, writes, fsync))
+            finally:
+                await committer.close()
+                backend.close()
+                shutil.rmtree(data_dir, ignore_errors=True)
+        groups = committer.stats['groups'] or 1
+        print(f"{n:>5} {results[0]:>12.0f} {results[1]:>12.0f} {results[1] / results[0]:>8.1f}x "
+              f"{committer.stats['commits'] / groups:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--levels', default='1,8,64,256')
+    parser.add_argument('--writes', type=int, default=50, help="số lần ghi mỗi request")
+    parser.add_argument('--fsync', action='store_true')
+    parser.add_argument('--delay-ms', type=float, default=0.0)
+    args = parser.parse_args()
+    asyncio.run(main_async([int(n) for n in args.levels.split(',')], args.writes, args.fsync, args.delay_ms))
+
+
+if __name__ == '__main__':
+    main()
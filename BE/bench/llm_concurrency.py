@@ -0,0 +1,109 @@
+"""
+Đo throughput của AsyncChatbotService.analyze_message khi chạy N request đồng thời
+với server OpenAI giả lập (độ trễ cố định). Nếu event loop không bị chặn,
+throughput phải tăng gần tuyến tính theo N.
+
+Kiểm tra (in OK / FAIL, có FAIL thì exit code 1): mọi request thành công, speedup ở mức N
+đạt ít nhất --min-efficiency * N và event loop không bị chặn quá --max-lag giây (mặc định bằng
+--latency: gọi LLM đồng bộ sẽ chặn loop ít nhất chừng đó mỗi lần).
+
+    cd BE && python -m bench.llm_concurrency --latency 0.2 --levels 1,2,4,8,16,32
+"""
+import argparse
+import asyncio
+import os
+import itertools
+import sys
+import time
+
+from bench.fake_openai import FakeOpenAIServer
+
+# mỗi tin nhắn 1 nội dung khác nhau để không trúng cache trích xuất
+_message_ids = itertools.count()
+
+
+async def run_level(service, concurrency: int, rounds: int) -> tuple:
+    """
+    (throughput req/s, số request lỗi) khi chạy `concurrency` request đồng thời, `rounds` lượt
+    """
+    errors = []
+
+    async def one(i):
+        result = await service.analyze_message(f"tin nhắn số {next(_message_ids)}")
+        if 'error' in result:
+            errors.append(result['error'])
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        await asyncio.gather(*(one(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    if errors:
+        print(f"  lỗi: {errors[0]}")
+    return concurrency * rounds / elapsed, len(errors)
+
+
+async def watch_loop_lag(lags: list, interval: float = 0.01) -> None:
+    # event loop bị chặn (gọi đồng bộ trong coroutine) thì sleep thức dậy trễ
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+async def main_async(levels, rounds: int, min_efficiency: float, max_lag: float) -> bool:
+    from app.api.chatbot.services import AsyncChatbotService
+
+    service = AsyncChatbotService()
+    print(f"{'N':>5} {'req/s':>10} {'speedup':>9} {'errors':>7}")
+    baseline = None
+    ok = True
+    lags = []
+    try:
+        # warm-up: mở kết nối trước khi đo
+        await run_level(service, 1, 1)
+        watcher = asyncio.create_task(watch_loop_lag(lags))
+        for n in levels:
+            throughput, errors = await run_level(service, n, rounds)
+            baseline = baseline or throughput
+            speedup = throughput / baseline
+            level_ok = errors == 0 and speedup >= min_efficiency * n / levels[0]
+            ok = ok and level_ok
+            print(f"{n:>5} {throughput:>10.2f} {speedup:>8.1f}x {errors:>7} {'OK' if level_ok else 'FAIL'}")
+        watcher.cancel()
+    finally:
+        await service.aclose()
+
+    worst_lag = max(lags, default=0.0)
+    lag_ok = worst_lag <= max_lag
+    print(f"event loop trễ tối đa {worst_lag * 1000:.1f}ms {'OK' if lag_ok else 'FAIL'}")
+    return ok and lag_ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--levels', default='1,2,4,8,16,32')
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--min-efficiency', type=float, default=0.5,
+                        help="speedup tối thiểu ở mức N là min-efficiency * N (so với mức đầu tiên)")
+    parser.add_argument('--max-lag', type=float, help="độ trễ tối đa (giây) của event loop, mặc định = --latency")
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(latency=args.latency)
+    server.start_in_background()
+    os.environ['OPENAI_BASE_URL'] = server.base_url
+    os.environ.setdefault('OPENAI_API_KEY', 'sk-fake')
+    # đo khả năng chạy song song, không đo ngân sách RPM / TPM của scheduler
+    os.environ.setdefault('LLM_RPM', '1000000')
+    os.environ.setdefault('LLM_TPM', '1000000000')
+
+    try:
+        ok = asyncio.run(main_async([int(n) for n in args.levels.split(',')], args.rounds,
+                                    args.min_efficiency, args.max_lag or args.latency))
+    finally:
+        server.shutdown()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
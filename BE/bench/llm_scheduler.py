@@ -0,0 +1,272 @@
+"""
+Kiểm tra LLMScheduler với server OpenAI giả lập có giới hạn RPM (trả 429 + Retry-After):
+1 user gửi dồn dập cùng lúc với vài user bình thường. So sánh độ trễ của user bình thường
+khi chia lượt theo user_id (fair) và khi dùng chung 1 hàng đợi (fifo).
+
+Trước đó chạy các kiểm tra (in OK / FAIL, có FAIL thì exit code 1):
+- fairness: user gửi sau 1 user đang dồn 30 request vẫn được chạy sau tối đa 2 request của user kia
+- retry_after: gặp 429 + Retry-After thì lần thử lại và request của user khác đều chờ hết Retry-After
+- overload: hàng đợi đầy thì submit() và POST /chatbot/process trả 503 + Retry-After ngay
+
+    cd BE && python -m bench.llm_scheduler --rpm 600 --burst 60 --error-rate 0.02
+    cd BE && python -m bench.llm_scheduler --server-rpm 40 --burst 30   # server chặn theo RPM
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from typing import Dict, List
+
+import httpx
+import openai
+
+from bench.fake_openai import FakeOpenAIServer
+
+# sai số cho phép khi so thời điểm (giây)
+TIMING_SLACK = 0.02
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+def report_check(label: str, ok: bool, detail: str) -> bool:
+    print(f"{label:<12} {detail} {'OK' if ok else 'FAIL'}")
+    return ok
+
+
+async def check_fairness(chatty_jobs: int = 30, users: int = 3) -> bool:
+    """
+    1 lời gọi chạy 1 lúc: các user gửi sau khi 'chatty' đã dồn việc chỉ phải chờ
+    việc chatty đang chạy / đã lấy ra, không phải chờ cả hàng đợi của chatty
+    """
+    from app.api.chatbot.scheduler import LLMScheduler
+
+    scheduler = LLMScheduler(rpm=60000, max_concurrency=1)
+    starts: List[str] = []
+
+    def job(key: str):
+        async def call():
+            starts.append(key)
+            await asyncio.sleep(0.01)
+        return scheduler.submit(key, 1, call)
+
+    waited: Dict[str, int] = {}
+
+    async def late_user(key: str):
+        submitted_at = len(starts)
+        await job(key)
+        waited[key] = sum(1 for started in starts[submitted_at:starts.index(key)] if started == 'chatty')
+
+    try:
+        chatty = [asyncio.create_task(job('chatty')) for _ in range(chatty_jobs)]
+        await asyncio.sleep(0.035)
+        await asyncio.gather(*(late_user(f'user{i}') for i in range(users)))
+        chatty_left = chatty_jobs - starts.count('chatty')
+        await asyncio.gather(*chatty)
+    finally:
+        await scheduler.close()
+    worst = max(waited.values())
+    return report_check('fairness', worst <= 2 and chatty_left > 0,
+                        f"chatty trước user đến sau <= {worst}, chatty còn chờ={chatty_left}")
+
+
+def rate_limit_error(retry_after: float) -> openai.RateLimitError:
+    response = httpx.Response(429, headers={'retry-after': f'{retry_after:g}'},
+                              request=httpx.Request('POST', 'http://fake/v1/chat/completions'))
+    return openai.RateLimitError('Rate limit reached for requests', response=response, body=None)
+
+
+async def check_retry_after(retry_after: float = 0.5) -> bool:
+    """
+    Lần gọi đầu bị 429 + Retry-After: thử lại không sớm hơn Retry-After và scheduler
+    không phát request mới (của user khác) trong lúc đó
+    """
+    from app.api.chatbot.scheduler import LLMScheduler
+
+    scheduler = LLMScheduler(rpm=60000, max_concurrency=4, backoff_base=0.05)
+    attempts: List[float] = []
+    other_start: List[float] = []
+
+    async def limited():
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise rate_limit_error(retry_after)
+
+    async def other():
+        other_start.append(time.monotonic())
+
+    try:
+        first = asyncio.create_task(scheduler.submit('limited', 1, limited))
+        await asyncio.sleep(0.05)
+        await scheduler.submit('other', 1, other)
+        await first
+    finally:
+        await scheduler.close()
+    retry_gap = attempts[1] - attempts[0]
+    other_gap = other_start[0] - attempts[0]
+    ok = (retry_gap >= retry_after - TIMING_SLACK and other_gap >= retry_after - TIMING_SLACK
+          and scheduler.stats()['rate_limited'] == 1)
+    return report_check('retry_after', ok, f"Retry-After={retry_after}s, thử lại sau {retry_gap:.2f}s, "
+                                           f"user khác chạy sau {other_gap:.2f}s")
+
+
+async def check_overload(max_queue: int = 4, max_latency: float = 0.1) -> bool:
+    """
+    Hàng đợi đầy: submit() ném SchedulerOverloaded ngay (không chờ tới lượt), route
+    trả 503 kèm Retry-After cũng ngay
+    """
+    from app.api.chatbot import routes
+    from app.api.chatbot.scheduler import LLMScheduler, SchedulerOverloaded
+    from main import app
+
+    service = routes.chatbot_service
+    scheduler = LLMScheduler(rpm=60000, max_concurrency=1, max_queue=max_queue)
+    service.scheduler = scheduler
+    release = asyncio.Event()
+
+    async def blocked():
+        await release.wait()
+
+    pending = []
+    try:
+        # giữ chỗ cho tới khi hàng đợi đầy
+        rejected_after = None
+        for n in range(max_queue + 3):
+            try:
+                scheduler.check_capacity()
+            except SchedulerOverloaded:
+                rejected_after = n
+                break
+            pending.append(asyncio.create_task(scheduler.submit('filler', 1, blocked)))
+            await asyncio.sleep(0)
+
+        start = time.perf_counter()
+        try:
+            await scheduler.submit('late', 1, blocked)
+            submit_error = None
+        except SchedulerOverloaded as e:
+            submit_error = e
+        submit_latency = time.perf_counter() - start
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+            start = time.perf_counter()
+            response = await client.post('/chatbot/process', json={
+                'message': f'đặt 1 bánh kem lúc {time.time()}', 'user_id': 'late'})
+            http_latency = time.perf_counter() - start
+    finally:
+        release.set()
+        await asyncio.gather(*pending, return_exceptions=True)
+        await scheduler.close()
+
+    ok = (rejected_after is not None and submit_error is not None and submit_error.retry_after >= 1
+          and submit_latency < max_latency
+          and response.status_code == 503 and response.headers.get('retry-after', '').isdigit()
+          and http_latency < max_latency)
+    return report_check('overload', ok, f"đầy sau {rejected_after} việc, submit {submit_latency * 1000:.1f}ms, "
+                                        f"HTTP {response.status_code} Retry-After={response.headers.get('retry-after')} "
+                                        f"{http_latency * 1000:.1f}ms")
+
+
+async def run_checks() -> bool:
+    results = [await check_fairness(), await check_retry_after(), await check_overload()]
+    return all(results)
+
+
+async def run_scenario(service, fair: bool, burst: int, users: int, per_user: int, gap: float) -> Dict[str, dict]:
+    latencies: Dict[str, List[float]] = {}
+    errors: Dict[str, int] = {}
+    counter = iter(range(10 ** 9))
+
+    async def one(user: str):
+        start = time.perf_counter()
+        result = await service.analyze_message(f"{user} tin nhắn số {next(counter)} ({fair})",
+                                               user_id=user if fair else None)
+        if 'error' in result:
+            errors[user] = errors.get(user, 0) + 1
+        else:
+            latencies.setdefault(user, []).append(time.perf_counter() - start)
+
+    async def normal_user(user: str):
+        for _ in range(per_user):
+            await one(user)
+            await asyncio.sleep(gap)
+
+    await asyncio.gather(
+        *(one('chatty') for _ in range(burst)),
+        *(normal_user(f'user{i}') for i in range(users))
+    )
+    return {
+        user: {
+            'ok': len(values),
+            'errors': errors.get(user, 0),
+            'p50': statistics.median(values),
+            'p95': _percentile(values, 0.95)
+        }
+        for user, values in sorted(latencies.items())
+    }
+
+
+async def main_async(args) -> bool:
+    from app.api.chatbot.scheduler import LLMScheduler
+    from app.api.chatbot.services import AsyncChatbotService
+
+    ok = await run_checks()
+    if args.checks_only:
+        return ok
+
+    service = AsyncChatbotService()
+    try:
+        for fair in (False, True):
+            service.scheduler = LLMScheduler(rpm=args.rpm, max_concurrency=args.concurrency,
+                                             backoff_base=0.2)
+            start = time.perf_counter()
+            report = await run_scenario(service, fair, args.burst, args.users, args.per_user, args.gap)
+            elapsed = time.perf_counter() - start
+            stats = service.scheduler.stats()
+            await service.scheduler.close()
+
+            print(f"\n[{'fair' if fair else 'fifo'}] {elapsed:.1f}s, retries={stats['retries']}, "
+                  f"rate_limited={stats['rate_limited']}, failed={stats['failed']}")
+            print(f"{'user':>8} {'ok':>4} {'err':>4} {'p50 (s)':>8} {'p95 (s)':>8}")
+            for user, row in report.items():
+                print(f"{user:>8} {row['ok']:>4} {row['errors']:>4} {row['p50']:>8.2f} {row['p95']:>8.2f}")
+    finally:
+        await service.aclose()
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--rpm', type=float, default=600, help="ngân sách RPM của scheduler")
+    parser.add_argument('--server-rpm', type=int, default=0, help="giới hạn RPM thật của server giả lập (0 = không giới hạn)")
+    parser.add_argument('--error-rate', type=float, default=0.02, help="tỉ lệ 429 ngẫu nhiên")
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--burst', type=int, default=60, help="số request user dồn dập gửi cùng lúc")
+    parser.add_argument('--users', type=int, default=3)
+    parser.add_argument('--per-user', type=int, default=5)
+    parser.add_argument('--gap', type=float, default=0.2)
+    parser.add_argument('--checks-only', action='store_true', help="chỉ chạy các kiểm tra, bỏ qua phần so sánh độ trễ")
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(latency=args.latency, rpm_limit=args.server_rpm,
+                              error_rate=args.error_rate, retry_after=0.5)
+    server.start_in_background()
+    os.environ['OPENAI_BASE_URL'] = server.base_url
+    os.environ.setdefault('OPENAI_API_KEY', 'sk-fake')
+
+    try:
+        ok = asyncio.run(main_async(args))
+    finally:
+        print(f"\nserver: {server.stats}")
+        server.shutdown()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Micro-benchmark cho OrderStore: độ trễ lookup / update / add / confirm
+khi kho có từ 100 tới 1.000.000 đơn nháp. Với index trong bộ nhớ và log
+append-only, độ trễ phải gần như không đổi theo số đơn.
+
+    cd BE && python -m bench.order_store --sizes 100,10000,1000000
+"""
+import argparse
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+
+from app.api.chatbot.order_store import OrderStore
+
+
+def make_draft(i: int) -> dict:
+    return {
+        "ten_khach_hang": f"Khách {i}",
+        "so_dien_thoai": f"09{i % 100000000:08d}",
+        "danh_sach_banh": [{"ten_banh": "bánh kem", "so_luong": 1 + i % 3}],
+        "dia_chi": "",
+        "gio_giao": "",
+        "ghi_chu": ""
+    }
+
+
+def timed(func, repeat: int):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1e6)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.99) - 1]
+
+
+def bench_size(size: int, repeat: int) -> dict:
+    directory = tempfile.mkdtemp(prefix='order_store_bench_')
+    try:
+        drafts = OrderStore(os.path.join(directory, 'order_info.jsonl'))
+        drafts.open()
+        finals = OrderStore(os.path.join(directory, 'data_final.jsonl'))
+        finals.open()
+
+        batch = 50000
+        for start in range(0, size, batch):
+            drafts.add_many([make_draft(i) for i in range(start, min(size, start + batch))])
+
+        rng = random.Random(size)
+
+        def lookup():
+            drafts.get(rng.randint(1, size))
+
+        def update():
+            order_id = rng.randint(1, size)
+            order = drafts.get(order_id)
+            order['gio_giao'] = '14:30'
+            drafts.put(order_id, order)
+
+        def add():
+            drafts.add(make_draft(0))
+
+        def confirm():
+            order = drafts.get(rng.randint(1, size))
+            order['status'] = 'confirmed'
+            finals.add(order)
+
+        results = {'size': size}
+        for name, func in (('lookup', lookup), ('update', update), ('add', add), ('confirm', confirm)):
+            results[name] = timed(func, repeat)
+
+        drafts.close()
+        finals.close()
+        return results
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', default='100,1000,10000,100000,1000000')
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{'drafts':>9} | " + ' | '.join(f"{name:^17}" for name in ('lookup', 'update', 'add', 'confirm')))
+    print(f"{'':>9} | " + ' | '.join(f"{'p50 µs':>8} {'p99 µs':>8}" for _ in range(4)))
+    for size in (int(s) for s in args.sizes.split(',')):
+        results = bench_size(size, args.repeat)
+        cells = ' | '.join(f"{results[name][0]:>8.1f} {results[name][1]:>8.1f}"
+                           for name in ('lookup', 'update', 'add', 'confirm'))
+        print(f"{size:>9} | {cells}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,389 @@
+"""
+Load test end-to-end bằng cách phát lại các hội thoại thật trong chat_history.
+
+Mỗi user_id trong lịch sử là 1 phiên (tin nhắn 'user' theo thứ tự thời gian). Phiên được
+phát lại giống hệt frontend: GET /history/ -> với mỗi tin nhắn: POST /history/ (user)
+-> POST /chatbot/process (kèm order_id trả về lần trước) hoặc POST /chatbot/confirm khi
+người dùng gõ "xác nhận" -> POST /history/ (agent). Khoảng nghỉ giữa 2 tin nhắn lấy theo
+timestamp gốc chia cho --speedup. Các phiên bắt đầu theo tiến trình Poisson (--rate phiên/giây)
+hoặc theo thời điểm gốc (--rate 0).
+
+Chạy với app đang chạy sẵn:
+
+    cd BE && python -m bench.replay --base-url http://127.0.0.1:8000 --data-dir app --sessions 200 --rate 5
+
+hoặc để harness tự bật server OpenAI giả lập + uvicorn trên thư mục dữ liệu tạm:
+
+    cd BE && python -m bench.replay --spawn --latency lognormal:0.8,0.5 --error-rate 0.02 \\
+        --sessions 500 --rate 10 --speedup 20 --out bench/results/replay.json
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from bench.fake_openai import FakeOpenAIServer
+
+BE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_HISTORY = os.path.join(BE_DIR, 'app', 'chat_history.json')
+
+# Giống frontend (homepage.jsx): tin nhắn chứa các cụm này + đang có đơn -> xác nhận đơn
+CONFIRM_WORDS = ('xác nhận', 'confirm', 'đồng ý')
+WELCOME_MESSAGE = 'Xin chào! Tôi là trợ lý ảo của tiệm bánh. Bạn cần hỗ trợ gì hôm nay?'
+
+
+@dataclass
+class Session:
+    user_id: str
+    start: float                                   # timestamp gốc của tin nhắn đầu (giây)
+    turns: List[Tuple[float, str]] = field(default_factory=list)  # (giây kể từ tin nhắn trước, nội dung)
+
+
+def _parse_time(value: str) -> float:
+    try:
+        return datetime.fromisoformat(value.rstrip('Z')).timestamp()
+    except (AttributeError, ValueError):
+        return 0.0
+
+
+def _read_messages(path: str) -> List[Dict[str, Any]]:
+    # file chat_history.json (JSON list) hoặc thư mục segment chat_history/ của JsonBackend
+    if os.path.isdir(path):
+        messages = []
+        for segment in sorted(glob.glob(os.path.join(path, 'segment-*.jsonl'))):
+            with open(segment, 'rb') as f:
+                messages.extend(json.loads(line) for line in f if line.endswith(b'\n'))
+        return messages
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def load_sessions(path: str) -> List[Session]:
+    """
+    Dựng lại các phiên theo user_id, tin nhắn user sắp theo timestamp
+    """
+    by_user: Dict[str, List[Tuple[float, str]]] = {}
+    for msg in _read_messages(path):
+        if msg.get('role') == 'user' and msg.get('content'):
+            by_user.setdefault(msg['user_id'], []).append((_parse_time(msg.get('timestamp')), msg['content']))
+
+    sessions = []
+    for user_id, messages in by_user.items():
+        messages.sort(key=lambda m: m[0])
+        session = Session(user_id, messages[0][0])
+        previous = messages[0][0]
+        for ts, content in messages:
+            session.turns.append((max(0.0, ts - previous), content))
+            previous = ts
+        sessions.append(session)
+    sessions.sort(key=lambda s: s.start)
+    return sessions
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.statuses: Dict[str, Dict[str, int]] = {}
+        self.sessions = {'started': 0, 'completed': 0, 'failed': 0, 'orders_confirmed': 0}
+
+    def record(self, endpoint: str, seconds: float, status: Any) -> None:
+        self.latencies.setdefault(endpoint, []).append(seconds)
+        counts = self.statuses.setdefault(endpoint, {})
+        counts[str(status)] = counts.get(str(status), 0) + 1
+
+    def summary(self, duration: float) -> Dict[str, Any]:
+        endpoints = {}
+        for endpoint, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            statuses = self.statuses[endpoint]
+            endpoints[endpoint] = {
+                'count': len(values),
+                'errors': sum(n for status, n in statuses.items() if not status.startswith('2')),
+                'statuses': statuses,
+                'rps': len(values) / duration if duration else 0.0,
+                'p50_ms': statistics.median(values) * 1000,
+                'p95_ms': values[min(len(values) - 1, int(len(values) * 0.95))] * 1000,
+                'p99_ms': values[min(len(values) - 1, int(len(values) * 0.99))] * 1000,
+                'max_ms': values[-1] * 1000
+            }
+        total = sum(len(v) for v in self.latencies.values())
+        return {
+            'duration_seconds': duration,
+            'requests': total,
+            'throughput_rps': total / duration if duration else 0.0,
+            'sessions': self.sessions,
+            'endpoints': endpoints
+        }
+
+
+class Replayer:
+    def __init__(self, client: httpx.AsyncClient, recorder: Recorder, speedup: float, max_think: float,
+                 stream: bool):
+        self.client = client
+        self.recorder = recorder
+        self.speedup = speedup
+        self.max_think = max_think
+        self.stream = stream
+
+    async def _request(self, method: str, url: str, label: Optional[str] = None, **kwargs) -> Optional[httpx.Response]:
+        label = label or f'{method} {url}'
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except httpx.HTTPError as e:
+            self.recorder.record(label, time.perf_counter() - start, type(e).__name__)
+            return None
+        self.recorder.record(label, time.perf_counter() - start, response.status_code)
+        return response
+
+    async def _process_stream(self, payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        label = 'POST /chatbot/process/stream'
+        start = time.perf_counter()
+        result = None
+        status: Any = 'no_result'
+        try:
+            async with self.client.stream('POST', '/chatbot/process/stream', json=payload) as response:
+                status = response.status_code
+                first = True
+                event = None
+                async for line in response.aiter_lines():
+                    if first:
+                        self.recorder.record(label + ' (first event)', time.perf_counter() - start, status)
+                        first = False
+                    if line.startswith('event:'):
+                        event = line[6:].strip()
+                    elif line.startswith('data:') and event == 'result':
+                        result = json.loads(line[5:])
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        self.recorder.record(label, time.perf_counter() - start, status)
+        return result
+
+    async def run(self, session: Session, user_id: str) -> None:
+        self.recorder.sessions['started'] += 1
+        order_id = None
+        try:
+            response = await self._request('GET', '/history/', params={'user_id': user_id})
+            if response is not None and response.status_code == 200 and not response.json():
+                await self._request('POST', '/history/',
+                                    json={'user_id': user_id, 'role': 'agent', 'content': WELCOME_MESSAGE})
+
+            for think, content in session.turns:
+                await asyncio.sleep(min(self.max_think, think / self.speedup))
+                await self._request('POST', '/history/', json={'user_id': user_id, 'role': 'user', 'content': content})
+
+                reply = '❌ Có lỗi xảy ra khi xử lý tin nhắn. Vui lòng thử lại!'
+                if order_id and any(word in content.lower() for word in CONFIRM_WORDS):
+                    response = await self._request('POST', '/chatbot/confirm', json={'order_id': order_id})
+                    if response is not None and response.status_code == 200:
+                        reply = response.json()['message']
+                        self.recorder.sessions['orders_confirmed'] += 1
+                        order_id = None
+                else:
+                    payload = {'message': content, 'order_id': order_id, 'user_id': user_id}
+                    if self.stream:
+                        result = await self._process_stream(payload)
+                    else:
+                        response = await self._request('POST', '/chatbot/process', json=payload)
+                        result = response.json()['data'] if response is not None and response.status_code == 200 else None
+                    if result:
+                        reply = result.get('message', reply)
+                        order_id = result.get('order_id') or order_id
+
+                await self._request('POST', '/history/', json={'user_id': user_id, 'role': 'agent', 'content': reply})
+            self.recorder.sessions['completed'] += 1
+        except Exception as e:
+            print(f"Session {user_id} failed: {str(e)}", file=sys.stderr)
+            self.recorder.sessions['failed'] += 1
+
+
+def dir_sizes(path: str) -> Dict[str, int]:
+    sizes = {}
+    for root, _, files in os.walk(path):
+        for name in files:
+            full = os.path.join(root, name)
+            try:
+                sizes[os.path.relpath(full, path)] = os.path.getsize(full)
+            except OSError:
+                pass
+    return sizes
+
+
+def growth_report(before: Dict[str, int], after: Dict[str, int], duration: float, sessions: int) -> Dict[str, Any]:
+    files = {}
+    for name in sorted(set(before) | set(after)):
+        delta = after.get(name, 0) - before.get(name, 0)
+        if delta:
+            files[name] = {'before': before.get(name, 0), 'after': after.get(name, 0), 'delta': delta}
+    total = sum(after.values()) - sum(before.values())
+    return {
+        'bytes_before': sum(before.values()),
+        'bytes_after': sum(after.values()),
+        'bytes_delta': total,
+        'bytes_per_second': total / duration if duration else 0.0,
+        'bytes_per_session': total / sessions if sessions else 0.0,
+        'files': files
+    }
+
+
+async def replay(args, base_url: str, data_dir: Optional[str]) -> Dict[str, Any]:
+    sessions = load_sessions(args.history)
+    if not sessions:
+        raise SystemExit(f'No user messages in {args.history}')
+    total = args.sessions or len(sessions)
+    rng = random.Random(args.seed)
+    recorder = Recorder()
+    limit = asyncio.Semaphore(args.concurrency)
+    before = dir_sizes(data_dir) if data_dir else {}
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout,
+                                 limits=httpx.Limits(max_connections=args.concurrency * 2)) as client:
+        replayer = Replayer(client, recorder, args.speedup, args.max_think, args.stream)
+
+        async def one(index: int):
+            # chạy vòng lại các transcript, mỗi lần 1 user_id mới để không trộn lịch sử
+            session = sessions[index % len(sessions)]
+            async with limit:
+                await replayer.run(session, f'replay_{index}_{session.user_id}')
+
+        start = time.perf_counter()
+        tasks = []
+        first_start = sessions[0].start
+        for index in range(total):
+            if args.rate > 0:
+                await asyncio.sleep(rng.expovariate(args.rate))
+            else:
+                session = sessions[index % len(sessions)]
+                cycle = index // len(sessions)
+                offset = (session.start - first_start) / args.speedup
+                await asyncio.sleep(max(0.0, start + offset + cycle * 1.0 - time.perf_counter()))
+            tasks.append(asyncio.create_task(one(index)))
+        await asyncio.gather(*tasks)
+        duration = time.perf_counter() - start
+
+    report = recorder.summary(duration)
+    if data_dir:
+        report['data_growth'] = growth_report(before, dir_sizes(data_dir), duration, recorder.sessions['completed'])
+    return report
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _wait_ready(base_url: str, process: subprocess.Popen, timeout: float = 30) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise SystemExit('uvicorn exited before becoming ready')
+        try:
+            if httpx.get(base_url + '/metrics', timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise SystemExit('uvicorn did not become ready in time')
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    sessions = report['sessions']
+    print(f"\n{report['duration_seconds']:.1f}s, {report['requests']} requests, "
+          f"{report['throughput_rps']:.1f} req/s, sessions: {sessions}")
+    print(f"{'endpoint':<44} {'count':>6} {'err':>5} {'rps':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for endpoint, row in report['endpoints'].items():
+        print(f"{endpoint:<44} {row['count']:>6} {row['errors']:>5} {row['rps']:>7.1f} {row['p50_ms']:>8.1f} "
+              f"{row['p95_ms']:>8.1f} {row['p99_ms']:>8.1f} {row['max_ms']:>8.1f}")
+    growth = report.get('data_growth')
+    if growth:
+        print(f"\ndata growth: {growth['bytes_delta'] / 1e6:.2f} MB "
+              f"({growth['bytes_per_second'] / 1e3:.1f} KB/s, {growth['bytes_per_session'] / 1e3:.1f} KB/session)")
+        for name, row in growth['files'].items():
+            print(f"  {name:<38} +{row['delta'] / 1e3:.1f} KB")
+    if 'fake_openai' in report:
+        print(f"\nfake OpenAI: {report['fake_openai']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--history', default=DEFAULT_HISTORY, help="chat_history.json hoặc thư mục chat_history/")
+    parser.add_argument('--base-url', help="app đang chạy (bỏ trống nếu dùng --spawn)")
+    parser.add_argument('--data-dir', help="DATA_DIR của app để đo tốc độ tăng dung lượng file")
+    parser.add_argument('--sessions', type=int, default=0, help="số phiên phát lại (mặc định = số transcript)")
+    parser.add_argument('--rate', type=float, default=2.0, help="số phiên bắt đầu / giây (0 = theo thời điểm gốc)")
+    parser.add_argument('--speedup', type=float, default=10.0, help="hệ số tua nhanh khoảng nghỉ giữa các tin nhắn")
+    parser.add_argument('--max-think', type=float, default=30.0, help="khoảng nghỉ tối đa giữa 2 tin nhắn (giây)")
+    parser.add_argument('--concurrency', type=int, default=200, help="số phiên chạy đồng thời tối đa")
+    parser.add_argument('--stream', action='store_true', help="dùng /chatbot/process/stream như frontend")
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help="lưu báo cáo JSON")
+    spawn = parser.add_argument_group('--spawn: tự chạy uvicorn + OpenAI giả lập')
+    spawn.add_argument('--spawn', action='store_true')
+    spawn.add_argument('--latency', default='lognormal:0.8,0.4', help="phân phối độ trễ LLM (xem bench.fake_openai)")
+    spawn.add_argument('--error-rate', type=float, default=0.0, help="tỉ lệ 429")
+    spawn.add_argument('--server-error-rate', type=float, default=0.0, help="tỉ lệ 500 / 503")
+    spawn.add_argument('--rpm-limit', type=int, default=0)
+    args = parser.parse_args()
+
+    if not args.spawn and not args.base_url:
+        parser.error('--base-url or --spawn is required')
+
+    fake = process = None
+    temp_dir = None
+    try:
+        base_url, data_dir = args.base_url, args.data_dir
+        if args.spawn:
+            fake = FakeOpenAIServer(latency=args.latency, error_rate=args.error_rate, retry_after=0.5,
+                                    server_error_rate=args.server_error_rate, rpm_limit=args.rpm_limit)
+            fake.start_in_background()
+            if not data_dir:
+                data_dir = temp_dir = tempfile.mkdtemp(prefix='bakery_replay_')
+            port = _free_port()
+            base_url = f'http://127.0.0.1:{port}'
+            env = dict(os.environ, DATA_DIR=data_dir, OPENAI_BASE_URL=fake.base_url,
+                       OPENAI_API_KEY=os.getenv('OPENAI_API_KEY') or 'sk-fake')
+            env.pop('EXTRACTION_CACHE_PATH', None)
+            process = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'main:app', '--port', str(port),
+                                        '--log-level', 'warning'], cwd=BE_DIR, env=env)
+            _wait_ready(base_url, process)
+
+        report = asyncio.run(replay(args, base_url, data_dir))
+        report['config'] = {k: v for k, v in vars(args).items()}
+        if fake:
+            report['fake_openai'] = fake.stats
+        print_report(report)
+        if args.out:
+            os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+            with open(args.out, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2, ensure_ascii=False)
+    finally:
+        if process:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if fake:
+            fake.shutdown()
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
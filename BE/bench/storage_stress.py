@@ -0,0 +1,210 @@
+"""
+Stress test ghi đồng thời từ nhiều process vào cùng 1 DATA_DIR (STORAGE_MULTI_PROCESS=1),
+sau đó mở lại kho và kiểm tra không mất / không trùng bản ghi nào đã được xác nhận.
+
+- direct: N process gọi thẳng JsonBackend (append lịch sử, add / add_many / put đơn nháp)
+- http: chạy uvicorn --workers N cùng server OpenAI giả lập, bắn đồng thời POST /history/,
+  POST /chatbot/analyze và POST /chatbot/confirm
+
+    cd BE && python -m bench.storage_stress --mode direct --workers 4 --ops 2000
+    cd BE && python -m bench.storage_stress --mode http --workers 4 --requests 2000 --concurrency 64
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Any, Dict, List
+
+import httpx
+
+from app.storage.json_backend import JsonBackend
+from bench.fake_openai import FakeOpenAIServer
+from bench.replay import BE_DIR, _free_port, _wait_ready
+
+# đơn đủ thông tin để /chatbot/confirm lưu được vào data_final
+COMPLETE_MESSAGE = ('Tôi là Khách {n}, số điện thoại 0901234567, đặt 1 bánh kem chocolate, '
+                    'giao tới 12 Lê Lợi Quận 1 lúc 14:30')
+
+
+def _direct_worker(args) -> Dict[str, List]:
+    data_dir, worker, ops = args
+    backend = JsonBackend(data_dir, shared=True)
+    history = backend.history()
+    drafts = backend.orders('order_info')
+    acked = {'messages': [], 'orders': []}
+    try:
+        for i in range(ops):
+            tag = f'w{worker}-{i}'
+            acked['messages'].append((history.append(f'user_{worker}', 'user', tag)['id'], tag))
+            if i % 10 == 9:
+                tags = [f'{tag}-{k}' for k in range(3)]
+                ids = drafts.add_many([{'ghi_chu': t, 'danh_sach_banh': []} for t in tags])
+                acked['orders'].extend(zip(ids, tags))
+            else:
+                order_id = drafts.add({'ghi_chu': tag, 'danh_sach_banh': []})
+                acked['orders'].append((order_id, tag))
+                if i % 5 == 0:
+                    # sửa lại đơn vừa tạo, bản cuối cùng phải là bản được đọc lại
+                    drafts.put(order_id, {'id': order_id, 'ghi_chu': tag, 'danh_sach_banh': [], 'sua': True})
+    finally:
+        backend.close()
+    return acked
+
+
+def check(label: str, stored: Dict[int, str], acked: List) -> Dict[str, Any]:
+    """
+    So sánh bản ghi đọc lại từ kho (id -> tag) với các bản ghi đã được xác nhận
+    """
+    ids = Counter(record_id for record_id, _ in acked)
+    result = {
+        'acked': len(acked),
+        'stored': len(stored),
+        'duplicate_ids': sum(1 for count in ids.values() if count > 1),
+        'lost': sum(1 for record_id, tag in acked if stored.get(record_id) != tag),
+    }
+    ok = result['duplicate_ids'] == 0 and result['lost'] == 0
+    print(f"{label:<10} acked={result['acked']:<7} stored={result['stored']:<7} "
+          f"duplicate_ids={result['duplicate_ids']:<4} lost={result['lost']:<4} {'OK' if ok else 'FAIL'}")
+    result['ok'] = ok
+    return result
+
+
+def reopen(data_dir: str) -> Dict[str, Dict[int, Any]]:
+    backend = JsonBackend(data_dir, shared=False)
+    try:
+        return {
+            'messages': {m['id']: m for m in backend.history().read_all()},
+            'orders': {o['id']: o for o in backend.orders('order_info').all()},
+            'finals': {o['id']: o for o in backend.orders('data_final').all()},
+        }
+    finally:
+        backend.close()
+
+
+def run_direct(data_dir: str, workers: int, ops: int) -> bool:
+    start = time.perf_counter()
+    with multiprocessing.get_context('spawn').Pool(workers) as pool:
+        results = pool.map(_direct_worker, [(data_dir, n, ops) for n in range(workers)])
+    duration = time.perf_counter() - start
+    acked = {key: [record for result in results for record in result[key]] for key in ('messages', 'orders')}
+    print(f"{workers} process, {sum(len(v) for v in acked.values())} bản ghi trong {duration:.1f}s")
+
+    stored = reopen(data_dir)
+    messages = check('messages', {i: m['content'] for i, m in stored['messages'].items()}, acked['messages'])
+    orders = check('orders', {i: o.get('ghi_chu') for i, o in stored['orders'].items()}, acked['orders'])
+    edited = [o for o in stored['orders'].values() if o.get('sua')]
+    expected_edits = sum(1 for _, tag in acked['orders'] if tag.count('-') == 1 and int(tag.split('-')[1]) % 5 == 0)
+    print(f"{'edits':<10} expected={expected_edits:<7} stored={len(edited):<7}")
+    return messages['ok'] and orders['ok'] and len(edited) == expected_edits
+
+
+async def _http_load(base_url: str, requests: int, concurrency: int) -> Dict[str, List]:
+    acked = {'messages': [], 'orders': [], 'finals': []}
+    errors = Counter()
+    queue: asyncio.Queue = asyncio.Queue()
+    for n in range(requests):
+        queue.put_nowait(n)
+
+    async def one(client: httpx.AsyncClient, n: int):
+        tag = f'req-{n}'
+        response = await client.post('/history/', json={'user_id': f'user_{n % 97}', 'role': 'user', 'content': tag})
+        if response.status_code == 201:
+            acked['messages'].append((response.json()['id'], tag))
+        else:
+            errors['history'] += 1
+        if n % 4:
+            return
+        response = await client.post('/chatbot/analyze', json={'message': COMPLETE_MESSAGE.format(n=n)})
+        data = response.json().get('data') if response.status_code == 200 else None
+        if not data or 'id' not in data:
+            errors['analyze'] += 1
+            return
+        acked['orders'].append((data['id'], data.get('ten_khach_hang')))
+        if n % 8 == 0:
+            response = await client.post('/chatbot/confirm', json={'order_id': data['id']})
+            body = response.json() if response.status_code == 200 else {}
+            order = body.get('data') or {}
+            if body.get('success') and order.get('id'):
+                # data là đơn đã lưu, id là id trong kho data_final
+                acked['finals'].append((order['id'], order.get('ten_khach_hang')))
+            else:
+                errors['confirm'] += 1
+
+    async def worker(client: httpx.AsyncClient):
+        while not queue.empty():
+            n = queue.get_nowait()
+            try:
+                await one(client, n)
+            except httpx.HTTPError:
+                errors['transport'] += 1
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+    if errors:
+        print(f"request errors: {dict(errors)}")
+    return acked
+
+
+def run_http(data_dir: str, workers: int, requests: int, concurrency: int) -> bool:
+    fake = FakeOpenAIServer(latency='0.02')
+    fake.start_in_background()
+    port = _free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    env = dict(os.environ, DATA_DIR=data_dir, OPENAI_BASE_URL=fake.base_url, STORAGE_BACKEND='json',
+               STORAGE_MULTI_PROCESS='1', SLOW_REQUEST_SECONDS='60', OPENAI_API_KEY=os.getenv('OPENAI_API_KEY') or 'sk-fake')
+    env.pop('EXTRACTION_CACHE_PATH', None)
+    process = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'main:app', '--port', str(port),
+                                '--workers', str(workers), '--log-level', 'warning'], cwd=BE_DIR, env=env)
+    try:
+        _wait_ready(base_url, process, timeout=60)
+        start = time.perf_counter()
+        acked = asyncio.run(_http_load(base_url, requests, concurrency))
+        duration = time.perf_counter() - start
+        print(f"{workers} worker, {requests} request trong {duration:.1f}s ({requests / duration:.0f} req/s)")
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        fake.shutdown()
+
+    stored = reopen(data_dir)
+    results = [
+        check('messages', {i: m['content'] for i, m in stored['messages'].items()}, acked['messages']),
+        check('orders', {i: o.get('ten_khach_hang') for i, o in stored['orders'].items()}, acked['orders']),
+        check('finals', {i: o.get('ten_khach_hang') for i, o in stored['finals'].items()}, acked['finals']),
+    ]
+    return all(result['ok'] for result in results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=('direct', 'http'), default='direct')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--ops', type=int, default=2000, help="direct: số lượt ghi mỗi process")
+    parser.add_argument('--requests', type=int, default=2000, help="http: tổng số lượt")
+    parser.add_argument('--concurrency', type=int, default=64, help="http: số request đồng thời")
+    parser.add_argument('--data-dir', help="mặc định: thư mục tạm, xoá sau khi chạy")
+    args = parser.parse_args()
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='bakery_storage_stress_')
+    try:
+        if args.mode == 'direct':
+            ok = run_direct(data_dir, args.workers, args.ops)
+        else:
+            ok = run_http(data_dir, args.workers, args.requests, args.concurrency)
+    finally:
+        if not args.data_dir:
+            shutil.rmtree(data_dir, ignore_errors=True)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,305 @@
+"""
+Micro-benchmark cho các hàm service và endpoint của chatbot / history trên dữ liệu
+giả lập cỡ production (bench.datasets). LLM được thay bằng StubAsyncOpenAI chạy trong
+process nên chỉ đo phần code của mình. Mỗi cỡ dữ liệu chạy trong 1 process riêng để
+đo peak RSS; kết quả (ops/sec, p50/p99, peak RSS) được lưu JSON để so sánh giữa các commit.
+
+    cd BE && python -m bench.suite --sizes 1000,100000,1000000 --out bench/results/after.json
+    cd BE && python -m bench.suite --compare bench/results/before.json bench/results/after.json
+"""
+import argparse
+import asyncio
+import inspect
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from bench.datasets import generate
+
+BE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(BE_DIR, 'bench', 'results')
+
+# Hàm đọc toàn bộ dữ liệu (O(N)) chỉ chạy vài lần
+HEAVY = 'heavy'
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss tính bằng KB trên Linux, byte trên macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BE_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def measure(func: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        if inspect.isawaitable(result):
+            await result
+        samples.append(time.perf_counter() - start)
+    total = sum(samples)
+    samples.sort()
+    return {
+        'n': repeat,
+        'ops_per_sec': repeat / total if total else float('inf'),
+        'p50_ms': statistics.median(samples) * 1000,
+        'p99_ms': samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000,
+        'max_ms': samples[-1] * 1000
+    }
+
+
+# ----------------------------------------------------------------------
+# Worker: chạy trong process riêng cho 1 cỡ dữ liệu
+# ----------------------------------------------------------------------
+def _benchmarks(service, history, client, size: int, rng: random.Random) -> List[Tuple[str, Optional[str], Callable]]:
+    counter = iter(range(10 ** 9))
+
+    def draft_id() -> int:
+        return rng.randint(1, size)
+
+    def user_id() -> str:
+        return f"user_{rng.randrange(max(1, size // 10)):07d}"
+
+    def new_message() -> str:
+        # nội dung khác nhau mỗi lần để không trúng cache trích xuất
+        return f"Mình muốn đặt bánh, mã tin {next(counter)}"
+
+    drafts = [order for order in (service.draft_store.get(rng.randint(1, size)) for _ in range(500)) if order]
+
+    def pair() -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        return rng.choice(drafts), rng.choice(drafts)
+
+    return [
+        # hàm thuần, không I/O
+        ('check_order_completeness', None, lambda: service.check_order_completeness(rng.choice(drafts))),
+        ('merge_banh_list', None, lambda: service.merge_banh_list(*(o['danh_sach_banh'] for o in pair()))),
+        ('merge_order_info', None, lambda: service.merge_order_info(*pair())),
+        ('build_process_result', None, lambda: service.build_process_result(rng.choice(drafts))),
+        # service (LLM stub + lưu trữ)
+        ('analyze_message.new', None, lambda: service.analyze_message(new_message(), user_id='bench')),
+        ('analyze_message.update', None,
+         lambda: service.analyze_message(new_message(), rng.choice(drafts), user_id='bench')),
+        ('process_order_logic.new', None, lambda: service.process_order_logic(new_message(), user_id='bench')),
+        ('process_order_logic.update', None,
+         lambda: service.process_order_logic(new_message(), draft_id(), user_id='bench')),
+        ('save_order_info', None, lambda: service.save_order_info(dict(rng.choice(drafts), id=None))),
+        ('find_order', None, lambda: service.find_order(draft_id())),
+        ('confirm_order', None, lambda: service.confirm_order(draft_id())),
+        ('page_final_orders', None, lambda: service.page_final_orders(limit=50)),
+        ('page_final_orders.q', None, lambda: service.page_final_orders(limit=50, q='nguyen van an')),
+        ('get_all_orders', HEAVY, lambda: service.get_all_orders()),
+        ('get_confirmed_orders', HEAVY, lambda: service.get_confirmed_orders()),
+        # history
+        ('history.add_message', None, lambda: history.add_message(user_id(), 'user', new_message())),
+        ('history.get_history.user', None, lambda: history.get_history(user_id())),
+        ('history.get_history_page.user', None, lambda: history.get_history_page(user_id(), limit=50)),
+        ('history.get_history_page.q', None, lambda: history.get_history_page(q='tiramisu', limit=50)),
+        ('history.search', None, lambda: history.search_history('bánh tiramisu')),
+        ('history.search.user', None, lambda: history.search_history('banh', user_id=user_id())),
+        ('history.search.recent', None, lambda: history.search_history('xac nhan', sort='recent')),
+        ('history.get_history.all', HEAVY, lambda: history.get_history()),
+        # endpoint qua ASGI (không qua mạng)
+        ('POST /chatbot/process', None,
+         lambda: client.post('/chatbot/process', json={'message': new_message(), 'user_id': 'bench'})),
+        ('POST /chatbot/process (update)', None,
+         lambda: client.post('/chatbot/process', json={'message': new_message(), 'order_id': draft_id()})),
+        ('POST /chatbot/confirm', None, lambda: client.post('/chatbot/confirm', json={'order_id': draft_id()})),
+        ('GET /chatbot/orders-final', None, lambda: client.get('/chatbot/orders-final', params={'limit': 50})),
+        ('POST /history/', None,
+         lambda: client.post('/history/', json={'user_id': user_id(), 'role': 'user', 'content': new_message()})),
+        ('GET /history/?user_id', None, lambda: client.get('/history/', params={'user_id': user_id()})),
+        ('GET /history/?user_id&limit', None,
+         lambda: client.get('/history/', params={'user_id': user_id(), 'limit': 50})),
+        ('GET /history/search', None, lambda: client.get('/history/search', params={'q': 'banh kem bap'})),
+        ('GET /chatbot/confirmed-orders', HEAVY, lambda: client.get('/chatbot/confirmed-orders')),
+    ]
+
+
+async def run_worker(args) -> Dict[str, Any]:
+    os.environ.update({
+        'DATA_DIR': args.data_dir,
+        'OPENAI_API_KEY': 'sk-bench',
+        # không để scheduler giới hạn tốc độ: chỉ đo code của mình
+        'LLM_RPM': '1e9',
+        'LLM_TPM': '1e12',
+        'LLM_QUEUE_SIZE': '100000',
+        'SLOW_REQUEST_SECONDS': '1e9',
+    })
+    os.environ.pop('EXTRACTION_CACHE_PATH', None)
+    if args.storage:
+        os.environ['STORAGE_BACKEND'] = args.storage
+
+    import fastapi  # noqa: F401  (import thư viện trước để load_seconds chỉ tính phần mở kho)
+    import httpx
+    import openai  # noqa: F401
+    from bench.fake_openai import StubAsyncOpenAI
+
+    # mở kho = import file JSON cũ sang log (giống lần chạy đầu trên dữ liệu thật)
+    start = time.perf_counter()
+    from main import app
+    from app.api.chatbot import routes
+    from app.api.history import services as history
+    from app.storage.factory import get_backend
+    get_backend().history()
+    load_seconds = time.perf_counter() - start
+    rss_after_load = _peak_rss_mb()
+    # dựng chỉ mục tìm kiếm lịch sử (lần tìm đầu tiên)
+    start = time.perf_counter()
+    await history.search_history('banh')
+    search_index_seconds = time.perf_counter() - start
+
+    service = routes.chatbot_service
+    service.client = StubAsyncOpenAI()
+    rng = random.Random(args.seed)
+    results: Dict[str, Dict[str, float]] = {}
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://bench') as client:
+            for name, kind, func in _benchmarks(service, history, client, args.size, rng):
+                if args.only and not any(part in name for part in args.only.split(',')):
+                    continue
+                if kind == HEAVY and args.skip_heavy:
+                    continue
+                repeat = args.heavy_repeat if kind == HEAVY else args.repeat
+                results[name] = await measure(func, repeat)
+                print(f"  {name:<36} {results[name]['ops_per_sec']:>10.1f} ops/s "
+                      f"p50 {results[name]['p50_ms']:>8.3f} ms  p99 {results[name]['p99_ms']:>8.3f} ms",
+                      file=sys.stderr, flush=True)
+    finally:
+        await service.aclose()
+
+    return {
+        'load_seconds': load_seconds,
+        'peak_rss_after_load_mb': rss_after_load,
+        'search_index_seconds': search_index_seconds,
+        'peak_rss_mb': _peak_rss_mb(),
+        'benchmarks': results
+    }
+
+
+# ----------------------------------------------------------------------
+# Điều phối: sinh dữ liệu, chạy worker cho từng cỡ, lưu / so sánh kết quả
+# ----------------------------------------------------------------------
+def run_size(size: int, args) -> Dict[str, Any]:
+    data_dir = tempfile.mkdtemp(prefix=f'bakery_bench_{size}_')
+    try:
+        start = time.perf_counter()
+        files = generate(data_dir, size, args.seed)
+        print(f"[{size}] generated {sum(files.values()) / 1e6:.1f} MB in {time.perf_counter() - start:.1f}s",
+              file=sys.stderr, flush=True)
+
+        command = [sys.executable, '-m', 'bench.suite', '--worker', '--size', str(size), '--data-dir', data_dir,
+                   '--repeat', str(args.repeat), '--heavy-repeat', str(args.heavy_repeat), '--seed', str(args.seed)]
+        if args.only:
+            command += ['--only', args.only]
+        if args.skip_heavy:
+            command.append('--skip-heavy')
+        if args.storage:
+            command += ['--storage', args.storage]
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [BE_DIR, os.getenv('PYTHONPATH')])))
+        output = subprocess.run(command, cwd=BE_DIR, env=env, stdout=subprocess.PIPE, check=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        result['dataset_bytes'] = files
+        print(f"[{size}] load {result['load_seconds']:.1f}s, search index {result.get('search_index_seconds', 0):.1f}s, "
+              f"peak RSS {result['peak_rss_mb']:.0f} MB",
+              file=sys.stderr, flush=True)
+        return result
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def compare(before_path: str, after_path: str, threshold: float) -> int:
+    with open(before_path, encoding='utf-8') as f:
+        before = json.load(f)
+    with open(after_path, encoding='utf-8') as f:
+        after = json.load(f)
+
+    print(f"before: {before['meta'].get('commit')}  after: {after['meta'].get('commit')}")
+    regressions = 0
+    for size, result in after['results'].items():
+        base = before['results'].get(size)
+        if not base:
+            continue
+        print(f"\nsize {size}: peak RSS {base['peak_rss_mb']:.0f} -> {result['peak_rss_mb']:.0f} MB, "
+              f"load {base['load_seconds']:.2f} -> {result['load_seconds']:.2f}s")
+        print(f"{'benchmark':<36} {'ops/s before':>12} {'ops/s after':>12} {'change':>8} {'p99 change':>10}")
+        for name, row in result['benchmarks'].items():
+            old = base['benchmarks'].get(name)
+            if not old:
+                continue
+            change = row['ops_per_sec'] / old['ops_per_sec'] - 1
+            p99_change = row['p99_ms'] / old['p99_ms'] - 1 if old['p99_ms'] else 0.0
+            flag = ''
+            if change < -threshold:
+                flag = '  <-- regression'
+                regressions += 1
+            print(f"{name:<36} {old['ops_per_sec']:>12.1f} {row['ops_per_sec']:>12.1f} "
+                  f"{change:>+8.1%} {p99_change:>+10.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1000,100000,1000000')
+    parser.add_argument('--repeat', type=int, default=200, help="số lần chạy mỗi benchmark")
+    parser.add_argument('--heavy-repeat', type=int, default=3, help="số lần chạy các benchmark đọc toàn bộ dữ liệu")
+    parser.add_argument('--skip-heavy', action='store_true')
+    parser.add_argument('--only', help="chỉ chạy benchmark có tên chứa 1 trong các chuỗi (phân cách bằng dấu phẩy)")
+    parser.add_argument('--storage', choices=['json', 'sqlite'], help="STORAGE_BACKEND (mặc định theo môi trường)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help="file JSON kết quả (mặc định bench/results/suite-<commit>.json)")
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help="so sánh 2 file kết quả")
+    parser.add_argument('--threshold', type=float, default=0.1, help="ngưỡng báo regression ops/sec khi so sánh")
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--size', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--data-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare, args.threshold) else 0)
+
+    if args.worker:
+        print(json.dumps(asyncio.run(run_worker(args))))
+        return
+
+    commit = _git_commit()
+    report = {
+        'meta': {
+            'commit': commit,
+            'timestamp': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'storage': args.storage or os.getenv('STORAGE_BACKEND') or 'json',
+            'repeat': args.repeat
+        },
+        'results': {}
+    }
+    for size in (int(s) for s in args.sizes.split(',')):
+        report['results'][str(size)] = run_size(size, args)
+
+    out = args.out or os.path.join(RESULTS_DIR, f"suite-{commit or 'local'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"saved {out}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,6 +5,7 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.api.history.routes import router as history_router
 from app.api.chatbot.routes import router as chatbot_router
+from app.api.metrics.routes import RequestMetricsMiddleware, router as metrics_router
 
 app = FastAPI(title="AI Agent Chatbot")
 
@@ -15,10 +16,13 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID", "Server-Timing"],
 )
+app.add_middleware(RequestMetricsMiddleware)
 
 app.include_router(history_router)
 app.include_router(chatbot_router)
+app.include_router(metrics_router)
 
 if __name__ == "__main__":
     import uvicorn
@@ -3,51 +3,88 @@ import { Users, Package, Clock, TrendingUp, Download, Search, Filter } from 'luc
 import './admin.css';
 
 const API_BASE_URL = 'http://localhost:8000';
+const PAGE_SIZE = 50;
 
 const Admin = () => {
   const [customerData, setCustomerData] = useState([]);
   const [searchTerm, setSearchTerm] = useState('');
   const [filterStatus, setFilterStatus] = useState('all');
   const [sortBy, setSortBy] = useState('date');
+  const [nextCursor, setNextCursor] = useState(null);
+  const [stats, setStats] = useState({ total_orders: 0, status_counts: {} });
+  const [loading, setLoading] = useState(false);
 
-  useEffect(() => {
-    const fetchOrders = async () => {
-      try {
-        const res = await fetch(`${API_BASE_URL}/chatbot/orders-final`);
-        const data = await res.json();
+  const mapOrder = (order, idx) => {
+    const orderType = order.danh_sach_banh && order.danh_sach_banh.length > 0
+      ? order.danh_sach_banh.map(b => b.ten_banh).join(', ')
+      : '';
+    const quantity = order.danh_sach_banh && order.danh_sach_banh.length > 0
+      ? order.danh_sach_banh.reduce((sum, b) => sum + (b.so_luong || 0), 0)
+      : 0;
 
-        const mapped = data.map((order, idx) => {
-          const orderType = order.danh_sach_banh && order.danh_sach_banh.length > 0
-            ? order.danh_sach_banh.map(b => b.ten_banh).join(', ')
-            : '';
-          const quantity = order.danh_sach_banh && order.danh_sach_banh.length > 0
-            ? order.danh_sach_banh.reduce((sum, b) => sum + (b.so_luong || 0), 0)
-            : 0;
+    return {
+      id: order.id || idx + 1,
+      customerName: order.ten_khach_hang || '',
+      phone: order.so_dien_thoai || '',
+      orderType: orderType,
+      quantity: quantity,
+      price: order.tong_tien || 0, 
+      gio_giao: order.gio_giao || '', 
+      address: order.dia_chi || '',
+      status: order.status || 'pending', 
+      notes: order.ghi_chu || '',
+      confirmedAt: order.confirmed_at || '',
+      danh_sach_banh: order.danh_sach_banh || []
+    };
+  };
 
-          return {
-            id: order.id || idx + 1,
-            customerName: order.ten_khach_hang || '',
-            phone: order.so_dien_thoai || '',
-            orderType: orderType,
-            quantity: quantity,
-            price: order.tong_tien || 0, 
-            gio_giao: order.gio_giao || '', 
-            address: order.dia_chi || '',
-            status: order.status || 'pending', 
-            notes: order.ghi_chu || '',
-            danh_sach_banh: order.danh_sach_banh || []
-          };
-        });
+  // Lọc / sắp xếp / phân trang ở server, mỗi lần chỉ tải PAGE_SIZE đơn
+  const fetchOrders = async (cursor = null) => {
+    const params = new URLSearchParams({
+      limit: PAGE_SIZE,
+      sort: sortBy === 'name' ? 'name' : 'confirmed_at',
+      order: sortBy === 'name' ? 'asc' : 'desc'
+    });
+    if (filterStatus !== 'all') params.append('status', filterStatus);
+    if (searchTerm.trim()) params.append('q', searchTerm.trim());
+    if (cursor) params.append('cursor', cursor);
 
-        setCustomerData(mapped);
-      } catch (err) {
-        setCustomerData([]);
-      }
-    };
+    setLoading(true);
+    try {
+      const res = await fetch(`${API_BASE_URL}/chatbot/orders-final?${params.toString()}`);
+      const data = await res.json();
+      const mapped = data.items.map(mapOrder);
+
+      setCustomerData(prev => (cursor ? [...prev, ...mapped] : mapped));
+      setNextCursor(data.next_cursor);
+    } catch (err) {
+      if (!cursor) setCustomerData([]);
+      setNextCursor(null);
+    } finally {
+      setLoading(false);
+    }
+  };
+
+  // Số liệu tổng lấy từ /chatbot/stats (bộ đếm ở server), không phụ thuộc trang đang tải
+  const fetchStats = async () => {
+    try {
+      const res = await fetch(`${API_BASE_URL}/chatbot/stats`);
+      if (res.ok) setStats(await res.json());
+    } catch (err) {
+      // giữ số liệu cũ
+    }
+  };
 
-    fetchOrders();
+  useEffect(() => {
+    fetchStats();
   }, []);
 
+  useEffect(() => {
+    const timer = setTimeout(() => fetchOrders(), 300);
+    return () => clearTimeout(timer);
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [searchTerm, filterStatus, sortBy]);
+
   const getStatusColor = (status) => {
     switch (status) {
       case 'pending': return 'status-pending';
@@ -66,30 +103,13 @@ const Admin = () => {
     }
   };
 
-  const filteredData = customerData.filter(item => {
-    const matchesSearch = item.customerName.toLowerCase().includes(searchTerm.toLowerCase()) ||
-                         item.phone.includes(searchTerm) ||
-                         item.orderType.toLowerCase().includes(searchTerm.toLowerCase());
-    const matchesFilter = filterStatus === 'all' || item.status === filterStatus;
-    return matchesSearch && matchesFilter;
-  });
-
-  const sortedData = [...filteredData].sort((a, b) => {
-    switch (sortBy) {
-      case 'date':
-        return new Date(b.timestamp) - new Date(a.timestamp);
-      case 'price':
-        return b.price - a.price;
-      case 'name':
-        return a.customerName.localeCompare(b.customerName);
-      default:
-        return 0;
-    }
-  });
+  const sortedData = customerData;
 
+  const statusCounts = stats.status_counts || {};
+  const totalOrders = stats.total_orders || 0;
   const totalRevenue = customerData.reduce((sum, item) => sum + item.price, 0);
-  const completedOrders = customerData.filter(item => item.status === 'completed').length;
-  const pendingOrders = customerData.filter(item => item.status === 'pending').length;
+  const completedOrders = statusCounts.completed || 0;
+  const pendingOrders = statusCounts.pending || 0;
 
   const formatCurrency = (amount) => {
     return new Intl.NumberFormat('vi-VN', {
@@ -102,26 +122,14 @@ const Admin = () => {
     return new Date(dateString).toLocaleDateString('vi-VN');
   };
 
+  // File CSV được server stream về theo bộ lọc hiện tại, trình duyệt không phải giữ toàn bộ đơn
   const exportToCSV = () => {
-    const headers = ['Tên khách hàng', 'Số điện thoại', 'Loại bánh', 'Số lượng', 'Giá', 'Giờ giao', 'Địa chỉ', 'Trạng thái', 'Ghi chú'];
-    const csvContent = [
-      headers.join(','),
-      ...sortedData.map(row => [
-        row.customerName,
-        row.phone,
-        row.orderType,
-        row.quantity,
-        row.price,
-        row.gio_giao,
-        `"${row.address}"`,
-        getStatusText(row.status),
-        `"${row.notes}"`
-      ].join(','))
-    ].join('\n');
+    const params = new URLSearchParams({ format: 'csv' });
+    if (filterStatus !== 'all') params.append('status', filterStatus);
+    if (searchTerm.trim()) params.append('q', searchTerm.trim());
 
-    const blob = new Blob([csvContent], { type: 'text/csv;charset=utf-8;' });
     const link = document.createElement('a');
-    link.href = URL.createObjectURL(blob);
+    link.href = `${API_BASE_URL}/chatbot/orders-final/export?${params.toString()}`;
     link.download = 'bakery_orders.csv';
     link.click();
   };
@@ -139,7 +147,7 @@ const Admin = () => {
             <Package />
           </div>
           <div className="stat-content">
-            <h3>{customerData.length}</h3>
+            <h3>{totalOrders}</h3>
             <p>Tổng đơn hàng</p>
           </div>
         </div>
@@ -206,7 +214,6 @@ const Admin = () => {
               onChange={(e) => setSortBy(e.target.value)}
             >
               <option value="date">Sắp xếp theo thời gian</option>
-              <option value="price">Sắp xếp theo giá</option>
               <option value="name">Sắp xếp theo tên</option>
             </select>
           </div>
@@ -293,6 +300,14 @@ const Admin = () => {
         </table>
       </div>
 
+      {nextCursor && (
+        <div className="load-more">
+          <button className="export-btn" onClick={() => fetchOrders(nextCursor)} disabled={loading}>
+            <span>{loading ? 'Đang tải...' : 'Tải thêm'}</span>
+          </button>
+        </div>
+      )}
+
       {sortedData.length === 0 && (
         <div className="no-data">
           <p>Không tìm thấy dữ liệu phù hợp</p>
@@ -7,6 +7,7 @@ const Homepage = () => {
   const [messages, setMessages] = useState([]);
   const [inputMessage, setInputMessage] = useState('');
   const [isTyping, setIsTyping] = useState(false);
+  const [streamStatus, setStreamStatus] = useState(''); // Tiến trình xử lý nhận từ SSE
   const [currentOrderId, setCurrentOrderId] = useState(null); // Lưu order ID hiện tại
   const [userId] = useState('user_' + Math.random().toString(36).substr(2, 9)); // Tạo user ID ngẫu nhiên
   const messagesEndRef = useRef(null);
@@ -85,7 +86,7 @@ const Homepage = () => {
         
         if (isConfirmation && currentOrderId) {
           // Xác nhận đơn hàng
-          const confirmResult = await chatbotService.confirmOrder(currentOrderId);
+          const confirmResult = await chatbotService.confirmOrder(currentOrderId, userId);
           if (confirmResult.success) {
             botResponseContent = confirmResult.message;
             setCurrentOrderId(null); // Reset order ID sau khi xác nhận
@@ -93,8 +94,24 @@ const Homepage = () => {
             botResponseContent = '❌ Không thể xác nhận đơn hàng. Vui lòng thử lại!';
           }
         } else {
-          // Xử lý tin nhắn thông thường
-          const processResult = await chatbotService.processMessage(inputMessage, currentOrderId);
+          // Xử lý tin nhắn thông thường (stream tiến trình qua SSE)
+          const fieldLabels = {
+            ten_khach_hang: 'tên khách hàng',
+            so_dien_thoai: 'số điện thoại',
+            danh_sach_banh: 'danh sách bánh',
+            dia_chi: 'địa chỉ',
+            gio_giao: 'giờ giao'
+          };
+          const processResult = await chatbotService.processMessageStream(inputMessage, currentOrderId, (event, data) => {
+            if (event === 'started') {
+              setStreamStatus('Đang phân tích tin nhắn...');
+            } else if (event === 'field' && fieldLabels[data.name] && data.value && data.value.length !== 0) {
+              setStreamStatus(`Đã nhận ${fieldLabels[data.name]}...`);
+            } else if (event === 'completeness') {
+              setStreamStatus(data.is_complete ? 'Đơn hàng đã đủ thông tin' : 'Đang kiểm tra thông tin còn thiếu...');
+            }
+          }, userId);
+          setStreamStatus('');
           
           if (processResult.success) {
             botResponseContent = processResult.message;
@@ -222,6 +239,7 @@ const Homepage = () => {
                   <span></span>
                   <span></span>
                 </div>
+                {streamStatus && <div className="typing-status">{streamStatus}</div>}
               </div>
             </div>
           </div>
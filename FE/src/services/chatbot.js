@@ -52,7 +52,7 @@ export const historyService = {
 // Service cho chatbot
 export const chatbotService = {
   // Xử lý tin nhắn với logic đầy đủ (API mới)
-  async processMessage(userInput, orderId = null) {
+  async processMessage(userInput, orderId = null, userId = null) {
     try {
       const response = await fetch(`${API_BASE_URL}/chatbot/process`, {
         method: 'POST',
@@ -61,7 +61,8 @@ export const chatbotService = {
         },
         body: JSON.stringify({ 
           message: userInput,
-          order_id: orderId 
+          order_id: orderId,
+          user_id: userId
         }),
       });
 
@@ -76,15 +77,88 @@ export const chatbotService = {
     }
   },
 
+  // Xử lý tin nhắn qua SSE: gọi onEvent(event, data) cho từng bước
+  // (started, field, completeness, result), trả về kết quả cùng dạng với processMessage
+  async processMessageStream(userInput, orderId = null, onEvent = () => {}, userId = null) {
+    try {
+      const response = await fetch(`${API_BASE_URL}/chatbot/process/stream`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+          'Accept': 'text/event-stream',
+        },
+        body: JSON.stringify({
+          message: userInput,
+          order_id: orderId,
+          user_id: userId
+        }),
+      });
+
+      if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+      }
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder('utf-8');
+      let buffer = '';
+      let result = null;
+
+      const handleBlock = (block) => {
+        let event = 'message';
+        const dataLines = [];
+        block.split('\n').forEach(line => {
+          if (line.startsWith('event:')) {
+            event = line.slice(6).trim();
+          } else if (line.startsWith('data:')) {
+            dataLines.push(line.slice(5).trim());
+          }
+        });
+        if (dataLines.length === 0) return;
+
+        const data = JSON.parse(dataLines.join('\n'));
+        if (event === 'result') {
+          result = data;
+        }
+        onEvent(event, data);
+      };
+
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+
+        buffer += decoder.decode(value, { stream: true });
+        let boundary = buffer.indexOf('\n\n');
+        while (boundary !== -1) {
+          handleBlock(buffer.slice(0, boundary));
+          buffer = buffer.slice(boundary + 2);
+          boundary = buffer.indexOf('\n\n');
+        }
+      }
+
+      if (!result) {
+        throw new Error('Stream ended without result');
+      }
+
+      return {
+        success: true,
+        data: result,
+        message: result.message || 'Processed successfully'
+      };
+    } catch (error) {
+      console.error('Error processing message stream:', error);
+      throw error;
+    }
+  },
+
   // Xác nhận đơn hàng
-  async confirmOrder(orderId) {
+  async confirmOrder(orderId, userId = null) {
     try {
       const response = await fetch(`${API_BASE_URL}/chatbot/confirm`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
         },
-        body: JSON.stringify({ order_id: orderId }),
+        body: JSON.stringify({ order_id: orderId, user_id: userId }),
       });
 
       if (!response.ok) {